@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+import shelve
+import argparse
+import numpy as np
+
+from time import time
+
+from cls.coactive import CoactiveLearning
+from cls.replay import SolverRecord, ReplayDomain, ReplayFeedback
+from cls.rooms import Rooms
+from cls.solver import solver_stats
+from cls.users import RoomsCoactiveFeedback, TablesCoactiveFeedback
+from main import LEARNERS
+
+
+def _solves(record):
+    """The solver calls so far, counting the answers replayed as calls."""
+    if record is None:
+        return solver_stats.calls
+    hits = sum(n for kind, n in record.stats.items() if kind.endswith('_hits'))
+    return solver_stats.calls + hits
+
+
+def run_learner(domain, users, learner, max_iters, timeout, seed, alpha=0.1,
+                record=None):
+    """Simulates the users with a learner, returns the per-iteration costs.
+
+    The record, if given, should be the learner's own, so that the seconds
+    of the learners are comparable. The answers it replays are counted as
+    solver calls.
+
+    Returns
+    -------
+    numpy.ndarray
+        The (num_users, max_iters, 3) array of the regrets, the cumulative
+        solver calls and the cumulative wall-clock time of each iteration.
+        The iterations after a user is satisfied keep its last values.
+    """
+    if isinstance(domain, Rooms):
+        feedback_class = RoomsCoactiveFeedback
+    else:
+        feedback_class = TablesCoactiveFeedback
+    if record is not None:
+        domain = ReplayDomain(domain, record)
+
+    costs = np.full((len(users), max_iters, 3), np.nan)
+    for i, user in enumerate(users):
+        user_model = feedback_class(domain, user, alpha=alpha)
+        if record is not None:
+            user_model = ReplayFeedback(user_model, record)
+        model = CoactiveLearning(domain, LEARNERS[learner](), seed=seed)
+        calls0, t0 = _solves(record), time()
+        simulation = model.simulate(user_model, max_iters=max_iters,
+                                    timeout=timeout, stop_on_satisfied=True)
+        for it, (reg, _, _) in enumerate(simulation):
+            costs[i, it] = reg, _solves(record) - calls0, time() - t0
+        last = np.where(~np.isnan(costs[i, :, 0]))[0]
+        if len(last):
+            costs[i, last[-1] + 1:] = costs[i, last[-1]]
+    return costs
+
+
+def to_target(costs, target):
+    """The mean iterations, solver calls and seconds to reach the regret.
+
+    Users never reaching the target count with their total cost.
+    """
+    reached = costs[:, :, 0] <= target
+    its = np.where(reached.any(axis=1), reached.argmax(axis=1),
+                   costs.shape[1] - 1)
+    rows = np.arange(costs.shape[0])
+    return (its.mean() + 1, costs[rows, its, 1].mean(),
+            costs[rows, its, 2].mean())
+
+
+if __name__ == '__main__':
+    fmt_class = argparse.ArgumentDefaultsHelpFormatter
+    parser = argparse.ArgumentParser(formatter_class=fmt_class)
+
+    parser.add_argument('-D', '--domain-shelf',
+                        default='domains/tables_n8.pickle',
+                        help='The file containing the domain to use')
+    parser.add_argument('-U', '--user-shelf',
+                        default='users/user_tables_s1_n8.pickle',
+                        help='The file containing the users')
+    parser.add_argument('-L', '--learners', nargs='+',
+                        default=list(LEARNERS.keys()),
+                        choices=list(LEARNERS.keys()),
+                        help='The learners to compare')
+    parser.add_argument('-n', '--num-users', type=int, default=5,
+                        help='The number of users to simulate')
+    parser.add_argument('-T', '--max-iters', type=int, default=30,
+                        help='The maximum number of iterations per user')
+    parser.add_argument('--timeout', type=int, default=600,
+                        help='The timeout of the inferences')
+    parser.add_argument('--target', type=float, default=0.1,
+                        help='The regret target')
+    parser.add_argument('--replay',
+                        help=('The prefix of the stores of solver answers, '
+                              'one per learner, so that the reruns of the '
+                              'benchmark solve only the new layouts'))
+    parser.add_argument('-a', '--alpha', type=float, default=0.1,
+                        help='The alpha value of the users')
+    parser.add_argument('-s', '--seed', type=int, default=0,
+                        help='The seed of the initial weights')
+    args = parser.parse_args()
+
+    with shelve.open(args.domain_shelf, 'r') as shelf:
+        domain = shelf['domain']
+    with shelve.open(args.user_shelf, 'r') as shelf:
+        users = shelf['users'][:args.num_users]
+
+    header = '{:>6} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'
+    row = '{:>6} {:>10.3f} {:>10.3f} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}'
+    print(header.format('', 'reg@end', 'reg@auc', 'its', 'calls', 'secs',
+                        'calls/reg'))
+    for learner in args.learners:
+        # Each learner has its own answers, a shared store would serve the
+        # later learners the layouts solved for the earlier ones
+        record = (SolverRecord('{}.{}'.format(args.replay, learner))
+                  if args.replay else None)
+        try:
+            costs = run_learner(domain, users, learner, args.max_iters,
+                                args.timeout, args.seed, args.alpha, record)
+        finally:
+            if record is not None:
+                record.close()
+        reg = np.nanmean(costs[:, :, 0], axis=0)
+        its, calls, secs = to_target(costs, args.target)
+        # Solver calls per unit of regret removed from the first iteration
+        gain = reg[0] - reg[-1]
+        per_reg = np.nanmean(costs[:, -1, 1]) / gain if gain > 0 \
+            else np.nan
+        print(row.format(learner, reg[-1], reg.mean(), its, calls, secs,
+                         per_reg))
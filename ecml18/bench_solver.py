@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import shelve
+import argparse
+import numpy as np
+
+from time import time
+from sklearn.utils import check_random_state
+
+from cls.solver import dzn, set_scratch_io
+from cls.rooms import Rooms
+from cls.tables import Tables
+
+
+def bench_dzn(data, repeat):
+    """Per-call time of the pymzn and the cls.solver dzn serializers."""
+    import pymzn
+    t0 = time()
+    for _ in range(repeat):
+        pymzn.dict2dzn(data)
+    t_pymzn = (time() - t0) / repeat
+    t0 = time()
+    for _ in range(repeat):
+        dzn(data)
+    t_fast = (time() - t0) / repeat
+    return t_pymzn, t_fast
+
+
+def bench_calls(domain, contexts, ws, scratch):
+    """Per-call time of phi and infer, with or without the scratch I/O."""
+    set_scratch_io(scratch)
+    t_phi, t_infer = [], []
+    for x, w in zip(contexts, ws):
+        t0 = time()
+        y = domain.infer(x, w)
+        t_infer.append(time() - t0)
+        domain._phis = {}
+        t0 = time()
+        domain.phi(x, y)
+        t_phi.append(time() - t0)
+    return np.mean(t_phi), np.mean(t_infer)
+
+
+if __name__ == '__main__':
+    fmt_class = argparse.ArgumentDefaultsHelpFormatter
+    parser = argparse.ArgumentParser(formatter_class=fmt_class)
+
+    parser.add_argument('-D', '--domain-shelf',
+                        help='The file containing the domain to use')
+    parser.add_argument('-d', '--domain', choices=['Tables', 'Rooms'],
+                        default='Tables',
+                        help='The domain to generate, if no shelf is given')
+    parser.add_argument('-n', '--num-calls', type=int, default=20,
+                        help='The number of solver calls per measure')
+    parser.add_argument('-s', '--seed', type=int, default=0,
+                        help='The seed for RNG')
+    args = parser.parse_args()
+
+    def load_domain():
+        if args.domain_shelf:
+            with shelve.open(args.domain_shelf, 'r') as shelf:
+                return shelf['domain']
+        return {'Tables': Tables, 'Rooms': Rooms}[args.domain](seed=args.seed)
+
+    domain = load_domain()
+    rng = check_random_state(args.seed)
+    contexts = [domain.draw_context(None, i) for i in range(args.num_calls)]
+    ws = [rng.normal(size=domain.num_features) for _ in contexts]
+
+    t_pymzn, t_fast = bench_dzn({**contexts[0], 'w': ws[0]}, 1000)
+    print('dzn serialization: pymzn = {:.1f}us, cls = {:.1f}us'
+          .format(t_pymzn * 1e6, t_fast * 1e6))
+
+    for scratch in [False, True]:
+        # A fresh domain, so that no pass reuses the caches of the other
+        t_phi, t_infer = bench_calls(load_domain(), contexts, ws, scratch)
+        print('scratch io = {!s:>5}: phi = {:.3f}s, infer = {:.3f}s per call'
+              .format(scratch, t_phi, t_infer))
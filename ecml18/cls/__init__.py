@@ -1,6 +1,24 @@
+import os
+import sys
+
+# The solver pool and governor are shared by the packages of the repository,
+# see solverkit at its root
+_root = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if _root not in sys.path:
+    sys.path.append(_root)
+
+from .budget import *
 from .coactive import *
 from .domain import *
+from .events import *
+from .governor import *
+from .replay import *
 from .rooms import *
+from .service import *
+from .solutions import *
+from .solver import *
+from .stopping import *
 from .tables import *
+from .topk import *
 from .users import *
 from .utils import *
@@ -0,0 +1,285 @@
+# -*- encoding: utf-8 -*-
+
+import hashlib
+import threading
+import numpy as np
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from cls.utils import freeze
+
+
+__all__ = ['COST_FIELDS', 'CostLedger', 'cost_ledger', 'cost_scope',
+           'current_scope', 'context_key', 'CostBudget', 'budgeted_infer',
+           'cost_report']
+
+
+""" Solver cost accounting
+
+Every solver call is charged to the cost ledger, under the scope of the
+thread making it: the user, the context (a digest of the context x, so that
+the iterations drawing the same context share its costs) and the phase of the
+simulation ('infer', 'improve', 'regret', 'phi'). The experiment
+is the run as a whole, e.g. the output shelf of a simulation. The costs are
+the solver launches, their wall-clock seconds, their CPU-seconds and the
+launches that ran up to their timeout.
+
+The CPU-seconds of a call are its wall-clock time times the cores it holds,
+i.e. the tokens granted by the governor, or its `parallel` argument: the
+solvers run on worker processes whose own resource usage is not visible
+here, and a solve keeps its cores busy, or reserved, for its whole duration.
+
+A `CostBudget` caps the CPU-seconds of each user, of each context and of the
+experiment. The inferences close to a cap get a shorter timeout, and once a
+cap is spent they degrade to approximate inferences: the best layout of the
+context in the solution pool of the learner if any, else a solve with the
+minimum timeout. The solves of
+the simulated users (improvements, regrets) are accounted but not capped, as
+they are part of the experiment being measured.
+"""
+
+
+# launches, wall-clock seconds, CPU-seconds and launches ending at the timeout
+COST_FIELDS = ['launches', 'wall', 'cpu', 'timeouts']
+
+_scopes = threading.local()
+
+
+def current_scope():
+    """The scope of the solver calls of this thread, a dictionary."""
+    return getattr(_scopes, 'scope', {})
+
+
+@contextmanager
+def cost_scope(**scope):
+    """Charges the solver calls of this thread in the block to the scope.
+
+    The given keys ('user', 'context', 'phase') override those of the
+    enclosing scope, the others are inherited.
+    """
+    outer = current_scope()
+    _scopes.scope = {**outer, **scope}
+    try:
+        yield _scopes.scope
+    finally:
+        _scopes.scope = outer
+
+
+def context_key(x):
+    """A short digest identifying the context x in the ledger."""
+    data = repr(sorted(freeze(x), key=lambda item: item[0]))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:8]
+
+
+class CostLedger(object):
+    """The costs of the solver calls, by user, context and phase.
+
+    Attributes
+    ----------
+    experiment : str
+        The name of the experiment, reported with the costs.
+    costs : dict
+        The costs (see `COST_FIELDS`) of each (user, context, phase), users
+        and contexts being None for the calls made outside of a simulation.
+    """
+    def __init__(self, experiment=None):
+        self.experiment = experiment
+        self.costs = defaultdict(lambda: np.zeros(len(COST_FIELDS)))
+        self._users = defaultdict(lambda: np.zeros(len(COST_FIELDS)))
+        self._spent = Counter()
+        self._lock = threading.Lock()
+
+    def charge(self, wall, cores=1, timeout=None):
+        """Charges a solver call to the scope of the calling thread.
+
+        Parameters
+        ----------
+        wall : float
+            The wall-clock time of the call, in seconds.
+        cores : int
+            The cores held by the call.
+        timeout : float
+            The timeout of the call, if any.
+        """
+        scope = current_scope()
+        user, context = scope.get('user'), scope.get('context')
+        key = (user, context, scope.get('phase'))
+        cpu = wall * cores
+        timed_out = bool(timeout) and wall >= timeout
+        with self._lock:
+            self.costs[key] += [1, wall, cpu, timed_out]
+            self._users[user] += [1, wall, cpu, timed_out]
+            self._spent['experiment'] += cpu
+            self._spent['user', user] += cpu
+            self._spent['context', user, context] += cpu
+
+    def spent(self, user=None, context=None):
+        """The CPU-seconds of a context of a user, of a user, or in total."""
+        with self._lock:
+            if context is not None:
+                return self._spent['context', user, context]
+            if user is not None:
+                return self._spent['user', user]
+            return self._spent['experiment']
+
+    def user_total(self, user):
+        """The total costs of a user so far, see `COST_FIELDS`."""
+        with self._lock:
+            costs = self._users[user].copy()
+        return dict(zip(COST_FIELDS, costs.tolist()))
+
+    def summary(self, by):
+        """The total costs grouped by 'user', 'context' or 'phase'.
+
+        Returns
+        -------
+        dict
+            The costs of each group, as dictionaries of `COST_FIELDS`. The
+            groups of the contexts are (user, context) pairs.
+        """
+        groups = defaultdict(lambda: np.zeros(len(COST_FIELDS)))
+        with self._lock:
+            for (user, context, phase), costs in self.costs.items():
+                group = {'user': user, 'context': (user, context),
+                         'phase': phase}[by]
+                groups[group] += costs
+        return {group: dict(zip(COST_FIELDS, costs.tolist()))
+                for group, costs in groups.items()}
+
+    def total(self):
+        """The total costs of the experiment, see `COST_FIELDS`."""
+        with self._lock:
+            costs = sum(self.costs.values(), np.zeros(len(COST_FIELDS)))
+        return dict(zip(COST_FIELDS, costs.tolist()))
+
+    def reset(self, experiment=None):
+        with self._lock:
+            self.experiment = experiment
+            self.costs.clear()
+            self._users.clear()
+            self._spent.clear()
+
+
+cost_ledger = CostLedger()
+
+
+class CostBudget(object):
+    """Caps on the CPU-seconds of the inferences, see `budgeted_infer`.
+
+    Parameters
+    ----------
+    user : float
+        The CPU-seconds of each user, 0 for no cap.
+    context : float
+        The CPU-seconds of each context of a user, 0 for no cap.
+    experiment : float
+        The CPU-seconds of the experiment, 0 for no cap.
+    min_timeout : float
+        The timeout of the inferences once a cap is spent, and the minimum
+        timeout of those close to a cap.
+    ledger : CostLedger
+        The ledger of the costs, `cost_ledger` by default.
+
+    Attributes
+    ----------
+    stats : collections.Counter
+        The number of inferences with a shortened timeout ('capped'), those
+        answered by the solution pool ('pooled') and those solved with the
+        minimum timeout ('approximate').
+    """
+    def __init__(self, user=0.0, context=0.0, experiment=0.0, min_timeout=10,
+                 ledger=None):
+        self.user = user
+        self.context = context
+        self.experiment = experiment
+        self.min_timeout = min_timeout
+        self.ledger = ledger if ledger is not None else cost_ledger
+        self.stats = Counter()
+
+    def remaining(self, user=None, context=None):
+        """The CPU-seconds left to the tightest cap of a context of a user."""
+        left = [np.inf]
+        if self.user:
+            left.append(self.user - self.ledger.spent(user))
+        if self.context:
+            left.append(self.context - self.ledger.spent(user, context))
+        if self.experiment:
+            left.append(self.experiment - self.ledger.spent())
+        return min(left)
+
+    def __bool__(self):
+        return bool(self.user or self.context or self.experiment)
+
+
+def budgeted_infer(domain, x, w, budget, timeout=600, pool=None,
+                   warm_start=False, **kwargs):
+    """Solves an inference problem within the budget of the current scope.
+
+    Parameters
+    ----------
+    domain : object
+        The domain.
+    x : dict
+        The context.
+    w : numpy.ndarray
+        The weight vector of the utility.
+    budget : CostBudget
+        The budget, None for no budget.
+    timeout : float
+        The timeout of the inference, if the budget allows it.
+    pool : cls.solutions.SolutionPool
+        The layouts inferred so far by the learner, if any.
+    warm_start : bool
+        Whether to warm start the inference from the pool.
+
+    Returns
+    -------
+    dict
+        The inferred layout, approximate if the budget is spent.
+    """
+    if warm_start and pool is not None:
+        kwargs['pool'] = pool
+    if not budget:
+        return domain.infer(x, w, timeout=timeout, **kwargs)
+    scope = current_scope()
+    remaining = budget.remaining(scope.get('user'), scope.get('context'))
+    if remaining <= 0:
+        y = pool.best(x, w)[0] if pool is not None else None
+        if y is not None:
+            budget.stats['pooled'] += 1
+            return y
+        budget.stats['approximate'] += 1
+        timeout = budget.min_timeout
+    elif remaining < timeout:
+        budget.stats['capped'] += 1
+        timeout = max(remaining, budget.min_timeout)
+    return domain.infer(x, w, timeout=timeout, **kwargs)
+
+
+def cost_report(ledger=None, top=5):
+    """A printable report of the costs of the experiment.
+
+    The report has the totals, the costs by phase, and the `top` most
+    expensive users and contexts.
+    """
+    ledger = ledger if ledger is not None else cost_ledger
+    row = '{:<24} {:>9} {:>12} {:>12} {:>9}'
+    header = row.format('', *COST_FIELDS)
+
+    def fmt(name, costs):
+        return row.format(str(name)[:24], int(costs['launches']),
+                          '{:.1f}'.format(costs['wall']),
+                          '{:.1f}'.format(costs['cpu']),
+                          int(costs['timeouts']))
+
+    lines = ['Solver costs of {}'.format(ledger.experiment or 'the run'),
+             header, fmt('total', ledger.total()), '', 'by phase', header]
+    by_phase = ledger.summary('phase')
+    lines += [fmt(phase, by_phase[phase])
+              for phase in sorted(by_phase, key=str)]
+    for by, name in [('user', 'user'), ('context', '(user, context)')]:
+        groups = ledger.summary(by)
+        worst = sorted(groups, key=lambda g: -groups[g]['cpu'])[:top]
+        lines += ['', 'top {} by {}'.format(len(worst), name), header]
+        lines += [fmt(group, groups[group]) for group in worst]
+    return '\n'.join(lines)
@@ -1,10 +1,15 @@
 # -*- encoding: utf-8 -*-
 
+import logging
 import numpy as np
 from time import time
 from cls.utils import *
+from cls.pool import SolverError
+from cls.solver import solver_stats
+from cls.budget import cost_ledger, cost_scope, context_key, budgeted_infer
+from cls.solutions import SolutionPool
+from cls.stopping import STOP_REASONS
 from sklearn.utils import check_random_state
-from textwrap import dedent
 
 
 class PreferencePerceptron(object):
@@ -30,22 +35,157 @@ class PreferencePerceptron(object):
         return w + phi_y_bar - phi_y
 
 
+class _StatefulLearner(PreferencePerceptron):
+    """Base of the update rules keeping a state, e.g. accumulated gradients.
+
+    The state is kept per user: a vector shaped like the weights for a single
+    user, or a matrix with one row per user when the learner is shared by a
+    population and called with the `rows` of the users it updates.
+    """
+    def _get(self, name, w, rows=None):
+        states = self.__dict__.setdefault('_states', {})
+        if rows is None:
+            if name not in states:
+                states[name] = np.zeros(np.shape(w))
+            return states[name]
+        rows = np.asarray(rows)
+        size = int(rows.max()) + 1
+        state = states.get(name)
+        if state is None or state.shape[0] < size:
+            grown = np.zeros((size, np.shape(w)[-1]))
+            if state is not None:
+                grown[:state.shape[0]] = state
+            states[name] = state = grown
+        return state[rows]
+
+    def _set(self, name, value, rows=None):
+        if rows is None:
+            self._states[name] = value
+        else:
+            self._states[name][np.asarray(rows)] = value
+
+
+class AveragedPerceptron(_StatefulLearner):
+    """Preference perceptron returning the average of its iterates.
+
+    The iterates are the weights of the plain perceptron; their average is
+    less sensitive to the noise of the single improvements.
+    """
+    def update(self, w, phi_y, phi_y_bar, rows=None, **kwargs):
+        delta = self._get('delta', w, rows)
+        total = self._get('total', w, rows)
+        n = self._get('n', w, rows)
+        # The initial weights, recovered from the current average
+        w0 = w - np.divide(total, n, out=np.zeros_like(total), where=n > 0)
+        delta = delta + phi_y_bar - phi_y
+        total = total + delta
+        n = n + 1
+        self._set('delta', delta, rows)
+        self._set('total', total, rows)
+        self._set('n', n, rows)
+        return w0 + total / n
+
+
+class AdaptivePerceptron(_StatefulLearner):
+    """Preference perceptron with per-feature AdaGrad step sizes.
+
+    Parameters
+    ----------
+    eta : float
+        The base step size.
+    eps : float
+        Smoothing of the step sizes of the features never updated.
+    """
+    def __init__(self, eta=1.0, eps=1e-8):
+        self.eta = eta
+        self.eps = eps
+
+    def update(self, w, phi_y, phi_y_bar, rows=None, **kwargs):
+        delta = phi_y_bar - phi_y
+        g2 = self._get('g2', w, rows) + delta ** 2
+        self._set('g2', g2, rows)
+        return w + self.eta * delta / (np.sqrt(g2) + self.eps)
+
+
+class NormalizedPerceptron(PreferencePerceptron):
+    """Preference perceptron with unit-norm steps.
+
+    Parameters
+    ----------
+    eta : float
+        The length of the steps.
+    """
+    def __init__(self, eta=1.0):
+        self.eta = eta
+
+    def update(self, w, phi_y, phi_y_bar, **kwargs):
+        delta = phi_y_bar - phi_y
+        norm = np.linalg.norm(delta, axis=-1, keepdims=True)
+        step = np.divide(delta, norm, out=np.zeros_like(delta),
+                         where=norm > 0)
+        return w + self.eta * step
+
+
+class ExponentiatedPerceptron(_StatefulLearner):
+    """Preference perceptron with exponentiated gradient (EG+-) updates.
+
+    The weights are the difference of two positive vectors, proportional to
+    the exponentials of the accumulated updates and normalized to unit L1
+    norm. Multiplicative updates converge faster when few features matter.
+
+    Parameters
+    ----------
+    eta : float
+        The learning rate.
+    """
+    def __init__(self, eta=1.0):
+        self.eta = eta
+
+    def update(self, w, phi_y, phi_y_bar, rows=None, **kwargs):
+        theta = self._get('theta', w, rows) + phi_y_bar - phi_y
+        self._set('theta', theta, rows)
+        z = self.eta * theta
+        m = np.abs(z).max(axis=-1, keepdims=True)
+        pos, neg = np.exp(z - m), np.exp(-z - m)
+        return (pos - neg) / (pos + neg).sum(axis=-1, keepdims=True)
+
+
 class CoactiveLearning(object):
     """
     """
-    def __init__(self, domain, learner, w=None,seed=None):
+    def __init__(self, domain, learner, w=None,seed=None, warm_start=False):
         self.domain = domain
         self.learner = learner
         self.num_features = domain.num_features
         self.w = w
         if self.w is None:
             self.w = learner.init_weights(self.num_features,seed)
+        self._incumbents = {}
+        # The layouts inferred so far, see cls.solutions
+        self.warm_start = warm_start
+        self.solution_pool = SolutionPool(
+            getattr(domain, '_distance_keys', None)
+        )
 
     def phi(self, x, y):
         return self.domain.phi(x, y)
 
-    def infer(self, x,timeout= 600):
-        return self.domain.infer(x, self.w,timeout=timeout)
+    def infer(self, x,timeout= 600, budget=None):
+        # The last layout inferred for the context is the incumbent returned
+        # by the supervised solver if the inference is killed
+        _frx = freeze(x)
+        y = budgeted_infer(self.domain, x, self.w, budget, timeout=timeout,
+                           pool=self.solution_pool,
+                           warm_start=self.warm_start,
+                           incumbent=self._incumbents.get(_frx))
+        self._incumbents[_frx] = y
+        return y
+
+    def infer_topk(self, x, k=5, min_distance=1, timeout=600):
+        """The k best layouts for x that are pairwise diverse, best first."""
+        return self.domain.infer_topk(x, self.w, k=k,
+                                      min_distance=min_distance,
+                                      timeout=timeout)
 
     def update(self, *args, **kwargs):
         """Updates the learning model with new evidence."""
@@ -55,7 +195,8 @@ class CoactiveLearning(object):
         return self.w.dot(self.phi(x, y))
 
     def simulate(self, user_model, max_iters=100, stop_on_satisfied=False,
-                 timeout=600, **kwargs):
+                 timeout=600, events=None, regret='exact', stopping=None,
+                 budget=None, **kwargs):
         """Simulate the interaction with the given user response model.
 
         Parameters
@@ -66,83 +207,442 @@ class CoactiveLearning(object):
             The maximum number of iterations to use in the elicitation.
         stop_on_satisfied : bool
             Whether to stop the interaction when the user is satisfied.
+        events : EventWriter
+            If given, an event is appended for each iteration.
+        regret : str
+            Either 'exact', to compute the regret with the optimal layout of
+            the user, or 'bound', to estimate it with `regret_bound` after the
+            improvement, solving no optimal layout for it. Whether each regret
+            is exact is recorded in the events.
+        stopping : callable
+            A factory of the detectors stopping the simulation early, see
+            `cls.stopping`. The reason of the stop is left in `stop_reason`
+            and recorded in the last event.
+        budget : cls.budget.CostBudget
+            The caps on the solver time of the inferences. The solver calls
+            are charged to the user, the context and the phase in
+            `cls.budget.cost_ledger` in any case.
 
         Returns
         -------
         generator of tuples
-            A generator of tuples with the trace of the algorithm.
+            A generator of tuples (regret, time, outcomes) with the trace of
+            the algorithm, where outcomes are the abnormal outcomes of the
+            solver calls of the iteration, see `SolverStats.outcomes`.
+            Iterations whose solver calls failed are skipped, their outcomes
+            are reported with the next iteration.
         """
         user = user_model
         log = get_logger(__name__)
-        log.push_context('uid = {:>2d}'.format(user.uid))
+        debug = log.isEnabledFor(logging.DEBUG)
+        log.push_context('uid = {:>2d}', user.uid)
 
-        msg = dedent('''
-            uid = {user.uid:>2d}, it = {it:>2d}, reg = {reg:>7.3f}, t = {t:>7.3f}
-        ''').strip()
+        msg = 'uid = {:>2d}, it = {:>2d}, reg = {:>7.3f}, t = {:>7.3f}'
 
-        data = []
+        detectors = stopping() if stopping is not None else []
+        self.stop_reason = None
+        solve0 = solver_stats.time
+        outcomes0 = solver_stats.outcomes.copy()
         for it in range(max_iters):
-            log.push_context('it = {:>2d}'.format(it))
+            log.push_context('it = {:>2d}', it)
+            calls0, time0 = solver_stats.snapshot()
+            scope = {'user': user.uid}
 
-            # Receive context
-            x = user.draw_context(it)
-            log.debug('x = {x}', locals())
+            try:
+                # Receive context
+                x = user.draw_context(it)
+                scope['context'] = context_key(x)
+                if debug:
+                    log.debug('x = {x}', x=x)
 
-            # Inference
-            t0 = time()
-            y = self.infer(x, timeout=timeout)
-            t_infer = time() - t0
-            log.debug('''
-                t_infer = {t_infer}
-                y = {y}
-            ''', locals())
-
-            reg = user.regret(x, y)
-            if stop_on_satisfied and user.satisfied(x, y):
+                # Inference
+                t0 = time()
+                with cost_scope(phase='infer', **scope):
+                    y = self.infer(x, timeout=timeout, budget=budget)
+                t_infer = time() - t0
+                if debug:
+                    log.debug('''
+                        t_infer = {t_infer}
+                        y = {y}
+                    ''', t_infer=t_infer, y=y)
+
+                with cost_scope(phase='regret', **scope):
+                    if regret == 'exact':
+                        reg, reg_exact = user.regret(x, y), True
+                    # In bound mode, no optimal layout is solved for it
+                    satisfied = stop_on_satisfied and user.satisfied(
+                        x, y, exact=regret == 'exact')
+
+                if not satisfied:
+                    # Improvement
+                    t1 = time()
+                    with cost_scope(phase='improve', **scope):
+                        y_bar = user.improve(x, y)
+                    t_improve = time() - t1
+                    if debug:
+                        log.debug('''
+                            t_improve = {t_improve}
+                            y_bar     = {y_bar}
+                        ''', t_improve=t_improve, y_bar=y_bar)
+
+                    # Model update
+                    w0 = self.w
+                    t2 = time()
+                    with cost_scope(phase='phi', **scope):
+                        phi_y = self.phi(x, y)
+                        phi_y_bar = self.phi(x, y_bar)
+                    self.solution_pool.add(x, y, phi_y)
+                    self.update(phi_y, phi_y_bar)
+                    t_update = time() - t2
+                    w1 = self.w
+
+                if regret == 'bound':
+                    # Exact if the feedback has solved the optimal layout
+                    with cost_scope(phase='regret', **scope):
+                        reg, reg_exact = user.regret_bound(x, y)
+            except SolverError as e:
+                log.warning('iteration skipped, solver call failed: {!r}', e)
                 log.pop_context()
-                log.debug('''
-                    user satisfied
-                ''', locals())
+                continue
+
+            outcomes = solver_stats.outcomes_since(outcomes0)
+            outcomes0 = solver_stats.outcomes.copy()
+            if outcomes:
+                log.warning('solver outcomes: {}', outcomes)
+            status = {
+                'n_timeouts': outcomes.get('timeout', 0),
+                'n_crashes': outcomes.get('crash', 0),
+                'n_failed': outcomes.get('failed', 0)
+            }
+
+            if satisfied:
+                log.pop_context()
+                if debug:
+                    log.debug('user satisfied')
+                self.stop_reason = 'satisfied'
                 t = t_infer
-                print(msg.format(**locals()))
-                yield reg, t
+                print(msg.format(user.uid, it, reg, t))
+                if events is not None:
+                    events.append(uid=user.uid, it=it, x_id=it, reg=reg,
+                                  reg_exact=int(reg_exact), t_infer=t_infer,
+                                  t=t, timestamp=time(),
+                                  stop=STOP_REASONS.index('satisfied'),
+                                  n_solves=solver_stats.calls - calls0,
+                                  t_solve=solver_stats.time - time0,
+                                  w=self.w, y=y, **status)
+                yield reg, t, outcomes
                 break
 
-            # Improvement
-            t1 = time()
-            y_bar = user.improve(x, y)
-            t_improve = time() - t1
-            log.debug('''
-                t_improve = {t_improve}
-                y_bar     = {y_bar}
-            ''', locals())
-
-            # Model update
-            w0 = self.w.copy()
-            t2 = time()
-            phi_y = self.phi(x, y)
-            phi_y_bar = self.phi(x, y_bar)
-            self.update(phi_y, phi_y_bar)
-            t_update = time() - t2
-            w1 = self.w
-
-            log.debug('''
-                t_update  = {t_update}
-                w0        = {w0}
-                phi_y     = {phi_y}
-                phi_y_bar = {phi_y_bar}
-                w1        = {w1}
-            ''', locals())
+            if debug:
+                log.debug('''
+                    t_update  = {t_update}
+                    w0        = {w0}
+                    phi_y     = {phi_y}
+                    phi_y_bar = {phi_y_bar}
+                    w1        = {w1}
+                ''', t_update=t_update, w0=w0, phi_y=phi_y,
+                    phi_y_bar=phi_y_bar, w1=w1)
 
             t = t_infer + t_update
 
-            print(msg.format(**locals()))
-            yield reg, t
+            stop = None
+            if detectors:
+                step = {'it': it, 'x': x, 'y': y, 'y_bar': y_bar,
+                        'phi_y': phi_y, 'phi_y_bar': phi_y_bar, 'w0': w0,
+                        'w1': w1, 'reg': reg,
+                        't_solve': solver_stats.time - solve0,
+                        'pool': self.solution_pool}
+                # Every detector sees every iteration, to keep its state
+                fired = [d.reason for d in detectors if d(step)]
+                stop = fired[0] if fired else None
+            if stop is None and it == max_iters - 1:
+                stop = 'max_iters'
+
+            print(msg.format(user.uid, it, reg, t))
+            if events is not None:
+                events.append(uid=user.uid, it=it, x_id=it, reg=reg,
+                              reg_exact=int(reg_exact), t_infer=t_infer,
+                              t_improve=t_improve, t_update=t_update, t=t,
+                              timestamp=time(),
+                              stop=STOP_REASONS.index(stop) if stop else None,
+                              n_solves=solver_stats.calls - calls0,
+                              t_solve=solver_stats.time - time0,
+                              phi_y=phi_y, phi_y_bar=phi_y_bar, w=w1,
+                              y=y, y_bar=y_bar, **status)
+            yield reg, t, outcomes
 
             log.pop_context()
+            if stop is not None and stop != 'max_iters':
+                log.info('stopped early: {}', stop)
+                self.stop_reason = stop
+                break
         else:
-            log.debug('''
-                user not satisfied
-            ''', locals())
+            if debug:
+                log.debug('user not satisfied')
+            self.stop_reason = 'max_iters'
         log.pop_context()
 
+
+class PopulationLearning(object):
+    """Coactive learning of a population of users in lock step.
+
+    The weights of all the users are the rows of a single matrix, updated at
+    once by the learner, which must accept matrices of weights and feature
+    vectors (one row per user). The solves of an iteration are dispatched
+    for all the users at once, on up to `num_workers` threads.
+
+    Parameters
+    ----------
+    domain : object
+        The domain.
+    learner : callable
+        The update rule, see `PreferencePerceptron`. The stateful rules keep
+        the state of each user by the `rows` of the updates.
+    num_users : int
+        The number of users.
+    W : numpy.ndarray
+        The initial (num_users, num_features) weight matrix. If None, all the
+        users start from the initial weights of the learner.
+    seed : int
+        The seed of the initial weights.
+    num_workers : int
+        The number of solves running at once.
+    warm_start : bool
+        Whether to warm start the inferences of each user from the layouts
+        inferred so far for that user.
+    """
+    def __init__(self, domain, learner, num_users, W=None, seed=None,
+                 num_workers=4, warm_start=False):
+        self.domain = domain
+        self.learner = learner
+        self.num_features = domain.num_features
+        self.num_workers = num_workers
+        if W is None:
+            w = learner.init_weights(self.num_features, seed)
+            W = np.tile(w, (num_users, 1))
+        self.W = np.array(W, dtype=np.float64)
+        self._incumbents = {}
+        self.warm_start = warm_start
+        keys = getattr(domain, '_distance_keys', None)
+        self.solution_pools = [SolutionPool(keys)
+                               for _ in range(self.num_users)]
+
+    @property
+    def num_users(self):
+        return self.W.shape[0]
+
+    def update(self, rows, phi_ys, phi_y_bars, **kwargs):
+        """Updates the weights of the given users with a single batched step.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            The indices of the users to update.
+        phi_ys : numpy.ndarray
+            The (len(rows), num_features) feature vectors of the argmaxes.
+        phi_y_bars : numpy.ndarray
+            The (len(rows), num_features) feature vectors of the improvements.
+        """
+        rows = np.asarray(rows)
+        self.W[rows] = self.learner(self.W[rows], phi_ys, phi_y_bars,
+                                    rows=rows, **kwargs)
+
+    def utility(self, rows, phis):
+        """The utility of one feature vector per given user."""
+        return np.einsum('ij,ij->i', self.W[np.asarray(rows)], phis)
+
+    def utilities(self, phis):
+        """The (num_users, len(phis)) utilities of the feature vectors."""
+        return self.W.dot(np.asarray(phis).T)
+
+    def _map(self, executor, fn, *iterables):
+        """Runs fn on the arguments in parallel, exceptions as results."""
+        def call(*args):
+            try:
+                return fn(*args)
+            except SolverError as e:
+                return e
+        return list(executor.map(call, *iterables))
+
+    def _infer(self, row, x, timeout, budget=None):
+        _frx = (row, freeze(x))
+        t0 = time()
+        y = budgeted_infer(self.domain, x, self.W[row], budget,
+                           timeout=timeout, pool=self.solution_pools[row],
+                           warm_start=self.warm_start,
+                           incumbent=self._incumbents.get(_frx))
+        self._incumbents[_frx] = y
+        return y, time() - t0
+
+    def infer(self, rows, xs, timeout=600, executor=None):
+        """The argmaxes of the given users in their contexts, in parallel."""
+        from concurrent.futures import ThreadPoolExecutor
+        if executor is None:
+            with ThreadPoolExecutor(self.num_workers) as executor:
+                return self.infer(rows, xs, timeout, executor)
+        results = self._map(executor, self._infer, rows, xs,
+                            [timeout] * len(rows))
+        return [r if isinstance(r, Exception) else r[0] for r in results]
+
+    def _step(self, row, user, x, inferred, stop_on_satisfied,
+              regret='exact'):
+        """The feedback of a user on its argmax, with the feature vectors."""
+        if isinstance(inferred, Exception):
+            return inferred
+        y, t_infer = inferred
+        step = {'y': y, 't_infer': t_infer}
+        with cost_scope(phase='regret'):
+            if regret == 'exact':
+                step.update(reg=user.regret(x, y), reg_exact=1)
+            satisfied = stop_on_satisfied and user.satisfied(
+                x, y, exact=regret == 'exact')
+        if not satisfied:
+            t0 = time()
+            with cost_scope(phase='improve'):
+                y_bar = user.improve(x, y)
+            step.update(y_bar=y_bar, t_improve=time() - t0)
+            with cost_scope(phase='phi'):
+                step.update(phi_y=self.phi(x, y),
+                            phi_y_bar=self.phi(x, y_bar))
+        if regret == 'bound':
+            # Exact if the feedback has solved the optimal layout
+            with cost_scope(phase='regret'):
+                reg, reg_exact = user.regret_bound(x, y)
+            step.update(reg=reg, reg_exact=int(reg_exact))
+        return step
+
+    def simulate(self, user_models, max_iters=100, stop_on_satisfied=False,
+                 timeout=600, events=None, regret='exact', stopping=None,
+                 budget=None, **kwargs):
+        """Simulates the interaction with all the users in lock step.
+
+        At each iteration the contexts of all the active users are drawn, and
+        their inferences, improvements and feature vectors are solved in
+        parallel, before a single batched update of their weights.
+
+        Parameters
+        ----------
+        user_models : list
+            The user response models, one per row of the weight matrix.
+        regret : str
+            Either 'exact' or 'bound', see `CoactiveLearning.simulate`.
+        stopping : callable
+            A factory of the detectors stopping each user early, see
+            `cls.stopping`. The reasons of the stops are left in
+            `stop_reasons`, by uid.
+        budget : cls.budget.CostBudget
+            The caps on the solver time of the inferences, see
+            `CoactiveLearning.simulate`.
+
+        Returns
+        -------
+        generator of tuples
+            A generator of tuples (uid, (regret, time, outcomes)), with the
+            trace of each user as in `CoactiveLearning.simulate`. Users whose
+            solves failed in an iteration are skipped for that iteration.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        log = get_logger(__name__)
+        msg = 'uid = {:>2d}, it = {:>2d}, reg = {:>7.3f}, t = {:>7.3f}'
+
+        # The solves run on the threads of the executor, in their own scopes
+        def infer_user(row, user, x):
+            with cost_scope(user=user.uid, context=context_key(x),
+                            phase='infer'):
+                return self._infer(row, x, timeout, budget)
+
+        def step_user(row, user, x, inferred):
+            with cost_scope(user=user.uid, context=context_key(x)):
+                return self._step(row, user, x, inferred, stop_on_satisfied,
+                                  regret)
+
+        active = list(range(len(user_models)))
+        detectors = [stopping() if stopping is not None else []
+                     for _ in active]
+        t_solves = [0.0 for _ in active]
+        self.stop_reasons = {}
+        outcomes0 = solver_stats.outcomes.copy()
+        with ThreadPoolExecutor(self.num_workers) as executor:
+            for it in range(max_iters):
+                if not active:
+                    break
+                log.push_context('it = {:>2d}', it)
+                users = [user_models[row] for row in active]
+                costs0 = [cost_ledger.user_total(user.uid) for user in users]
+                xs = [user.draw_context(it) for user in users]
+
+                inferred = self._map(executor, infer_user, active, users, xs)
+                steps = self._map(executor, step_user, active, users, xs,
+                                  inferred)
+
+                updated = [(row, step) for row, step in zip(active, steps)
+                           if not isinstance(step, Exception) and
+                           'y_bar' in step]
+                for row, x, step in zip(active, xs, steps):
+                    if not isinstance(step, Exception) and 'y_bar' in step:
+                        self.solution_pools[row].add(x, step['y'],
+                                                     step['phi_y'])
+                W0 = self.W.copy()
+                t0 = time()
+                if updated:
+                    rows, steps_ = zip(*updated)
+                    self.update(rows,
+                                np.array([s['phi_y'] for s in steps_]),
+                                np.array([s['phi_y_bar'] for s in steps_]))
+                t_update = (time() - t0) / max(len(updated), 1)
+
+                outcomes = solver_stats.outcomes_since(outcomes0)
+                outcomes0 = solver_stats.outcomes.copy()
+                status = {
+                    'n_timeouts': outcomes.get('timeout', 0),
+                    'n_crashes': outcomes.get('crash', 0),
+                    'n_failed': outcomes.get('failed', 0)
+                }
+                stopped = set()
+                for row, user, x, step, c0 in zip(active, users, xs, steps,
+                                                  costs0):
+                    # The solves of the user, charged to it in the ledger
+                    costs = cost_ledger.user_total(user.uid)
+                    n_solves = int(costs['launches'] - c0['launches'])
+                    t_solve = costs['wall'] - c0['wall']
+                    t_solves[row] += t_solve
+                    if isinstance(step, Exception):
+                        log.warning('uid = {}, iteration skipped, solver call '
+                                    'failed: {!r}', user.uid, step)
+                        continue
+                    stop = None
+                    if 'y_bar' in step:
+                        step['t_update'] = t_update
+                        t = step['t_infer'] + t_update
+                        fired = [d.reason for d in detectors[row]
+                                 if d({'it': it, 'x': x, 'w0': W0[row],
+                                       'w1': self.W[row],
+                                       't_solve': t_solves[row],
+                                       'pool': self.solution_pools[row],
+                                       **step})]
+                        stop = fired[0] if fired else None
+                    else:
+                        stop = 'satisfied'
+                        t = step['t_infer']
+                    if stop is None and it == max_iters - 1:
+                        stop = 'max_iters'
+                    if stop is not None:
+                        stopped.add(row)
+                        self.stop_reasons[user.uid] = stop
+                    print(msg.format(user.uid, it, step['reg'], t))
+                    if events is not None:
+                        events.append(uid=user.uid, it=it, x_id=it,
+                                      t=t, timestamp=time(),
+                                      n_solves=n_solves, t_solve=t_solve,
+                                      stop=(STOP_REASONS.index(stop)
+                                            if stop else None),
+                                      w=self.W[row].copy(), **step, **status)
+                    yield user.uid, (step['reg'], t, outcomes)
+
+                active = [row for row in active if row not in stopped]
+                log.pop_context()
+        for row in active:
+            self.stop_reasons.setdefault(user_models[row].uid, 'max_iters')
+
+    def phi(self, x, y):
+        return self.domain.phi(x, y)
@@ -2,6 +2,7 @@
 import pymzn
 import numpy as np
 from cls.utils import *
+from cls.solver import minizinc
 
 
 class Domain(object):
@@ -82,7 +83,7 @@ class Domain(object):
         model.parameter('FEATURES', mzn_range(features))
         model.array_variable('phi', 'FEATURES', feat_type, features, output=True)
         model.satisfy()
-        sol = pymzn.minizinc(model, data=x)
+        sol = minizinc(model, data=x, pooled=True)
         _phi = sol[0]['phi']
         self._phis[_frx] = np.array(_phi, dtype=np.float64)
         return self._phis[_frx]
@@ -128,7 +129,7 @@ class Domain(object):
         dtype = dot_type(w, feat_type)
         model.variable('obj', dtype, mzn_dot('w', 'phi'))
         model.maximize('obj')
-        return pymzn.minizinc(model, data=x, parse_output=False, parallel=8)[0]
+        return minizinc(model, data=x, parse_output=False, parallel=8)[0]
 
     def draw_context(self, user, it):
         """Draw a context x for the given user.
@@ -0,0 +1,329 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import json
+import queue
+import pickle
+import struct
+import threading
+import numpy as np
+
+from time import time
+
+
+__all__ = ['event_dtype', 'EventWriter', 'EventReader', 'load_events']
+
+
+""" Binary event log
+
+An event log is a file starting with a magic string, followed by a sequence of
+chunks. Each chunk holds a batch of iteration events in a columnar encoding:
+
+    header : struct '<4sIIQQ' (tag, num_events, descr_len, data_len, aux_len)
+    descr  : JSON encoding of the numpy dtype of the events
+    data   : the events as a numpy structured array
+    aux    : pickled list of (y, y_bar) layouts, one per event
+
+Numeric fields are loaded with a single `np.frombuffer` per chunk, while the
+layouts are only unpickled when requested. The chunks of a log written by
+different versions may have different fields: they are read with the union
+of the fields, the missing ones being NaN, or -1 for integer fields.
+"""
+
+
+MAGIC = b'CLSEVT1\n'
+CHUNK_TAG = b'CHNK'
+_CHUNK_HEADER = struct.Struct('<4sIIQQ')
+
+
+def event_dtype(num_features):
+    """Returns the numpy dtype of the iteration events.
+
+    Parameters
+    ----------
+    num_features : int
+        The number of features of the domain.
+    """
+    vec = ('<f8', (num_features,))
+    return np.dtype([
+        ('uid', '<i4'), ('it', '<i4'), ('x_id', '<i4'),
+        ('reg', '<f8'), ('reg_exact', '<i4'), ('t_infer', '<f8'),
+        ('t_improve', '<f8'), ('t_update', '<f8'), ('t', '<f8'),
+        ('timestamp', '<f8'),
+        ('n_solves', '<i4'), ('t_solve', '<f8'),
+        ('n_timeouts', '<i4'), ('n_crashes', '<i4'), ('n_failed', '<i4'),
+        ('stop', '<i4'),
+        ('phi_y', *vec), ('phi_y_bar', *vec), ('w', *vec)
+    ])
+
+
+def _dtype2json(dtype):
+    return json.dumps(dtype.descr).encode('utf-8')
+
+
+def _json2dtype(descr):
+    fields = []
+    for field in json.loads(descr.decode('utf-8')):
+        if len(field) == 3:
+            field[2] = tuple(field[2])
+        fields.append(tuple(field))
+    return np.dtype(fields)
+
+
+def _missing(field):
+    """The value of a field missing from an event."""
+    return -1 if field.base.kind == 'i' else np.nan
+
+
+def _encode(events, dtype):
+    """Encodes a batch of events (dictionaries) into a chunk."""
+    data = np.zeros(len(events), dtype=dtype)
+    for name in dtype.names:
+        missing = _missing(dtype[name])
+        column = data[name]
+        for i, event in enumerate(events):
+            value = event.get(name)
+            column[i] = missing if value is None else value
+    aux = pickle.dumps([(e.get('y'), e.get('y_bar')) for e in events],
+                       protocol=pickle.HIGHEST_PROTOCOL)
+    descr = _dtype2json(dtype)
+    data = data.tobytes()
+    header = _CHUNK_HEADER.pack(CHUNK_TAG, len(events), len(descr), len(data),
+                                len(aux))
+    return b''.join([header, descr, data, aux])
+
+
+class EventWriter(object):
+    """Buffered asynchronous writer of iteration events.
+
+    Events are buffered in memory and handed in batches to a background thread,
+    which encodes and appends them to the event log. A batch is flushed when
+    the buffer is full or when `flush_interval` seconds have passed since the
+    last flush, so that running simulations can be monitored.
+
+    Parameters
+    ----------
+    path : str
+        The event log file. Events are appended if the file exists.
+    num_features : int
+        The number of features of the domain.
+    buffer_size : int
+        The maximum number of events to buffer before flushing.
+    flush_interval : float
+        The maximum number of seconds between two flushes.
+    """
+    def __init__(self, path, num_features, buffer_size=256,
+                 flush_interval=10.0):
+        self.path = path
+        self.dtype = event_dtype(num_features)
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._last_flush = time()
+        self._batches = queue.Queue()
+        self._error = None
+
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+            self._file.flush()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        # The error stops the writer, it is raised by the next flush or close
+        try:
+            while True:
+                batch = self._batches.get()
+                if batch is None:
+                    break
+                self._file.write(_encode(batch, self.dtype))
+                self._file.flush()
+        except Exception as e:
+            self._error = e
+
+    def _check(self):
+        if self._error is not None:
+            raise RuntimeError('Writing the event log {} failed: {!r}'
+                               .format(self.path, self._error)) \
+                from self._error
+
+    def append(self, **event):
+        """Appends an event.
+
+        The keyword arguments are the fields of the event, see `event_dtype`,
+        plus the layouts `y` and `y_bar`. Missing fields are stored as NaN, or
+        -1 for integer fields. The values should not be modified afterwards,
+        as they are encoded in the background.
+        """
+        self._buffer.append(event)
+        if (len(self._buffer) >= self.buffer_size or
+                time() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Hands the buffered events to the writer thread.
+
+        Raises a RuntimeError if the writer thread has failed to write the
+        events flushed before.
+        """
+        self._check()
+        if self._buffer:
+            self._batches.put(self._buffer)
+            self._buffer = []
+        self._last_flush = time()
+
+    def close(self):
+        """Flushes the buffered events and waits for the writer thread.
+
+        Raises a RuntimeError if the writer thread has failed.
+        """
+        try:
+            self.flush()
+        finally:
+            self._batches.put(None)
+            self._thread.join()
+            self._file.close()
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _align(arrays, fields=None):
+    """Concatenates the events of chunks with possibly different dtypes.
+
+    The events get the union of the fields of the chunks, or the given
+    fields, the fields missing from a chunk being NaN, or -1 for integer
+    fields. A field with different types in different chunks, e.g. the
+    feature vectors of different domains, raises a ValueError.
+    """
+    union = {}
+    for events in arrays:
+        for name in events.dtype.names:
+            field = union.setdefault(name, events.dtype[name])
+            if field != events.dtype[name]:
+                raise ValueError('The field {} of the event log has types {} '
+                                 'and {}'.format(name, field,
+                                                 events.dtype[name]))
+    if fields is None:
+        fields = list(union)
+    dtype = np.dtype([(name, union[name]) for name in fields])
+    aligned = np.empty(sum(map(len, arrays)), dtype=dtype)
+    start = 0
+    for events in arrays:
+        chunk = aligned[start:start + len(events)]
+        for name in fields:
+            if name in events.dtype.names:
+                chunk[name] = events[name]
+            else:
+                chunk[name] = _missing(dtype[name])
+        start += len(events)
+    return aligned
+
+
+class EventReader(object):
+    """Reader of an event log.
+
+    Parameters
+    ----------
+    path : str
+        The event log file.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def chunks(self, offset=0, layouts=False):
+        """Iterates over the complete chunks of the event log.
+
+        Incomplete trailing chunks, e.g. being written by a running simulation,
+        are skipped, so the log can be read incrementally by passing the offset
+        of the last chunk read.
+
+        Parameters
+        ----------
+        offset : int
+            The file offset where to start reading from.
+        layouts : bool
+            Whether to load the (y, y_bar) layouts of the events.
+
+        Returns
+        -------
+        generator of tuples
+            Tuples (offset, events, layouts) where offset is the file offset
+            after the chunk, events is a numpy structured array and layouts
+            is a list of (y, y_bar) tuples, or None if not requested.
+        """
+        size = os.path.getsize(self.path)
+        with open(self.path, 'rb') as f:
+            if offset < len(MAGIC):
+                if f.read(len(MAGIC)) != MAGIC:
+                    raise ValueError('Not an event log: {}'.format(self.path))
+                offset = len(MAGIC)
+            f.seek(offset)
+            while offset + _CHUNK_HEADER.size <= size:
+                header = f.read(_CHUNK_HEADER.size)
+                tag, n, descr_len, data_len, aux_len = \
+                    _CHUNK_HEADER.unpack(header)
+                if tag != CHUNK_TAG:
+                    raise ValueError('Corrupted event log at offset {}'
+                                     .format(offset))
+                end = (offset + _CHUNK_HEADER.size + descr_len + data_len +
+                       aux_len)
+                if end > size:
+                    break
+                dtype = _json2dtype(f.read(descr_len))
+                events = np.frombuffer(f.read(data_len), dtype=dtype, count=n)
+                if layouts:
+                    aux = pickle.loads(f.read(aux_len))
+                else:
+                    aux = None
+                    f.seek(aux_len, os.SEEK_CUR)
+                offset = end
+                yield offset, events, aux
+
+    def read(self, fields=None, layouts=False):
+        """Reads all the events of the log.
+
+        Parameters
+        ----------
+        fields : list of str
+            The fields to load. If None, all fields are loaded. The chunks
+            with different fields are aligned, see the module docstring.
+        layouts : bool
+            Whether to also return the (y, y_bar) layouts of the events.
+
+        Returns
+        -------
+        numpy.ndarray or tuple
+            The structured array of the events, and the list of layouts if
+            requested.
+        """
+        arrays, aux = [], []
+        for _, events, chunk_layouts in self.chunks(layouts=layouts):
+            arrays.append(events)
+            if layouts:
+                aux.extend(chunk_layouts)
+        if len({events.dtype for events in arrays}) > 1:
+            events = _align(arrays, fields)
+        elif arrays:
+            if fields is not None:
+                arrays = [events[list(fields)] for events in arrays]
+            events = np.concatenate(arrays)
+        else:
+            events = np.zeros(0, dtype=event_dtype(0))
+            if fields is not None:
+                events = events[list(fields)]
+        events = np.array(events, copy=True)
+        if layouts:
+            return events, aux
+        return events
+
+
+def load_events(path, fields=None, layouts=False):
+    """Loads the events of an event log, see `EventReader.read`."""
+    return EventReader(path).read(fields=fields, layouts=layouts)
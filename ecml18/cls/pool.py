@@ -0,0 +1,4 @@
+# -*- encoding: utf-8 -*-
+
+from solverkit.pool import *
+from solverkit.pool import __all__
@@ -0,0 +1,193 @@
+# -*- encoding: utf-8 -*-
+
+import dbm
+import json
+import zlib
+import pickle
+import hashlib
+import threading
+import numpy as np
+
+from collections import Counter
+
+
+__all__ = ['REPLAY_MODES', 'SolverRecord', 'ReplayDomain', 'ReplayFeedback']
+
+
+""" Record and replay of the solver answers
+
+For fixed inputs the answers of the solver never change, so the answers of a
+simulation can be recorded and served again to later simulations, e.g. to
+compare learners on the same users. The answers are stored in a dbm file,
+indexed by a digest of the solve and of its inputs, and compressed.
+
+The domain and the user feedback of a simulation are wrapped, so the learners
+and the rest of the simulation are unchanged: a replayed run only calls the
+solver for the inputs that were never recorded, e.g. the layouts inferred by
+a different learner.
+"""
+
+
+# record: always solve and record the answers
+# replay: serve the recorded answers, solve and record on a miss
+# strict: serve the recorded answers, raise a KeyError on a miss
+REPLAY_MODES = ['record', 'replay', 'strict']
+
+
+def _to_json(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    raise TypeError('Cannot encode {} to JSON'.format(type(obj)))
+
+
+def _layout(y):
+    """The layout y without its 'utility', which depends on the learner."""
+    return {k: v for k, v in y.items() if k != 'utility'}
+
+
+class SolverRecord(object):
+    """A store of solver answers, indexed by the inputs of the solves.
+
+    Parameters
+    ----------
+    path : str
+        The dbm file of the store, created if missing.
+    mode : str
+        One of `REPLAY_MODES`.
+
+    Attributes
+    ----------
+    stats : collections.Counter
+        The number of answers served from the store ('hits') and solved
+        ('misses'), by kind of solve, e.g. 'infer_hits'.
+    """
+    def __init__(self, path, mode='replay'):
+        if mode not in REPLAY_MODES:
+            raise ValueError('Unknown replay mode: {}'.format(mode))
+        self.path = path
+        self.mode = mode
+        self.stats = Counter()
+        self._db = dbm.open(path, 'c')
+        # The dbm modules are not thread safe, the solves run unlocked
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(kind, *args):
+        """The index of a solve, a digest of its kind and inputs.
+
+        Floats are encoded with their exact representation, so equal inputs
+        and only equal inputs give the same key.
+        """
+        data = json.dumps([kind, *args], sort_keys=True, default=_to_json)
+        return hashlib.sha1(data.encode('utf-8')).digest()
+
+    def call(self, kind, solve, *args):
+        """Returns the answer of a solve, from the store or from the solver.
+
+        Parameters
+        ----------
+        kind : str
+            The kind of solve, e.g. 'infer'.
+        solve : callable
+            The solve, called with no arguments on a miss.
+        args : list
+            The inputs of the solve, which determine its answer.
+        """
+        key = self.key(kind, *args)
+        with self._lock:
+            value = self._db.get(key) if self.mode != 'record' else None
+        if value is not None:
+            self.stats[kind + '_hits'] += 1
+            return pickle.loads(zlib.decompress(value))
+        if self.mode == 'strict':
+            raise KeyError('No recorded answer for {}'.format(kind))
+        self.stats[kind + '_misses'] += 1
+        answer = solve()
+        value = zlib.compress(
+            pickle.dumps(answer, protocol=pickle.HIGHEST_PROTOCOL)
+        )
+        with self._lock:
+            self._db[key] = value
+        return answer
+
+    def __len__(self):
+        with self._lock:
+            return len(self._db.keys())
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ReplayDomain(object):
+    """A domain whose `phi` and `infer` answers go through a `SolverRecord`.
+
+    The feature vectors are indexed by the layout without its 'utility',
+    which depends on the weights of the learner that inferred it. The
+    inferences are indexed also by their timeout and by whether they are
+    warm started, which can change their answers. Everything else is taken
+    from the wrapped domain.
+    """
+    def __init__(self, domain, record):
+        self.domain = domain
+        self.record = record
+
+    def __getattr__(self, name):
+        return getattr(self.domain, name)
+
+    def phi(self, x, y, features=None):
+        return self.record.call('phi',
+                                lambda: self.domain.phi(x, y, features),
+                                x, _layout(y), features)
+
+    def infer(self, x, w, features=None, timeout=600, **kwargs):
+        warm_start = kwargs.get('pool') is not None
+        return self.record.call(
+            'infer',
+            lambda: self.domain.infer(x, w, features, timeout=timeout,
+                                      **kwargs),
+            x, w, features, timeout, warm_start
+        )
+
+    def infer_topk(self, x, w, k=5, min_distance=1, timeout=600):
+        return self.record.call(
+            'infer_topk',
+            lambda: self.domain.infer_topk(x, w, k=k,
+                                           min_distance=min_distance,
+                                           timeout=timeout),
+            x, w, k, min_distance, timeout
+        )
+
+
+class ReplayFeedback(object):
+    """A user feedback whose `improve` answers go through a `SolverRecord`.
+
+    The improvements are indexed by the user weights, the parameters of the
+    feedback, the context and the layout to improve, without its 'utility',
+    so that the learners inferring the same layout share the improvement.
+    Everything else is taken from the wrapped feedback.
+    """
+    def __init__(self, feedback, record):
+        self.feedback = feedback
+        self.record = record
+
+    def __getattr__(self, name):
+        return getattr(self.feedback, name)
+
+    def improve(self, x, y, **kwargs):
+        feedback = self.feedback
+        return self.record.call(
+            'improve', lambda: feedback.improve(x, y, **kwargs),
+            type(feedback).__name__, feedback.w_star, feedback.alpha, x,
+            _layout(y), kwargs
+        )
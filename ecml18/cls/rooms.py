@@ -1,18 +1,29 @@
 import os
+import threading
 
 from cls.utils import freeze,subdict
 from cls.domain import Domain
+from cls.solver import minizinc
+from cls.topk import infer_topk
+from cls.solutions import warm_infer
 from sklearn.utils import check_random_state
 
 import numpy as np
 import pymzn
 
 
+# Guards the feature vector caches of the domains, which are shared by the
+# threads of a population simulation
+_lock = threading.Lock()
+
+
 class Rooms(object):
 
     _phi_keys = ["x","y","dx","dy","side_diff"]
 
     _inference_vars = _phi_keys + ["belong_to","utility"]
+    _distance_keys = ["x","y","dx","dy"]
+
     _phi_vars = ["phi","all_normalizers"]
     def __init__(self, seed=None, num_contexts=100, n_rooms=4, **kwargs):
         n_rooms = int(n_rooms)
@@ -37,34 +48,56 @@ class Rooms(object):
             features = self.features
 
         _frx = (freeze(x), freeze(y), tuple(sorted(features)))
-        if _frx in self._phis:
-            return self._phis[_frx]
+        with _lock:
+            _phi = self._phis.get(_frx)
+        if _phi is not None:
+            return _phi
 
-        sol = pymzn.minizinc(self.phi_file, 
+        sol = minizinc(self.phi_file, 
                             data={
                                     **inputize(subdict(y,keys=Rooms._phi_keys),Rooms._phi_keys),
                                     **x},
                             output_vars=Rooms._phi_vars,
                             solver=pymzn.opturion,
-                            suppress_segfault=True
+                            suppress_segfault=True,
+                            pooled=True
                 )
         _phi = [p*n for p,n in zip (sol[-1]['phi'],sol[-1]['all_normalizers'])]
-        self._phis[_frx] = np.array(_phi, dtype=np.float64)
-        return self._phis[_frx]
-
-
-    def infer(self, x, w, features=None,timeout=600):
-        results =  pymzn.minizinc(self.inference_file, 
+        _phi = np.array(_phi, dtype=np.float64)
+        with _lock:
+            return self._phis.setdefault(_frx, _phi)
+
+
+    def infer(self, x, w, features=None,timeout=600, incumbent=None,
+              pool=None):
+        if pool is not None:
+            # Bounded by the best pooled layout of the context, if any
+            y = warm_infer(self, pool, x, w, timeout=timeout,
+                           incumbent=incumbent)
+            if y is not None:
+                return y
+        if incumbent is not None:
+            incumbent = [incumbent]
+        results =  minizinc(self.inference_file, 
                                 data={**x,"w":w}, 
                                 timeout=timeout, 
                                 output_vars=Rooms._inference_vars, 
                                 #parse_output=False,
                                 solver=pymzn.opturion,
-                                suppress_segfault=True
+                                suppress_segfault=True,
+                                incumbent=incumbent
                                 )
 
         return results[-1]
 
+    def infer_topk(self, x, w, k=5, min_distance=1, timeout=600):
+        """Returns k high-utility layouts, pairwise at least min_distance apart.
+
+        See `cls.topk.infer_topk`.
+        """
+        return infer_topk(self, x, w, k=k, min_distance=min_distance,
+                          timeout=timeout)
+
     def _generate_contexts(self, num_contexts=100, n_rooms=4,  seed=None):
         rng = check_random_state(seed)
         #np.random.seed(seed)
@@ -0,0 +1,54 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import numpy as np
+
+from solverkit.service import call_service
+
+
+__all__ = ['ServiceDomain']
+
+
+class ServiceDomain(object):
+    """A domain whose solves run on a layout synthesis service.
+
+    The service (`interface/server.py`) loads the domain from its shelf once
+    and keeps its caches and solver workers warm across runs. Everything but
+    `phi` and `infer` is taken from the local copy of the domain.
+
+    Parameters
+    ----------
+    url : str
+        The address of the service, e.g. http://127.0.0.1:8765.
+    domain_file : str
+        The shelf of the domain, readable by the service.
+    domain : object
+        The local copy of the domain.
+    """
+    def __init__(self, url, domain_file, domain):
+        self.url = url.rstrip('/')
+        self.domain_file = os.path.abspath(domain_file)
+        self.domain = domain
+        self.session = self._call('session', domain_file=self.domain_file,
+                                  w=np.zeros(domain.num_features))['session']
+
+    def _call(self, method, **kwargs):
+        return call_service(self.url, method, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.domain, name)
+
+    def phi(self, x, y, features=None):
+        _phi = self._call('phi', session=self.session, x=x, y=y,
+                          features=features)['phi']
+        return np.array(_phi, dtype=np.float64)
+
+    def infer(self, x, w, features=None, timeout=600, incumbent=None,
+              pool=None):
+        # The inferences are not warm started from the pools of the learners
+        return self._call('infer', session=self.session, x=x, w=w,
+                          features=features, timeout=timeout,
+                          incumbent=incumbent)['y']
+
+    def close(self):
+        self._call('close', session=self.session)
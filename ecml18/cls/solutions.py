@@ -0,0 +1,198 @@
+# -*- encoding: utf-8 -*-
+
+import pymzn
+import threading
+import numpy as np
+
+from collections import Counter
+from cls.solver import minizinc, UNSAT_ERRORS
+from cls.utils import freeze, subdict
+
+
+__all__ = ['UTILITY_SCALE', 'BOUND_SLACK', 'SolutionPool', 'fix_layout',
+           'warm_infer']
+
+
+""" Solution pools
+
+Every learner keeps the layouts it inferred in each context, with their
+feature vectors, in its own solution pool. The utility of all the pooled
+layouts of a context for a new weight vector is a single product of their
+feature matrix with the weights. The layouts of the users (improvements,
+optimal layouts) are never pooled, so that the learner does not see them.
+
+An inference in a context with pooled layouts can be warm started: the
+utility of the best pooled layout, computed from its pooled feature vector
+with no solve, is a lower bound for the inference, which only searches for
+layouts at least as good. If it finds none within its timeout, the pooled
+layout is returned, so warm started inferences with a timeout can differ
+from the cold ones.
+
+The inference models maximize an integer utility, the weights scaled by
+`UTILITY_SCALE` and rounded. The bound is loosened by `BOUND_SLACK` of the
+utility so that the rounding cannot exclude the pooled layout: a looser
+bound only prunes less.
+"""
+
+
+# The scale of the integer utilities of the inference models, see their w1
+UTILITY_SCALE = 10000
+
+# The relative slack of the lower bound of the warm started inferences
+BOUND_SLACK = 0.01
+
+
+class SolutionPool(object):
+    """Feasible layouts of each context, with their feature vectors.
+
+    Parameters
+    ----------
+    keys : list of str
+        The attributes identifying a layout. If None, all of them.
+    max_size : int
+        The maximum number of layouts kept for each context. When full, the
+        oldest layout of the context is dropped.
+
+    Attributes
+    ----------
+    stats : collections.Counter
+        The number of warm started inferences ('seeded') and of those that
+        returned the pooled layout ('kept').
+
+    The pool can be shared by threads.
+    """
+    def __init__(self, keys=None, max_size=1000):
+        self.keys = keys
+        self.max_size = max_size
+        self.stats = Counter()
+        self._contexts = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _context(self, x):
+        _frx = freeze(x)
+        if _frx not in self._contexts:
+            self._contexts[_frx] = {'ys': [], 'keys': set(), 'phis': None}
+        return self._contexts[_frx]
+
+    def add(self, x, y, phi):
+        """Adds the layout y of context x, with feature vector phi."""
+        _fry = freeze(subdict(y, self.keys))
+        phi = np.asarray(phi, dtype=np.float64)[None, :]
+        with self._lock:
+            context = self._context(x)
+            if _fry in context['keys']:
+                return
+            if context['phis'] is None:
+                context['phis'] = phi
+            else:
+                context['phis'] = np.vstack([context['phis'], phi])
+            # New lists, so that the layouts returned by `layouts` stay
+            # aligned with their feature matrix
+            context['ys'] = context['ys'] + [y]
+            context['keys'].add(_fry)
+            if len(context['ys']) > self.max_size:
+                y_old = context['ys'][0]
+                context['ys'] = context['ys'][1:]
+                context['keys'].discard(freeze(subdict(y_old, self.keys)))
+                context['phis'] = context['phis'][1:]
+
+    def layouts(self, x):
+        """The pooled layouts of context x and their feature matrix."""
+        with self._lock:
+            context = self._contexts.get(freeze(x))
+            if context is None:
+                return [], np.zeros((0, 0))
+            return context['ys'], context['phis']
+
+    def best(self, x, w):
+        """The best pooled layout of context x for the weights w.
+
+        Returns
+        -------
+        tuple
+            The layout and its utility, (None, None) if the pool of the
+            context is empty.
+        """
+        ys, phis = self.layouts(x)
+        if not ys:
+            return None, None
+        utilities = phis.dot(w)
+        i = int(np.argmax(utilities))
+        return ys[i], float(utilities[i])
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(c['ys']) for c in self._contexts.values())
+
+
+def fix_layout(y, keys):
+    """MiniZinc constraints fixing the given attributes to their values in y.
+    """
+    constraints = []
+    for key in keys:
+        if np.ndim(y[key]) == 0:
+            value = int(y[key])
+        else:
+            value = '[{}]'.format(', '.join(str(int(v)) for v in y[key]))
+        constraints.append('constraint {} == {};'.format(key, value))
+    return constraints
+
+
+def warm_infer(domain, pool, x, w, timeout=600, incumbent=None):
+    """Solves an inference problem warm started from a solution pool.
+
+    Parameters
+    ----------
+    domain : object
+        A domain with an `inference_file` maximizing the integer 'utility',
+        its `_inference_vars` and its layout attributes `_distance_keys`.
+    pool : SolutionPool
+        The layouts inferred so far by the learner.
+    x : dict
+        The context.
+    w : numpy.ndarray
+        The weight vector of the utility.
+    timeout : float
+        The timeout of the inference, in seconds.
+    incumbent : dict
+        The layout to return if the inference is killed, when supervised.
+        Defaults to the pooled layout.
+
+    Returns
+    -------
+    dict
+        The optimal layout, None if the pool of the context is empty. The
+        pooled layout if the inference times out, with an approximate
+        'utility'.
+    """
+    y_pool, u0 = pool.best(x, w)
+    if y_pool is None:
+        return None
+    pool.stats['seeded'] += 1
+
+    # The pooled layout, with its utility for w in the units of the model
+    y0 = {**y_pool, 'utility': int(round(UTILITY_SCALE * u0))}
+    bound = int(np.floor(UTILITY_SCALE * (u0 - BOUND_SLACK * abs(u0))))
+    try:
+        results = minizinc(domain.inference_file, data={**x, 'w': w},
+                           timeout=timeout, incumbent=[incumbent or y0],
+                           constraints=['constraint utility >= {};'.format(
+                               bound)],
+                           output_vars=domain._inference_vars,
+                           solver=pymzn.opturion, suppress_segfault=True)
+    except UNSAT_ERRORS:
+        results = []
+    if not results:
+        # Nothing as good as the pooled layout was found within the timeout
+        pool.stats['kept'] += 1
+        return y0
+    return results[-1]
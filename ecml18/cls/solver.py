@@ -0,0 +1,330 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import pymzn
+import shutil
+import tempfile
+import threading
+import numpy as np
+
+from time import time
+from collections import Counter
+from multiprocessing.util import Finalize
+
+from cls.budget import cost_ledger
+from cls.governor import get_governor
+from solverkit.supervision import UNSAT_ERRORS, unsatisfiable
+from solverkit.supervision import supervised_solve
+
+
+__all__ = ['SolverStats', 'solver_stats', 'minizinc', 'local_minizinc', 'dzn',
+           'scratch_dir', 'set_scratch_io', 'start_pool', 'stop_pool',
+           'FALLBACKS', 'start_supervisor', 'stop_supervisor',
+           'UNSAT_ERRORS', 'unsatisfiable']
+
+
+class SolverStats(object):
+    """Counters of the solver calls made by this process.
+
+    Attributes
+    ----------
+    calls : int
+        The number of solver calls.
+    time : float
+        The wall-clock time spent in solver calls, in seconds.
+    outcomes : collections.Counter
+        The number of abnormal outcomes of the supervised calls, by kind:
+        'timeout', 'crash', 'retried' (succeeded after a crash), 'incumbent'
+        (answered with the incumbent after a timeout) and 'failed'.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.time = 0.0
+        self.outcomes = Counter()
+
+    def snapshot(self):
+        return self.calls, self.time
+
+    def outcomes_since(self, outcomes):
+        """The outcomes counted after the given copy of `outcomes`."""
+        return dict(self.outcomes - outcomes)
+
+
+solver_stats = SolverStats()
+
+
+""" Solver I/O
+
+By default, the data of a solver call is serialized with `dzn` and written,
+together with a private copy of the model, in a RAM-backed scratch directory.
+All the files generated by the MiniZinc toolchain for the call (.dzn, .fzn,
+.ozn) are then kept off the disk and never shared between concurrent calls.
+The private copy is also where the extra `constraints` of a call, e.g. the
+nogoods of a top-k inference, are appended to the model.
+"""
+
+
+# RAM-backed directories where to put the solver files, in order of preference
+SCRATCH_DIRS = ['/dev/shm', '/run/shm']
+
+_scratch = {'dir': None, 'pid': None, 'enabled': True}
+_models = {}
+
+
+def set_scratch_io(enabled):
+    """Enables or disables the scratch directory solver I/O.
+
+    If disabled, the calls are passed to pymzn as they are.
+    """
+    _scratch['enabled'] = enabled
+
+
+def scratch_dir():
+    """Returns the scratch directory of this process, creating it if needed."""
+    if _scratch['pid'] != os.getpid():
+        root = next((d for d in SCRATCH_DIRS if os.path.isdir(d)), None)
+        _scratch['dir'] = tempfile.mkdtemp(prefix='cls-', dir=root)
+        _scratch['pid'] = os.getpid()
+        Finalize(None, shutil.rmtree, args=(_scratch['dir'],),
+                 kwargs={'ignore_errors': True}, exitpriority=0)
+    return _scratch['dir']
+
+
+def _dzn_value(value):
+    if isinstance(value, np.ndarray):
+        if value.ndim == 2:
+            return 'array2d(1..{}, 1..{}, {})'.format(
+                value.shape[0], value.shape[1], _dzn_value(value.ravel())
+            )
+        if value.dtype.kind in 'if':
+            return '[' + ', '.join(map(repr, value.tolist())) + ']'
+        value = value.tolist()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        if all(type(v) in (int, float) for v in value):
+            return '[' + ', '.join(map(repr, value)) + ']'
+        return '[' + ', '.join(map(_dzn_value, value)) + ']'
+    if isinstance(value, (set, frozenset)):
+        return '{' + ', '.join(map(_dzn_value, sorted(value))) + '}'
+    if isinstance(value, str):
+        return '"{}"'.format(value)
+    raise TypeError('Cannot serialize {} to dzn'.format(type(value)))
+
+
+def dzn(data):
+    """Serializes a dictionary of data into a dzn string.
+
+    Supports scalars, one dimensional lists, tuples and numpy arrays, two
+    dimensional numpy arrays and sets. Numeric arrays are serialized in bulk.
+    """
+    return ''.join('{} = {};\n'.format(key, _dzn_value(value))
+                   for key, value in data.items())
+
+
+def _model_source(mzn):
+    if mzn not in _models:
+        with open(mzn) as f:
+            _models[mzn] = f.read()
+    return _models[mzn]
+
+
+def _scratch_file(suffix, content):
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=scratch_dir())
+    with os.fdopen(fd, 'w') as f:
+        f.write(content)
+    return path
+
+
+def _scratch_minizinc(mzn, *dzn_files, data=None, constraints=None,
+                      **kwargs):
+    source = _model_source(mzn)
+    if constraints:
+        source += '\n' + '\n'.join(constraints) + '\n'
+    model = _scratch_file('.mzn', source)
+    files = [model]
+    try:
+        if data:
+            files.append(_scratch_file('.dzn', dzn(data)))
+        return pymzn.minizinc(model, *dzn_files, *files[1:], **kwargs)
+    finally:
+        base = os.path.splitext(model)[0]
+        for path in files + [base + '.fzn', base + '.ozn']:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _solve(mzn, *dzn_files, data=None, **kwargs):
+    if isinstance(mzn, str) and mzn.endswith('.mzn') and (
+            _scratch['enabled'] or kwargs.get('constraints')):
+        return _scratch_minizinc(mzn, *dzn_files, data=data, **kwargs)
+    if kwargs.pop('constraints', None):
+        raise ValueError('Extra constraints need a model file')
+    return pymzn.minizinc(mzn, *dzn_files, data=data, **kwargs)
+
+
+# The cores used by the last call of each thread to `local_minizinc`
+_cores = threading.local()
+
+
+def local_minizinc(mzn, *dzn_files, data=None, **kwargs):
+    """Solves a MiniZinc problem in this process, see `minizinc`.
+
+    If the governor is enabled, the call waits for a solver token and its
+    `parallel` argument is capped to the number of tokens it gets.
+    """
+    if isinstance(kwargs.get('solver'), str):
+        # e.g. the solver of a fallback, see FALLBACKS
+        kwargs['solver'] = getattr(pymzn, kwargs['solver'])
+    governor = get_governor()
+    if governor is None:
+        _cores.count = kwargs.get('parallel') or 1
+        return _solve(mzn, *dzn_files, data=data, **kwargs)
+    with governor.acquire(kwargs.get('parallel', 1)) as grant:
+        _cores.count = len(grant)
+        if 'parallel' in kwargs:
+            kwargs['parallel'] = len(grant)
+        return _solve(mzn, *dzn_files, data=data, **kwargs)
+
+
+def _counted_minizinc(*args, **kwargs):
+    """The target of the solver workers: the answer of `local_minizinc` and
+    the number of cores it used."""
+    result = local_minizinc(*args, **kwargs)
+    return result, _cores.count
+
+
+""" Solver pool """
+
+
+_pool = {'pool': None}
+
+
+def start_pool(num_workers, timeout=None):
+    """Starts a pool of solver workers for the pooled solver calls.
+
+    Parameters
+    ----------
+    num_workers : int
+        The number of worker processes.
+    timeout : float
+        The per-job timeout in seconds, None for no timeout.
+    """
+    from cls.pool import SolverPool
+    stop_pool()
+    _pool['pool'] = SolverPool(num_workers, target=_counted_minizinc,
+                               timeout=timeout)
+    return _pool['pool']
+
+
+def stop_pool():
+    """Stops the pool of solver workers, if running."""
+    if _pool['pool'] is not None:
+        _pool['pool'].close()
+        _pool['pool'] = None
+
+
+""" Supervision
+
+Supervised calls run on a solver pool, whose workers are killed together with
+their solver processes when a call exceeds its hard deadline, i.e. its own
+`timeout` (or the default deadline) plus a grace period. A call whose worker
+or solver crashed is retried with the `FALLBACKS`, while a call past its
+deadline returns the incumbent given by the caller, if any. The outcomes are
+counted in `solver_stats.outcomes`, see `solverkit.supervision`.
+"""
+
+
+# Overrides of the arguments of the retries of a crashed call: the first retry
+# runs the same call again, the second switches to Gecode
+FALLBACKS = [{}, {'solver': 'gecode'}]
+
+_supervisor = {'pool': None, 'grace': 60.0, 'deadline': 3600.0}
+
+
+def start_supervisor(grace=60.0, deadline=3600.0, num_workers=1):
+    """Supervises the solver calls made by this process.
+
+    The calls not sent to the solver pool are run on dedicated workers, so
+    at most `num_workers` of them run at once: it should be at least the
+    number of threads of the process solving concurrently.
+
+    Parameters
+    ----------
+    grace : float
+        The seconds a call may run past its own timeout before being killed.
+    deadline : float
+        The hard deadline of the calls without a timeout, in seconds.
+    num_workers : int
+        The number of dedicated workers.
+    """
+    from cls.pool import SolverPool
+    stop_supervisor()
+    _supervisor['pool'] = SolverPool(num_workers, target=_counted_minizinc)
+    _supervisor['grace'] = grace
+    _supervisor['deadline'] = deadline
+    return _supervisor['pool']
+
+
+def stop_supervisor():
+    """Stops the supervision of the solver calls."""
+    if _supervisor['pool'] is not None:
+        _supervisor['pool'].close()
+        _supervisor['pool'] = None
+
+
+def _supervised(pool, mzn, dzn_files, data, incumbent, kwargs):
+    timeout = kwargs.get('timeout') or _supervisor['deadline']
+    return supervised_solve(
+        pool, (mzn, *dzn_files), {**kwargs, 'data': data},
+        timeout + _supervisor['grace'], FALLBACKS, solver_stats.outcomes,
+        incumbent=None if incumbent is None else (incumbent, None)
+    )
+
+
+def minizinc(mzn, *dzn_files, data=None, pooled=False, incumbent=None,
+             **kwargs):
+    """Solves a MiniZinc problem, see `pymzn.minizinc`.
+
+    All the solver calls of the domains and users go through this function,
+    which keeps track of them in `solver_stats` and charges them to the
+    scope of the calling thread in `cls.budget.cost_ledger`. Calls on model
+    files use the scratch directory I/O, unless disabled with
+    `set_scratch_io`.
+
+    Parameters
+    ----------
+    pooled : bool
+        Whether to run the call on the solver pool, if started. Meant for
+        short and frequent solves, e.g. feature vectors and utilities.
+    incumbent : object
+        The result to return if the call is killed past its deadline, when
+        supervised. If None, a `cls.pool.SolverTimeoutError` is raised.
+    constraints : list of str
+        MiniZinc items appended to the model of the call, which must be a
+        model file.
+    """
+    t0 = time()
+    # The cores held by the call, the requested ones unless it reports them
+    cores = kwargs.get('parallel') or 1
+    try:
+        pool = _pool['pool'] if pooled else None
+        if _supervisor['pool'] is not None:
+            result, used = _supervised(pool or _supervisor['pool'], mzn,
+                                       dzn_files, data, incumbent, kwargs)
+        elif pool is not None:
+            result, used = pool.solve(mzn, *dzn_files, data=data, **kwargs)
+        else:
+            result = local_minizinc(mzn, *dzn_files, data=data, **kwargs)
+            used = _cores.count
+        cores = used or cores
+        return result
+    finally:
+        elapsed = time() - t0
+        solver_stats.calls += 1
+        solver_stats.time += elapsed
+        cost_ledger.charge(elapsed, cores, kwargs.get('timeout'))
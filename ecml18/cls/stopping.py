@@ -0,0 +1,174 @@
+# -*- encoding: utf-8 -*-
+
+import numpy as np
+
+
+__all__ = ['STOP_REASONS', 'ArgmaxStable', 'DirectionStable',
+           'RegretPlateau', 'SolverBudget', 'make_stopping']
+
+
+""" Stopping criteria
+
+A simulation of a user stops when the user is satisfied, after the maximum
+number of iterations, or as soon as one of its detectors fires. A detector is
+called after each iteration with a dictionary describing it:
+
+    it           : the iteration
+    x, y, y_bar  : the context, the argmax and the improvement
+    phi_y        : the feature vector of the argmax
+    phi_y_bar    : the feature vector of the improvement
+    w0, w1       : the weights before and after the update
+    reg          : the regret of the argmax
+    t_solve      : the total solver time of the user so far, in seconds
+    pool         : the layouts inferred so far by the learner
+
+and returns whether the learning has converged, or should stop anyway. The
+reason of the stop is recorded in the traces and in the events, as the index
+of the reason in `STOP_REASONS`.
+"""
+
+
+STOP_REASONS = ['satisfied', 'max_iters', 'argmax', 'direction', 'plateau',
+                'budget']
+
+
+class ArgmaxStable(object):
+    """Fires when the updates stopped changing the argmax for k iterations.
+
+    The argmax of the context of an iteration is taken among the layouts of
+    the solution pool of the context, before and after the update, so that no
+    solve is needed. The iterations whose pool has less than two layouts of
+    the context, e.g. those of a context seen for the first time, cannot
+    change the argmax and are skipped. Without a pool, an iteration counts as
+    stable if the user did not change the argmax.
+
+    Parameters
+    ----------
+    k : int
+        The number of consecutive stable iterations.
+    """
+    reason = 'argmax'
+
+    def __init__(self, k=3):
+        self.k = k
+        self._stable = 0
+
+    def _changed(self, step):
+        """Whether the update changed the argmax, None if it cannot tell."""
+        pool = step.get('pool')
+        if pool is None:
+            return not np.array_equal(step['phi_y'], step['phi_y_bar'])
+        ys, phis = pool.layouts(step['x'])
+        if len(ys) < 2:
+            return None
+        return (np.argmax(phis.dot(step['w0'])) !=
+                np.argmax(phis.dot(step['w1'])))
+
+    def __call__(self, step):
+        changed = self._changed(step)
+        if changed is not None:
+            self._stable = 0 if changed else self._stable + 1
+        return self._stable >= self.k
+
+
+class DirectionStable(object):
+    """Fires when the direction of w changed less than eps for k iterations.
+
+    The change is one minus the cosine similarity of the weights before and
+    after the update. The scale of w does not matter to the argmax.
+
+    Parameters
+    ----------
+    eps : float
+        The maximum change of direction.
+    k : int
+        The number of consecutive iterations.
+    """
+    reason = 'direction'
+
+    def __init__(self, eps=1e-3, k=3):
+        self.eps = eps
+        self.k = k
+        self._stable = 0
+
+    def __call__(self, step):
+        w0, w1 = step['w0'], step['w1']
+        norm = np.linalg.norm(w0) * np.linalg.norm(w1)
+        change = 1.0 - w0.dot(w1) / norm if norm > 0 else 1.0
+        self._stable = self._stable + 1 if change < self.eps else 0
+        return self._stable >= self.k
+
+
+class RegretPlateau(object):
+    """Fires when the regret varied less than tol in the last iterations.
+
+    Parameters
+    ----------
+    window : int
+        The number of iterations considered.
+    tol : float
+        The maximum variation of the regret within the window.
+    """
+    reason = 'plateau'
+
+    def __init__(self, window=5, tol=1e-3):
+        self.window = window
+        self.tol = tol
+        self._regrets = []
+
+    def __call__(self, step):
+        self._regrets = (self._regrets + [step['reg']])[-self.window:]
+        return (len(self._regrets) == self.window and
+                max(self._regrets) - min(self._regrets) <= self.tol)
+
+
+class SolverBudget(object):
+    """Fires when the solver time of the user exceeds a budget.
+
+    The solver time is wall-clock time, of the solves of all the phases. The
+    budgets of `cls.budget.CostBudget` instead cap CPU-seconds, and make the
+    inferences approximate rather than stopping the user.
+
+    Parameters
+    ----------
+    seconds : float
+        The solver time budget of each user.
+    """
+    reason = 'budget'
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __call__(self, step):
+        return step['t_solve'] >= self.seconds
+
+
+def make_stopping(stop_argmax=0, stop_direction=0.0, stop_plateau=0,
+                  solver_budget=0.0, **kwargs):
+    """Returns a factory of the detectors of each user, None if no detector.
+
+    Parameters
+    ----------
+    stop_argmax : int
+        The k of `ArgmaxStable`, 0 to disable it.
+    stop_direction : float
+        The eps of `DirectionStable`, 0 to disable it.
+    stop_plateau : int
+        The window of `RegretPlateau`, 0 to disable it.
+    solver_budget : float
+        The seconds of `SolverBudget`, 0 to disable it.
+    """
+    def stopping():
+        detectors = []
+        if stop_argmax:
+            detectors.append(ArgmaxStable(stop_argmax))
+        if stop_direction:
+            detectors.append(DirectionStable(stop_direction))
+        if stop_plateau:
+            detectors.append(RegretPlateau(stop_plateau))
+        if solver_budget:
+            detectors.append(SolverBudget(solver_budget))
+        return detectors
+    if not (stop_argmax or stop_direction or stop_plateau or solver_budget):
+        return None
+    return stopping
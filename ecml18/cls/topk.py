@@ -0,0 +1,146 @@
+# -*- encoding: utf-8 -*-
+
+import pymzn
+import numpy as np
+
+from cls.solver import minizinc, UNSAT_ERRORS
+from cls.utils import freeze
+
+
+__all__ = ['layout_distance', 'nogood', 'select_diverse', 'infer_topk']
+
+
+""" Top-k diverse inference
+
+The k layouts are taken from the stream of improving solutions of a single
+optimization solve, keeping the best ones that are at least `min_distance`
+apart. If the stream has less than k such layouts, each missing layout is the
+best one at distance at least `min_distance` from those already selected,
+found by a solve of the inference model with the corresponding nogoods. The
+solves are capped, by default at 2k, so that a context whose solves time out
+before proving their optimum returns the layouts selected so far.
+
+The solves are not incremental: pymzn has no persistent solver session, so
+each nogood solve flattens the model again and optimizes from scratch. In the
+worst case a top-k inference costs the all-solutions solve plus max_solves - 1
+full inferences; it is cheap only when the stream of the first solve already
+has k diverse layouts, which is common for small min_distance.
+"""
+
+
+def _values(y, key):
+    return np.atleast_1d(np.asarray(y[key], dtype=np.int64))
+
+
+def layout_distance(y1, y2, keys):
+    """The L1 distance between two layouts over the given attributes."""
+    return int(sum(np.abs(_values(y1, k) - _values(y2, k)).sum()
+                   for k in keys))
+
+
+def nogood(y, min_distance, keys):
+    """A MiniZinc constraint excluding the layouts too close to y.
+
+    The layouts allowed are those whose L1 distance from y over the given
+    attributes is at least min_distance. The arrays of the attributes are
+    assumed to be indexed from 1.
+    """
+    terms = []
+    for key in keys:
+        if np.ndim(y[key]) == 0:
+            terms.append('abs({} - {})'.format(key, int(y[key])))
+        else:
+            terms.extend('abs({}[{}] - {})'.format(key, i + 1, int(v))
+                         for i, v in enumerate(y[key]))
+    return 'constraint {} >= {};'.format(' + '.join(terms), min_distance)
+
+
+def select_diverse(candidates, k, min_distance, keys):
+    """Greedily selects the best candidates at least min_distance apart.
+
+    Parameters
+    ----------
+    candidates : list of dict
+        The layouts, with their 'utility'.
+    k : int
+        The maximum number of layouts to select.
+    min_distance : int
+        The minimum distance between two selected layouts.
+    keys : list of str
+        The attributes over which the distance is computed.
+
+    Returns
+    -------
+    list of dict
+        The selected layouts, by decreasing utility.
+    """
+    selected = []
+    for y in sorted(candidates, key=lambda y: -y['utility']):
+        if len(selected) == k:
+            break
+        if all(layout_distance(y, s, keys) >= min_distance for s in selected):
+            selected.append(y)
+    return selected
+
+
+def _solutions(domain, x, w, timeout, constraints=None):
+    try:
+        return list(minizinc(domain.inference_file, data={**x, 'w': w},
+                             timeout=timeout,
+                             output_vars=domain._inference_vars,
+                             solver=pymzn.opturion, suppress_segfault=True,
+                             all_solutions=True, constraints=constraints))
+    except UNSAT_ERRORS:
+        return []
+
+
+def infer_topk(domain, x, w, k=5, min_distance=1, timeout=600,
+               max_solves=None):
+    """Solves a top-k diverse inference problem.
+
+    Parameters
+    ----------
+    domain : object
+        A domain with an `inference_file` maximizing the 'utility', its
+        `_inference_vars` and the `_distance_keys` of its layouts.
+    x : dict
+        The context.
+    w : numpy.ndarray
+        The weight vector of the utility.
+    k : int
+        The number of layouts to return.
+    min_distance : int
+        The minimum L1 distance between two returned layouts.
+    timeout : float
+        The timeout of each solve, in seconds.
+    max_solves : int
+        The maximum number of solves, 2k if None. Each solve flattens and
+        optimizes the model from scratch, see the module docstring.
+
+    Returns
+    -------
+    list of dict
+        At most k layouts by decreasing utility, less if the context has less
+        than k layouts at least min_distance apart, or if max_solves were not
+        enough to find them. The first is the argmax of the utility.
+    """
+    if max_solves is None:
+        max_solves = 2 * k
+    keys = domain._distance_keys
+    candidates = {}
+    for y in _solutions(domain, x, w, timeout):
+        candidates[freeze(y)] = y
+    selected = select_diverse(candidates.values(), k, min_distance, keys)
+    solves = 1
+    while 0 < len(selected) < k and solves < max_solves:
+        solves += 1
+        constraints = [nogood(y, min_distance, keys) for y in selected]
+        solutions = _solutions(domain, x, w, timeout, constraints)
+        if not solutions:
+            break
+        for y in solutions:
+            candidates[freeze(y)] = y
+        # The last solution is the best one far enough from the selected
+        # layouts, so the selection grows at each solve
+        selected = select_diverse(candidates.values(), k, min_distance, keys)
+    return selected
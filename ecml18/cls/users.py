@@ -1,11 +1,13 @@
 import os
 import re
 import pymzn
+import logging
 import numpy as np
 
 from subprocess import CalledProcessError
 from sklearn.utils import check_random_state
 from cls.utils import *
+from cls.solver import minizinc
 
 class User(object):
     """A user used in a simulation experiment.
@@ -80,13 +82,12 @@ def sample_users(domain, num_users=20, dist_w='uniform',
     return users
 
 
-class RoomsCoactiveFeedback(object):
-    
-    _improvement_keys = ["x","y","dx","dy","belong_to"]
-    _improvement_vars = ["x","y","dx","dy","belong_to","side_diff","utility"]
+class _CoactiveFeedback(object):
+    """The feedback of a simulated user, shared by the domains.
 
-    _utility_vars = ["utility"]
-    
+    The feedback of each domain adds the improvement of the objects, with
+    an `improve(x, y)` method.
+    """
     def __init__(self, domain, user, alpha=0.1, noise=None, seed=None):
         self.domain = domain
         self.user = user
@@ -94,9 +95,8 @@ class RoomsCoactiveFeedback(object):
         self.noise = noise
         self.rng = check_random_state(seed)
         self._y_stars = {}
-        directory = (os.path.dirname(os.path.realpath(__file__))) 
-        self.improvement_file = directory + "/rooms/improvement.mzn"
-        self.utility_file = directory + "/rooms/utility.mzn"
+        # The utility of the best layout shown so far in each context
+        self._u_bests = {}
 
     @property
     def uid(self):
@@ -144,17 +144,67 @@ class RoomsCoactiveFeedback(object):
         reg = u_star - u_y
 
         log = get_logger(__name__)
-        log.debug('''
-            y_star = {y_star}
-            u_y    = {u_y}
-            u_star = {u_star}
-            reg    = {reg}
-        ''', locals())
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('''
+                y_star = {y_star}
+                u_y    = {u_y}
+                u_star = {u_star}
+                reg    = {reg}
+            ''', y_star=y_star, u_y=u_y, u_star=u_star, reg=reg)
 
         return reg
 
-    def satisfied(self, *args, **kwargs):
-        return self.regret(*args, **kwargs) <= 0.0
+    def regret_bound(self, x, y):
+        """A regret estimate that needs no optimal solve.
+
+        If the optimal layout of the context is known, the regret is exact.
+        Otherwise it is a lower bound, given by the best layout of the context
+        shown to the user so far.
+
+        Parameters
+        ----------
+        x : dict
+            The context x.
+        y : dict
+            The object y.
+
+        Returns
+        -------
+        tuple
+            The regret and whether it is exact.
+        """
+        _frx = freeze(x)
+        if _frx in self._y_stars:
+            return self.regret(x, y), True
+        u_y = self.utility(x, y)
+        u_best = max(self._u_bests.get(_frx, u_y), u_y)
+        self._u_bests[_frx] = u_best
+        return u_best - u_y, False
+
+    def satisfied(self, x, y, exact=True):
+        """Whether the object y is optimal for the user in context x.
+
+        If not exact, the user is satisfied only if the optimal layout of the
+        context is already known, so that no optimal solve is needed.
+        """
+        if exact:
+            return self.regret(x, y) <= 0.0
+        reg, reg_exact = self.regret_bound(x, y)
+        return reg_exact and reg <= 0.0
+
+
+class RoomsCoactiveFeedback(_CoactiveFeedback):
+    
+    _improvement_keys = ["x","y","dx","dy","belong_to"]
+    _improvement_vars = ["x","y","dx","dy","belong_to","side_diff","utility"]
+
+    _utility_vars = ["utility"]
+    
+    def __init__(self, domain, user, alpha=0.1, noise=None, seed=None):
+        super().__init__(domain, user, alpha=alpha, noise=noise, seed=seed)
+        directory = (os.path.dirname(os.path.realpath(__file__))) 
+        self.improvement_file = directory + "/rooms/improvement.mzn"
+        self.utility_file = directory + "/rooms/utility.mzn"
 
     def improve(self, x, y, timeout=600):
 
@@ -164,6 +214,7 @@ class RoomsCoactiveFeedback(object):
             y_star = self._y_stars[freeze(x)]
         else :
             y_star = self.domain.infer(x,self.w_star)
+            self._y_stars[frx] = y_star
 
         y_util_data = {
                 "input_x" : y["x"],
@@ -175,12 +226,13 @@ class RoomsCoactiveFeedback(object):
                 **x
                 }
 
-        y_util = pymzn.minizinc(self.utility_file, 
+        y_util = minizinc(self.utility_file, 
                             data=y_util_data,
                             output_vars=["utility"],
                                 timeout=timeout, 
                             solver=pymzn.opturion,
-                            suppress_segfault=True
+                            suppress_segfault=True,
+                            pooled=True
                 )[-1]["utility"]
 
         improve_data = {
@@ -190,12 +242,13 @@ class RoomsCoactiveFeedback(object):
                     "alpha" : self.alpha,
                     "w" : self.w_star,
                      **x}
-        sol = pymzn.minizinc(self.improvement_file, 
+        sol = minizinc(self.improvement_file, 
                             data=improve_data,
                             output_vars=RoomsCoactiveFeedback._improvement_vars,
                                 timeout=timeout, 
                             solver=pymzn.opturion,
-                            suppress_segfault=True
+                            suppress_segfault=True,
+                            incumbent=[y]
                 )[-1]
 
         #def u(y):
@@ -209,7 +262,7 @@ class RoomsCoactiveFeedback(object):
         #print("y_bar: ",sol)
         return sol
 
-class TablesCoactiveFeedback(object):
+class TablesCoactiveFeedback(_CoactiveFeedback):
     # TODO
 
     _improvement_keys = ["x","y","dx","dy"]
@@ -218,74 +271,11 @@ class TablesCoactiveFeedback(object):
     _utility_vars = ["utility"]
     
     def __init__(self, domain, user, alpha=0.1, noise=None, seed=None):
-        self.domain = domain
-        self.user = user
-        self.alpha = alpha
-        self.noise = noise
-        self.rng = check_random_state(seed)
-        self._y_stars = {}
+        super().__init__(domain, user, alpha=alpha, noise=noise, seed=seed)
         directory = (os.path.dirname(os.path.realpath(__file__))) 
         self.improvement_file = directory + "/tables/improve.mzn"
         self.utility_file = directory + "/tables/utility.mzn"
 
-    @property
-    def uid(self):
-        return self.user.uid
-
-    @property
-    def w_star(self):
-        return self.user.w_star
-
-    @property
-    def features(self):
-        return self.user.features
-
-    def draw_context(self, it):
-        return self.domain.draw_context(self.user, it)
-
-    def phi_star(self, x, y):
-        return self.domain.phi(x, y, self.features)
-
-    def utility(self, x, y):
-        """The utility function of the user.
-
-        Calculate the utility function of an object y in context x, with respect
-        to the user weights and features.
-
-        Parameters
-        ----------
-        x : dict
-            The context x.
-        y : dict
-            The object y.
-        """
-        return self.w_star.dot(self.phi_star(x, y))
-
-    def regret(self, x, y):
-        _frx = freeze(x)
-        if _frx in self._y_stars:
-            y_star = self._y_stars[_frx]
-        else:
-            y_star = self.domain.infer(x, self.w_star, self.features)
-            self._y_stars[_frx] = y_star
-
-        u_y = self.utility(x, y)
-        u_star = self.utility(x, y_star)
-        reg = u_star - u_y
-
-        log = get_logger(__name__)
-        log.debug('''
-            y_star = {y_star}
-            u_y    = {u_y}
-            u_star = {u_star}
-            reg    = {reg}
-        ''', locals())
-
-        return reg
-
-    def satisfied(self, *args, **kwargs):
-        return self.regret(*args, **kwargs) <= 0.0
-
     def improve(self, x, y):
 
         if self.satisfied(x,y): return y
@@ -296,6 +286,7 @@ class TablesCoactiveFeedback(object):
             y_star = self._y_stars[freeze(x)]
         else :
             y_star = self.domain.infer(x,self.w_star)
+            self._y_stars[frx] = y_star
 
 
         improve_data = {
@@ -310,11 +301,12 @@ class TablesCoactiveFeedback(object):
                     "input_star_dy" : y_star["dy"],
                     "w" : self.w_star,
                      **x}
-        sol = pymzn.minizinc(self.improvement_file, 
+        sol = minizinc(self.improvement_file, 
                             data=improve_data,
                             output_vars=TablesCoactiveFeedback._improvement_vars,
                             solver=pymzn.opturion,
-                            suppress_segfault=True
+                            suppress_segfault=True,
+                            incumbent=[y]
                 )[-1]
 
         #def u(y):
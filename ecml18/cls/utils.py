@@ -1,7 +1,10 @@
 import re
+import queue
 import inspect
 import logging
 import argparse
+import contextvars
+import logging.handlers
 import numpy as np
 
 from itertools import product, chain
@@ -11,7 +14,8 @@ from sklearn.utils import check_random_state
 
 
 __all__ = ['get_class', 'get_defaults', 'array2string', 'dict2str', 'subdict',
-           'freeze', 'get_logger', 'ContextFilter', 'mzn_range', 'mzn_dot',
+           'freeze', 'get_logger', 'start_logging',
+           'ContextFilter', 'ContextFormatter', 'mzn_range', 'mzn_dot',
            'dot_type', 'add_prefix', 'strip_prefix', 'parse_remainder']
 
 
@@ -142,39 +146,69 @@ class BraceMessage(object):
         return self.fmt.format(*args, **kwargs)
 
 
+_log_context = contextvars.ContextVar('log_context', default=())
+
+
 class ContextFilter(logging.Filter):
-    """A filter to add contextual information in the log message.
+    """A filter to attach the current logging context to the record.
+
+    The filter should be attached to the handlers, so that only the records
+    passing the level check pay for it. The context is only attached here,
+    formatting is left to the `ContextFormatter`.
+    """
+    def filter(self, record):
+        record.context = _log_context.get()
+        return True
+
+
+class ContextFormatter(logging.Formatter):
+    """A formatter prepending the record context to the log message.
 
     Parameter
     ---------
-    context : str
-        The context to add to the logger.
     sep : str
         The separation string between the context and the message.
     """
-    def __init__(self, context, sep=', '):
-        self.context = context
+    def __init__(self, fmt=None, datefmt=None, sep=', '):
+        super().__init__(fmt, datefmt)
         self.sep = sep
 
-    def filter(self, record):
-        record.msg = self.sep.join([self.context, str(record.msg)])
-        return True
+    def format(self, record):
+        context = getattr(record, 'context', ())
+        if context:
+            record = logging.makeLogRecord(record.__dict__)
+            parts = [fmt.format(*args) for fmt, args in context]
+            parts.append(record.getMessage())
+            record.msg, record.args = self.sep.join(parts), ()
+        return super().format(record)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """A queue handler leaving the formatting to the listener thread."""
+
+    def prepare(self, record):
+        return record
 
 
 class MultilineLoggerAdapter(logging.LoggerAdapter):
     """An adapter to allow multiline logging messages.
+
+    Messages are dedented, split and wrapped into lazy `BraceMessage` only if
+    the logger is enabled for the given level.
     """
     def __init__(self, logger, extra=None):
         super().__init__(logger, extra or {})
 
-    def push_context(self, context, sep=', '):
-        self.logger.addFilter(ContextFilter(context, sep))
+    def push_context(self, fmt, *args):
+        _log_context.set(_log_context.get() + ((fmt, args),))
 
     def pop_context(self):
-        self.logger.filters.pop()
+        _log_context.set(_log_context.get()[:-1])
 
     def log(self, level, msg, *args,
             exc_info=None, extra=None, stack_info=False, **kwargs):
+        if not self.isEnabledFor(level):
+            return
         msg = dedent(str(msg)).strip()
         for msg in msg.splitlines():
             self.logger._log(level, BraceMessage(msg, args, kwargs), (),
@@ -186,6 +220,52 @@ def get_logger(name):
     return MultilineLoggerAdapter(logging.getLogger(name))
 
 
+def start_logging(filename=None, level=logging.INFO, stream=None,
+                  fmt=logging.BASIC_FORMAT):
+    """Configures the root logger to write the logs in a background thread.
+
+    Records are put in a queue by the logging calls and formatted and written
+    by a `QueueListener` thread. Records not passing the level check are
+    discarded before any formatting.
+
+    Parameters
+    ----------
+    filename : str
+        The log file. If None, no log file is written.
+    level : int or str
+        The logging level of the root logger.
+    stream : file-like object
+        An additional stream where to write the logs, e.g. sys.stdout.
+    fmt : str
+        The format string of the log records.
+
+    Returns
+    -------
+    logging.handlers.QueueListener
+        The running listener, call its stop() method to flush the logs.
+    """
+    formatter = ContextFormatter(fmt)
+    handlers = []
+    if filename:
+        handlers.append(logging.FileHandler(filename, mode='w+'))
+    if stream:
+        handlers.append(logging.StreamHandler(stream))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    queue_handler = _DeferredQueueHandler(records)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(records, *handlers)
+    listener.start()
+    return listener
+
+
 
 """ Mzn utilities """
 
@@ -11,8 +11,18 @@ import os.path
 from sklearn.utils import check_random_state
 
 from cls.utils import *
-from cls.coactive import PreferencePerceptron
-from cls.coactive import CoactiveLearning
+from cls.coactive import PreferencePerceptron, AveragedPerceptron
+from cls.coactive import AdaptivePerceptron, NormalizedPerceptron
+from cls.coactive import ExponentiatedPerceptron
+from cls.coactive import CoactiveLearning, PopulationLearning
+from cls.budget import CostBudget, cost_ledger, cost_report
+from cls.events import EventWriter
+from cls.replay import REPLAY_MODES, SolverRecord, ReplayDomain, ReplayFeedback
+from cls.service import ServiceDomain
+from cls.solver import start_pool, stop_pool
+from cls.solver import start_supervisor, stop_supervisor
+from cls.stopping import make_stopping
+from cls.governor import start_governor, stop_governor
 from cls.users import User, sample_users, RoomsCoactiveFeedback, TablesCoactiveFeedback
 from cls.rooms import Rooms
 from cls.tables import Tables
@@ -21,6 +31,10 @@ from itertools import combinations
 
 LEARNERS = {
     'pp': PreferencePerceptron,
+    'avg': AveragedPerceptron,
+    'ada': AdaptivePerceptron,
+    'norm': NormalizedPerceptron,
+    'eg': ExponentiatedPerceptron,
 }
 
 
@@ -74,29 +88,110 @@ def simulate(**kwargs):
             domain = shelf['domain']
 
     if not kwargs['output_shelf']:
-        import os.path
         usrfile, ext = os.path.splitext(kwargs['user_shelf'])
         outfile =  usrfile + '_trace' + ext
     else:
         outfile = kwargs['output_shelf']
 
+    if kwargs.get('events_file'):
+        eventsfile = kwargs['events_file']
+    else:
+        eventsfile = os.path.splitext(outfile)[0] + '.events'
+
     u = int(kwargs['user'])
     n = int(kwargs['num_users']) or len(users)
 
-    for user in users[u:n]:
-        learner = LEARNERS[kwargs['learner']]()
-        if isinstance(domain, Rooms):
-            user_model = RoomsCoactiveFeedback(domain, user)
-        else:
-            user_model = TablesCoactiveFeedback(domain, user)
-        model = CoactiveLearning(domain, learner,seed=kwargs["seed"])
-        for t in model.simulate(user_model, **kwargs):
+    if kwargs.get('solver_workers'):
+        start_pool(kwargs['solver_workers'])
+    if kwargs.get('solver_grace'):
+        # One worker per thread solving at once, see PopulationLearning
+        start_supervisor(kwargs['solver_grace'], kwargs['solver_deadline'],
+                         max(kwargs.get('population_workers') or 0, 1))
+
+    if isinstance(domain, Rooms):
+        feedback_class = RoomsCoactiveFeedback
+    else:
+        feedback_class = TablesCoactiveFeedback
+    if kwargs.get('service'):
+        domain_file = kwargs.get('domain_shelf') or kwargs['user_shelf']
+        domain = ServiceDomain(kwargs['service'], domain_file, domain)
+    record = None
+    if kwargs.get('replay'):
+        record = SolverRecord(kwargs['replay'], kwargs['replay_mode'])
+        domain = ReplayDomain(domain, record)
+
+    stopping = make_stopping(**kwargs)
+    cost_ledger.reset(outfile)
+    budget = CostBudget(kwargs['user_budget'], kwargs['context_budget'],
+                        kwargs['experiment_budget'], kwargs['min_timeout'])
+
+    def append_trace(uid, t):
+        with shelve.open(outfile, writeback=True) as outshelf:
+            if 'traces' not in outshelf:
+                outshelf['traces'] = {}
+            if uid not in outshelf['traces']:
+                outshelf['traces'][uid] = []
+            outshelf['traces'][uid].append(t)
+
+    with EventWriter(eventsfile, domain.num_features) as events:
+        user_models = []
+        for user in users[u:n]:
+            user_model = feedback_class(domain, user,
+                                        alpha=kwargs.get('alpha', 0.1))
+            if record is not None:
+                user_model = ReplayFeedback(user_model, record)
+            user_models.append(user_model)
+
+        if kwargs.get('population_workers'):
+            # All the users in lock step, with their solves in parallel
+            model = PopulationLearning(
+                domain, LEARNERS[kwargs['learner']](), len(user_models),
+                seed=kwargs['seed'], num_workers=kwargs['population_workers'],
+                warm_start=kwargs['warm_start']
+            )
+            for uid, t in model.simulate(user_models, events=events,
+                                         stopping=stopping, budget=budget,
+                                         **kwargs):
+                append_trace(uid, t)
             with shelve.open(outfile, writeback=True) as outshelf:
-                if 'traces' not in outshelf:
-                    outshelf['traces'] = {}
-                if user.uid not in outshelf['traces']:
-                    outshelf['traces'][user.uid] = []
-                outshelf['traces'][user.uid].append(t)
+                outshelf['completed'] = (outshelf.get('completed', []) +
+                                         [user.uid for user in users[u:n]])
+                outshelf.setdefault('stop_reasons', {}).update(
+                    model.stop_reasons)
+        else:
+            for user, user_model in zip(users[u:n], user_models):
+                learner = LEARNERS[kwargs['learner']]()
+                model = CoactiveLearning(domain, learner,seed=kwargs["seed"],
+                                         warm_start=kwargs['warm_start'])
+                for t in model.simulate(user_model, events=events,
+                                        stopping=stopping, budget=budget,
+                                        **kwargs):
+                    append_trace(user.uid, t)
+                with shelve.open(outfile, writeback=True) as outshelf:
+                    outshelf['completed'] = outshelf.get('completed', []) + [user.uid]
+                    outshelf.setdefault('stop_reasons', {})[user.uid] = \
+                        model.stop_reason
+
+    with shelve.open(outfile) as outshelf:
+        outshelf['costs'] = {
+            'total': cost_ledger.total(),
+            'phase': cost_ledger.summary('phase'),
+            'user': cost_ledger.summary('user'),
+            'context': cost_ledger.summary('context'),
+            'budget': dict(budget.stats)
+        }
+    print(cost_report())
+    if budget:
+        print('budget: {}'.format(dict(budget.stats)))
+    get_logger(__name__).info('solver costs: {}', cost_ledger.total())
+
+    if kwargs.get('service'):
+        domain.close()
+    if record is not None:
+        get_logger(__name__).info('solver record: {}', dict(record.stats))
+        record.close()
+    stop_supervisor()
+    stop_pool()
 
 
 if __name__ == '__main__':
@@ -107,6 +202,15 @@ if __name__ == '__main__':
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='display logs on standard output')
     parser.add_argument('--log', default='srai.log', help='Log file')
+    parser.add_argument('--log-level', default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='the logging level')
+    parser.add_argument('--solver-tokens', type=int, default=None,
+                        help=('the number of solver threads allowed to run at '
+                              'once on the machine, shared by all the '
+                              'processes using the same value; 0 disables '
+                              'the limit, default inherits it from the '
+                              'parent process (e.g. sweep.py)'))
 
     subparsers = parser.add_subparsers()
 
@@ -197,6 +301,11 @@ if __name__ == '__main__':
         '-O', '--output-shelf',
         help='the file where to store the output trace'
     )
+    simulate_parser.add_argument(
+        '-E', '--events-file',
+        help=('the file where to store the event log '
+              '(default: the output shelf with extension .events)')
+    )
     simulate_parser.add_argument(
         '-u', '--user', type=int, default=0,
         help='user to start the simulateation with'
@@ -209,10 +318,107 @@ if __name__ == '__main__':
         '-L', '--learner', choices=list(LEARNERS.keys()), default='pp',
         help='the learning algorithm to use'
     )
+    simulate_parser.add_argument(
+        '-T', '--max-iters', type=int, default=100,
+        help='the maximum number of iterations per user'
+    )
     simulate_parser.add_argument(
         '--timeout', type=int, default=600,
         help='timeout for inference'
     )
+    simulate_parser.add_argument(
+        '--population-workers', type=int, default=0,
+        help=('simulate all the users in lock step, with their weights in a '
+              'single matrix and this many solves in parallel; 0 simulates '
+              'the users one after the other')
+    )
+    simulate_parser.add_argument(
+        '--regret', choices=['exact', 'bound'], default='exact',
+        help=('compute the exact regrets, or lower bounds from the best '
+              'layouts found so far, with no optimal solve of their own')
+    )
+    simulate_parser.add_argument(
+        '--stop-argmax', type=int, default=0, metavar='K',
+        help=('stop a user when the updates did not change the argmax of '
+              'the pooled layouts for K iterations; 0 disables it')
+    )
+    simulate_parser.add_argument(
+        '--stop-direction', type=float, default=0.0, metavar='EPS',
+        help=('stop a user when the direction of the weights changed less '
+              'than EPS (cosine distance) for 3 iterations; 0 disables it')
+    )
+    simulate_parser.add_argument(
+        '--stop-plateau', type=int, default=0, metavar='N',
+        help=('stop a user when the regret did not vary in the last N '
+              'iterations; 0 disables it')
+    )
+    simulate_parser.add_argument(
+        '--solver-budget', type=float, default=0.0, metavar='SECONDS',
+        help=('stop a user after this many wall-clock seconds of solver '
+              'time, in all the phases; unlike --user-budget, the user stops '
+              'rather than going on with approximate inferences; 0 disables '
+              'it')
+    )
+    simulate_parser.add_argument(
+        '--user-budget', type=float, default=0.0, metavar='SECONDS',
+        help=('CPU-seconds (wall-clock seconds times cores) of solver time '
+              'of each user, past which its inferences are approximated; '
+              'the user goes on until a stop, e.g. --solver-budget; 0 for '
+              'no cap')
+    )
+    simulate_parser.add_argument(
+        '--context-budget', type=float, default=0.0, metavar='SECONDS',
+        help=('CPU-seconds of solver time of each context of a user, past '
+              'which its inferences are approximated; 0 for no cap')
+    )
+    simulate_parser.add_argument(
+        '--experiment-budget', type=float, default=0.0, metavar='SECONDS',
+        help=('CPU-seconds of solver time of the whole simulation, past '
+              'which all the inferences are approximated; 0 for no cap')
+    )
+    simulate_parser.add_argument(
+        '--min-timeout', type=float, default=10,
+        help=('timeout of the inferences past a budget, when the solution '
+              'pool of their context is empty')
+    )
+    simulate_parser.add_argument(
+        '--solver-workers', type=int, default=0,
+        help=('number of persistent solver processes for the short solves '
+              '(phi, utility), 0 to solve in the main process')
+    )
+    simulate_parser.add_argument(
+        '--solver-grace', type=float, default=0,
+        help=('supervise the solver calls: seconds a call may run past its '
+              'timeout before being killed (e.g. 60); crashed calls are '
+              'retried and killed inferences fall back to the incumbent; 0 '
+              'disables the supervision')
+    )
+    simulate_parser.add_argument(
+        '--warm-start', action='store_true',
+        help=('bound the inferences with the best layout inferred so far in '
+              'their context; with a timeout, the inferences can then differ '
+              'from the cold ones')
+    )
+    simulate_parser.add_argument(
+        '--replay',
+        help=('a store of solver answers (created if missing) to replay the '
+              'recorded answers from and to record the new ones to')
+    )
+    simulate_parser.add_argument(
+        '--replay-mode', choices=REPLAY_MODES, default='replay',
+        help=('record: always solve; replay: solve only the answers not '
+              'recorded; strict: fail on the answers not recorded')
+    )
+    simulate_parser.add_argument(
+        '--service',
+        help=('address of a layout synthesis service (interface/server.py) '
+              'to run the domain solves on, e.g. http://127.0.0.1:8765; its '
+              '--domains-dir must contain the domain shelf')
+    )
+    simulate_parser.add_argument(
+        '--solver-deadline', type=float, default=3600,
+        help='seconds after which supervised calls without timeout are killed'
+    )
 
     coactive_parser = simulate_subparsers.add_parser(
         'coactive', formatter_class=fmt,
@@ -226,13 +432,19 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
-    handlers = [logging.FileHandler(args.log, mode='w+')]
-    if args.verbose:
-        handlers.append(logging.StreamHandler(sys.stdout))
-    logging.basicConfig(level=logging.DEBUG, handlers=handlers)
+    stream = sys.stdout if args.verbose else None
+    listener = start_logging(args.log, level=args.log_level, stream=stream)
 
-    if hasattr(args, 'cmd'):
-        args.cmd(**vars(args))
-    else:
-        parser.print_help()
+    if args.solver_tokens == 0:
+        stop_governor()
+    elif args.solver_tokens is not None:
+        start_governor(args.solver_tokens)
+
+    try:
+        if hasattr(args, 'cmd'):
+            args.cmd(**vars(args))
+        else:
+            parser.print_help()
+    finally:
+        listener.stop()
 
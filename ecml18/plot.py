@@ -1,11 +1,21 @@
 #!/usr/bin/env python3
 
+import os
 import re
+import sys
+import glob
 import shelve
+import hashlib
 import argparse
 import numpy as np
 import matplotlib.pyplot as plt
 
+from time import sleep
+from datetime import timedelta
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from cls.events import EventReader, load_events
+
 plt.style.use('ggplot')
 
 marks = ['s-', 'D-', '<-', '^-', '>-', 'v-']
@@ -41,45 +51,154 @@ def label_from_filename(path):
     return path.split("/")[-1].partition(".")[0]
 
 
+def pad_traces(traces):
+    """Stacks a list of traces into a zero-padded array.
+
+    Parameters
+    ----------
+    traces : list of lists of tuples
+        The traces, i.e. lists of (regret, time, ...) tuples.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (len(traces), max_len, 2) with regrets and times.
+    numpy.ndarray
+        The lengths of the traces.
+    """
+    lengths = np.array([len(trace) for trace in traces], dtype=np.int64)
+    data = np.zeros((len(traces), lengths.max(initial=0), 2))
+    mask = np.arange(data.shape[1]) < lengths[:, None]
+    if mask.any():
+        data[mask] = [step[:2] for trace in traces for step in trace]
+    return data, lengths
+
+
+def events_traces(events):
+    """Stacks the events of an event log into a zero-padded array.
+
+    Returns the same arrays of `pad_traces`, with one trace per user.
+    """
+    uids, rows = np.unique(events['uid'], return_inverse=True)
+    its = events['it']
+    lengths = np.zeros(len(uids), dtype=np.int64)
+    np.maximum.at(lengths, rows, its + 1)
+    data = np.zeros((len(uids), lengths.max(initial=0), 2))
+    data[rows, its, 0] = events['reg']
+    data[rows, its, 1] = events['t']
+    return data, lengths
+
+
+def fit_iters(data, lengths, iters):
+    """Truncates or pads the traces in data to the given iterations."""
+    if data.shape[1] >= iters:
+        return data[:, :iters], np.minimum(lengths, iters)
+    padded = np.zeros((data.shape[0], iters, data.shape[2]))
+    padded[:, :data.shape[1]] = data
+    return padded, lengths
+
+
 def regret_matrix(traces, iters):
-    return np.array([[trace[i][0] if i < len(trace) else 0.0
-                      for i in range(iters)] for trace in traces])
+    data, lengths = fit_iters(*pad_traces(traces), iters)
+    return data[:, :, 0]
 
 
 def avg_regret_matrix(traces, iters):
-    avg_regs = []
-    for trace in traces:
-        avg_reg = []
-        for i in range(iters):
-            if i == 0:
-                avg_reg.append(trace[i][0])
-            elif i < len(trace):
-                reg_t = (avg_reg[-1] + trace[i][0])
-                avg_reg.append(reg_t)
-            else:
-                avg_reg.append(avg_reg[-1])
-        for i in range(iters):
-            avg_reg[i] /= i + 1
-        avg_reg.append(avg_reg[-1])
-        avg_regs.append(avg_reg)
-    return np.array(avg_regs)
-
+    return avg_regret(*fit_iters(*pad_traces(traces), iters))
 
 
 def time_matrix(traces, iters):
-    times = []
-    for trace in traces:
-        time = [0.0]
-        for i in range(iters):
-            if i < len(trace):
-                time.append(time[-1] + trace[i][1])
-            else:
-                time.append(time[-1])
-        times.append(time)
-    return np.array(times)
+    return cum_time(*fit_iters(*pad_traces(traces), iters))
+
+
+def avg_regret(data, lengths):
+    """Average regret up to each iteration, for padded traces.
+
+    Iterations past the end of a trace count as zero regret. The last column
+    is repeated, so the result has shape (num_traces, iters + 1).
+    """
+    iters = data.shape[1]
+    avg = np.cumsum(data[:, :, 0], axis=1) / np.arange(1, iters + 1)
+    return np.concatenate([avg, avg[:, -1:]], axis=1)
+
+
+def cum_time(data, lengths):
+    """Cumulative time at each iteration, for padded traces.
+
+    The first column is zero, so the result has shape (num_traces, iters + 1).
+    """
+    time = np.zeros((data.shape[0], data.shape[1] + 1))
+    np.cumsum(data[:, :, 1], axis=1, out=time[:, 1:])
+    return time
+
+
+def _store_files(input_file):
+    return glob.glob(glob.escape(input_file) + '*')
+
+
+def _cache_file(input_file, cache_dir):
+    key = hashlib.sha1(os.path.abspath(input_file).encode('utf-8'))
+    return os.path.join(cache_dir, key.hexdigest() + '.npz')
+
 
+def _stamp(input_file):
+    stats = [os.stat(f) for f in _store_files(input_file)]
+    return np.array([[s.st_mtime_ns, s.st_size] for s in stats])
 
-def plot_reg(input_files, output_file, iters, no_std=True):
+
+def load_traces(input_file, cache_dir=None):
+    """Loads the traces of an output shelf or event log as padded arrays.
+
+    If cache_dir is given, the arrays are cached there and reused as long as
+    the input file is not modified.
+    """
+    if cache_dir:
+        cache_file = _cache_file(input_file, cache_dir)
+        stamp = _stamp(input_file)
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as cache:
+                if np.array_equal(cache['stamp'], stamp):
+                    return cache['data'], cache['lengths']
+
+    if input_file.endswith('.events'):
+        events = load_events(input_file, fields=['uid', 'it', 'reg', 't'])
+        data, lengths = events_traces(events)
+    else:
+        with shelve.open(input_file, 'r') as shelf:
+            traces = list(shelf['traces'].values())
+        data, lengths = pad_traces(traces)
+    if 's4' in input_file:
+        data, lengths = data[0:4], lengths[0:4]
+
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(cache_file, data=data, lengths=lengths, stamp=stamp)
+    return data, lengths
+
+
+def load_groups(input_files, iters, cache_dir=None, jobs=None):
+    """Loads the groups of input files, each file once and in parallel.
+
+    Returns
+    -------
+    list of tuples
+        For each group, the (data, lengths) padded arrays of all its traces,
+        fit to the given iterations.
+    """
+    files = sorted({f for group in input_files for f in group})
+    load = partial(load_traces, cache_dir=cache_dir)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        loaded = dict(zip(files, executor.map(load, files)))
+
+    groups = []
+    for group in input_files:
+        fit = [fit_iters(*loaded[f], iters) for f in group]
+        groups.append((np.concatenate([data for data, _ in fit]),
+                       np.concatenate([lengths for _, lengths in fit])))
+    return groups
+
+
+def plot_reg(input_files, output_file, iters, no_std=True, groups=None):
 
     fig = plt.figure()
     ax = fig.add_subplot(111)
@@ -92,17 +211,13 @@ def plot_reg(input_files, output_file, iters, no_std=True):
 
     y_max = 0
 
-    for i, input_file_group in enumerate(input_files):
-        traces = []
-        for input_file in input_file_group:
-            with shelve.open(input_file) as shelf:
-                if 's4' in input_file:
-                    traces += list(shelf['traces'].values())[0:4]
-                else:
-                    traces += shelf['traces'].values()
+    if groups is None:
+        groups = load_groups(input_files, iters)
+
+    for i, (input_file_group, group) in enumerate(zip(input_files, groups)):
         label = get_label(input_file_group)
 
-        reg = avg_regret_matrix(traces, iters)
+        reg = avg_regret(*group)
         median = np.median(reg, axis=0)
         std = np.std(reg, axis=0) / np.sqrt(reg.shape[0])
 
@@ -121,9 +236,10 @@ def plot_reg(input_files, output_file, iters, no_std=True):
     ax.legend()
 
     fig.savefig(output_file + '_reg.png', dpi=300, bbox_inches='tight')
+    plt.close(fig)
 
 
-def plot_time(input_files, output_file, iters, no_std=True):
+def plot_time(input_files, output_file, iters, no_std=True, groups=None):
 
     fig = plt.figure()
     ax = fig.add_subplot(111)
@@ -136,17 +252,13 @@ def plot_time(input_files, output_file, iters, no_std=True):
 
     y_max = 0
 
-    for i, input_file_group in enumerate(input_files):
-        traces = []
-        for input_file in input_file_group:
-            with shelve.open(input_file) as shelf:
-                if 's4' in input_file:
-                    traces += list(shelf['traces'].values())[0:4]
-                else:
-                    traces += shelf['traces'].values()
+    if groups is None:
+        groups = load_groups(input_files, iters)
+
+    for i, (input_file_group, group) in enumerate(zip(input_files, groups)):
         label = get_label(input_file_group)
 
-        time = time_matrix(traces, iters)
+        time = cum_time(*group)
         median = np.median(time, axis=0) / 60
         std = np.std(time, axis=0) / np.sqrt(time.shape[0])
 
@@ -164,6 +276,7 @@ def plot_time(input_files, output_file, iters, no_std=True):
     ax.legend(loc="upper left")
 
     fig.savefig(output_file + '_time.png', dpi=300, bbox_inches='tight')
+    plt.close(fig)
 
 
 def aggregate(files):
@@ -188,6 +301,153 @@ def aggregate(files):
     return groups
 
 
+class TraceMonitor(object):
+    """Incremental aggregation of the event log of a running simulation.
+
+    Each poll only reads the chunks appended to the log since the last one, and
+    updates the padded regret and time arrays and the throughput counters. A
+    user is finished once an event of it has a stop code, e.g. when it was
+    satisfied or stopped early, or after `iters` iterations.
+
+    Parameters
+    ----------
+    input_file : str
+        The event log file.
+    iters : int
+        The number of iterations of the simulation.
+    num_users : int
+        The number of users of the simulation, if known.
+    """
+    def __init__(self, input_file, iters, num_users=None):
+        self.reader = EventReader(input_file)
+        self.iters = iters
+        self.num_users = num_users
+        self.offset = 0
+        self.rows = {}
+        self.data = np.zeros((0, iters, 2))
+        self.lengths = np.zeros(0, dtype=np.int64)
+        self.stopped = np.zeros(0, dtype=bool)
+        self.num_events = 0
+        self.num_solves = 0
+        self.t_solve = 0.0
+        self.t_first = np.inf
+        self.t_last = -np.inf
+
+    def poll(self):
+        """Reads the new events of the log, returns their number."""
+        if not os.path.exists(self.reader.path):
+            return 0
+        num_new = 0
+        for offset, events, _ in self.reader.chunks(self.offset):
+            self.offset = offset
+            self._add(events[events['it'] < self.iters])
+            num_new += len(events)
+        return num_new
+
+    def _add(self, events):
+        for uid in events['uid']:
+            if uid not in self.rows:
+                self.rows[uid] = len(self.rows)
+        num_rows = len(self.rows) - self.data.shape[0]
+        if num_rows > 0:
+            self.data = np.concatenate(
+                [self.data, np.zeros((num_rows, self.iters, 2))])
+            self.lengths = np.concatenate(
+                [self.lengths, np.zeros(num_rows, dtype=np.int64)])
+            self.stopped = np.concatenate(
+                [self.stopped, np.zeros(num_rows, dtype=bool)])
+
+        rows = np.array([self.rows[uid] for uid in events['uid']],
+                        dtype=np.int64)
+        its = events['it']
+        self.data[rows, its, 0] = events['reg']
+        self.data[rows, its, 1] = events['t']
+        np.maximum.at(self.lengths, rows, its + 1)
+        if 'stop' in events.dtype.names:
+            self.stopped[rows[events['stop'] >= 0]] = True
+
+        self.num_events += len(events)
+        if 'n_solves' in events.dtype.names:
+            self.num_solves += int(events['n_solves'].clip(0).sum())
+            self.t_solve += float(np.nansum(events['t_solve']))
+        if len(events):
+            self.t_first = min(self.t_first, events['timestamp'].min())
+            self.t_last = max(self.t_last, events['timestamp'].max())
+
+    @property
+    def elapsed(self):
+        return max(self.t_last - self.t_first, 0.0)
+
+    @property
+    def rate(self):
+        """The iterations per second."""
+        if self.elapsed == 0.0:
+            return 0.0
+        return (self.num_events - 1) / self.elapsed
+
+    @property
+    def remaining(self):
+        """The number of iterations left, at most, to the running users."""
+        num_unseen = max((self.num_users or 0) - len(self.rows), 0)
+        running = ~self.stopped & (self.lengths < self.iters)
+        left = self.iters - self.lengths[running]
+        return num_unseen * self.iters + int(left.sum())
+
+
+def watch(input_files, output_file, iters, interval=60.0, num_users=None,
+          no_std=True):
+    """Monitors the event logs of running simulations.
+
+    Every `interval` seconds, the new events of the logs are aggregated, the
+    regret and time plots refreshed and the throughput and ETA of each group
+    printed. Returns when all the simulations are complete, which requires
+    `num_users` to be known.
+    """
+    monitors = [[TraceMonitor(f, iters, num_users) for f in group]
+                for group in input_files]
+    msg = ('{label}: users = {users}, iters = {done}, iters/h = {rate:.1f}, '
+           'solves/s = {solves:.2f}, solve time = {solve_frac:.0%}, '
+           'ETA = {eta}')
+    while True:
+        num_new = sum(m.poll() for group in monitors for m in group)
+        if num_new:
+            files, groups = [], []
+            progress = 1
+            for input_file_group, group in zip(input_files, monitors):
+                done = int(sum(m.lengths.sum() for m in group))
+                rate = sum(m.rate for m in group)
+                remaining = sum(m.remaining for m in group)
+                elapsed = sum(m.elapsed for m in group)
+                print(msg.format(
+                    label=get_label(input_file_group),
+                    users=sum(len(m.rows) for m in group), done=done,
+                    rate=rate * 3600,
+                    solves=sum(m.num_solves / max(m.elapsed, 1.0)
+                               for m in group),
+                    solve_frac=(sum(m.t_solve for m in group) /
+                                max(elapsed, 1.0)),
+                    eta=(timedelta(seconds=round(remaining / rate))
+                         if rate > 0 else '-')
+                ))
+                if any(len(m.rows) for m in group):
+                    files.append(input_file_group)
+                    groups.append((np.concatenate([m.data for m in group]),
+                                   np.concatenate([m.lengths for m in group])))
+                    progress = max([progress] + [m.lengths.max(initial=0)
+                                                 for m in group])
+            if groups:
+                groups = [(data[:, :progress], lengths)
+                          for data, lengths in groups]
+                plot_reg(files, output_file, progress, no_std=no_std,
+                         groups=groups)
+                plot_time(files, output_file, progress, no_std=no_std,
+                          groups=groups)
+        if num_users and all(m.remaining <= 0 for group in monitors
+                             for m in group):
+            break
+        sleep(interval)
+
+
 if __name__ == '__main__':
     fmt_class = argparse.ArgumentDefaultsHelpFormatter
     parser = argparse.ArgumentParser(formatter_class=fmt_class)
@@ -200,10 +460,31 @@ if __name__ == '__main__':
                         help='Whether to plot the standard deviation')
     parser.add_argument('-T', '--iters', type=int, default=100,
                         help='The iterations of to plot')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='The number of processes loading the input files')
+    parser.add_argument('--cache-dir', default='.plot_cache',
+                        help='The directory where to cache the loaded traces')
+    parser.add_argument('--watch', action='store_true',
+                        help=('Monitor the event logs of running simulations, '
+                              'refreshing plots and progress statistics'))
+    parser.add_argument('--interval', type=float, default=60.0,
+                        help='The refresh interval in seconds (with --watch)')
+    parser.add_argument('--num-users', type=int, default=None,
+                        help=('The number of users per input file, used for '
+                              'the ETA (with --watch)'))
     args = parser.parse_args()
 
     files = aggregate(args.input_files)
 
-    plot_reg(files, args.output_file, args.iters, no_std=args.no_std)
-    plot_time(files, args.output_file, args.iters, no_std=args.no_std)
+    if args.watch:
+        watch(files, args.output_file, args.iters, interval=args.interval,
+              num_users=args.num_users, no_std=args.no_std)
+        sys.exit(0)
+    groups = load_groups(files, args.iters, cache_dir=args.cache_dir,
+                         jobs=args.jobs)
+
+    plot_reg(files, args.output_file, args.iters, no_std=args.no_std,
+             groups=groups)
+    plot_time(files, args.output_file, args.iters, no_std=args.no_std,
+              groups=groups)
 
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import glob
+import json
+import shelve
+import argparse
+import subprocess
+
+from itertools import product
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from cls.governor import start_governor
+
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+
+SIZE_ARGS = {'Tables': '--n-tables', 'Rooms': '--n-rooms'}
+
+GRID_KEYS = ['domain', 'size', 'user_seeds', 'alpha', 'timeout', 'learner']
+
+# The solver budgets of the simulations, in CPU-seconds, see cls.budget
+BUDGET_KEYS = ['user_budget', 'context_budget', 'experiment_budget']
+
+DEFAULTS = {
+    'python': sys.executable,
+    'domain_seed': 1,
+    'user_seeds': [1],
+    'users_per_seed': 5,
+    'alpha': 0.1,
+    'timeout': 600,
+    'learner': 'pp',
+    'iters': 100,
+    'user_budget': 0,
+    'context_budget': 0,
+    'experiment_budget': 0,
+    'domains_dir': 'domains',
+    'users_dir': 'users',
+    'outputs_dir': 'outputs',
+}
+
+
+def _listify(value):
+    return value if isinstance(value, list) else [value]
+
+
+def _store_exists(path):
+    return len(glob.glob(glob.escape(path) + '*')) > 0
+
+
+def _shelf_get(path, key, default=None):
+    if not _store_exists(path):
+        return default
+    with shelve.open(path, 'r') as shelf:
+        return shelf.get(key, default)
+
+
+class Unit(object):
+    """A unit of work of a sweep, i.e. a run of main.py producing a file.
+
+    Parameters
+    ----------
+    path : str
+        The output file of the unit.
+    args : list of str
+        The command line arguments to main.py.
+    config : dict
+        The sweep configuration.
+
+    Attributes
+    ----------
+    shelf_key : str
+        The key of the output shelf holding the result of the unit.
+    """
+    shelf_key = None
+
+    def __init__(self, path, args, config):
+        self.path = path
+        self.args = args
+        self.config = config
+
+    def __str__(self):
+        return self.path
+
+    @property
+    def command(self):
+        main = os.path.join(DIR, 'main.py')
+        return [self.config['python'], main] + [str(arg) for arg in self.args]
+
+    @property
+    def stdout(self):
+        return None
+
+    def complete(self):
+        """Whether the outputs of the unit exist and are complete.
+
+        By default, whether the output shelf holds the `shelf_key`.
+        """
+        return _shelf_get(self.path, self.shelf_key) is not None
+
+    def clean(self):
+        """Removes partial outputs of the unit."""
+        for f in glob.glob(glob.escape(self.path) + '*'):
+            os.remove(f)
+
+    def run(self):
+        """Runs the unit, returns whether it completed."""
+        self.clean()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        if self.stdout:
+            with open(self.stdout, 'w') as out:
+                subprocess.run(self.command, stdout=out)
+        else:
+            subprocess.run(self.command)
+        return self.complete()
+
+
+class DomainUnit(Unit):
+    shelf_key = 'domain'
+
+    def __init__(self, domain, size, config):
+        name = '{}_n{}.pickle'.format(domain.lower(), size)
+        path = os.path.join(config['domains_dir'], name)
+        args = ['-s', config['domain_seed'], 'generate', 'domain', '-D', path,
+                domain, SIZE_ARGS[domain], size]
+        super().__init__(path, args, config)
+
+
+class UsersUnit(Unit):
+    shelf_key = 'users'
+
+    def __init__(self, domain_unit, domain, size, seed, config):
+        name = 'user_{}_s{}_n{}.pickle'.format(domain.lower(), seed, size)
+        path = os.path.join(config['users_dir'], name)
+        args = ['-s', seed, 'generate', 'users', '-D', domain_unit.path,
+                '-U', path, '-n', config['users_per_seed']]
+        super().__init__(path, args, config)
+        self.domain_unit = domain_unit
+
+
+class SimulationUnit(Unit):
+    shelf_key = 'completed'
+
+    def __init__(self, users_unit, domain, size, seed, alpha, timeout,
+                 learner, config):
+        name = 'output_{}_s{}_n{}_a{}'.format(domain.lower(), seed, size, alpha)
+        if timeout != DEFAULTS['timeout']:
+            name += '_t{}'.format(timeout)
+        if learner != DEFAULTS['learner']:
+            name += '_{}'.format(learner)
+        for key in BUDGET_KEYS:
+            if config[key]:
+                # e.g. _u3600 for a user budget of 3600 CPU-seconds
+                name += '_{}{}'.format(key[0], config[key])
+        base = os.path.join(config['outputs_dir'], name)
+        args = ['-s', config['domain_seed'], '--log', base + '.log',
+                'simulate', '-D', users_unit.domain_unit.path,
+                '-U', users_unit.path, '-O', base + '.pickle',
+                '-E', base + '.events', '-L', learner,
+                '-T', config['iters'], '--timeout', timeout]
+        for key in BUDGET_KEYS:
+            if config[key]:
+                args += ['--' + key.replace('_', '-'), config[key]]
+        args += ['coactive', '--alpha', alpha]
+        super().__init__(base + '.pickle', args, config)
+        self.base = base
+        self.users_unit = users_unit
+
+    @property
+    def stdout(self):
+        return self.base + '.out'
+
+    def complete(self):
+        # The uids of the users whose simulation is complete
+        completed = set(_shelf_get(self.path, self.shelf_key, []))
+        return completed >= set(range(self.config['users_per_seed']))
+
+    def clean(self):
+        super().clean()
+        for ext in ['.events', '.out', '.log']:
+            if os.path.exists(self.base + ext):
+                os.remove(self.base + ext)
+
+
+def expand(config):
+    """Expands a sweep configuration into its units of work.
+
+    Every grid key of the configuration may be a single value or a list of
+    values, units are generated for the cartesian product of the values.
+    Domains and users shared by several simulations are generated once.
+
+    Returns
+    -------
+    tuple of lists
+        The domain, users and simulation units.
+    """
+    config = {**DEFAULTS, **config}
+    grid = [_listify(config[key]) for key in GRID_KEYS]
+
+    domains, users, sims = OrderedDict(), OrderedDict(), OrderedDict()
+    for domain, size, seed, alpha, timeout, learner in product(*grid):
+        if domain not in SIZE_ARGS:
+            raise ValueError('Unknown domain: {}'.format(domain))
+        d = DomainUnit(domain, size, config)
+        d = domains.setdefault(d.path, d)
+        u = UsersUnit(d, domain, size, seed, config)
+        u = users.setdefault(u.path, u)
+        s = SimulationUnit(u, domain, size, seed, alpha, timeout, learner,
+                           config)
+        sims.setdefault(s.path, s)
+    return list(domains.values()), list(users.values()), list(sims.values())
+
+
+def run_units(units, jobs, dry_run=False):
+    """Runs the incomplete units on a pool of at most jobs processes.
+
+    Returns
+    -------
+    list of Unit
+        The units which did not complete.
+    """
+    todo = [unit for unit in units if not unit.complete()]
+    for unit in units:
+        print('{:>8} {}'.format('todo' if unit in todo else 'done', unit))
+    if dry_run or not todo:
+        return todo
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(lambda unit: unit.run(), todo))
+    failed = [unit for unit, ok in zip(todo, results) if not ok]
+    for unit in failed:
+        print('{:>8} {}'.format('failed', unit), file=sys.stderr)
+    return failed
+
+
+def cost_summary(sims):
+    """Prints the solver costs of the completed simulations and their total.
+    """
+    row = '{:<48} {:>9} {:>12} {:>9}'
+    print(row.format('', 'launches', 'cpu', 'timeouts'))
+    totals = [0, 0.0, 0]
+    for unit in sims:
+        costs = _shelf_get(unit.path, 'costs')
+        if costs is None:
+            continue
+        total = costs['total']
+        values = [total['launches'], total['cpu'], total['timeouts']]
+        totals = [a + b for a, b in zip(totals, values)]
+        print(row.format(os.path.basename(unit.base)[:48], int(values[0]),
+                         '{:.1f}'.format(values[1]), int(values[2])))
+    print(row.format('total', int(totals[0]), '{:.1f}'.format(totals[1]),
+                     int(totals[2])))
+
+
+def sweep(config, jobs=4, generate_only=False, dry_run=False):
+    """Runs a sweep, recomputing only the missing or incomplete outputs."""
+    domains, users, sims = expand(config)
+
+    failed = run_units(domains, jobs, dry_run)
+    if not dry_run:
+        users = [u for u in users if u.domain_unit not in failed]
+    failed += run_units(users, jobs, dry_run)
+    if generate_only:
+        return failed
+    if not dry_run:
+        sims = [s for s in sims if s.users_unit not in failed]
+    return failed + run_units(sims, jobs, dry_run)
+
+
+if __name__ == '__main__':
+    fmt_class = argparse.ArgumentDefaultsHelpFormatter
+    parser = argparse.ArgumentParser(formatter_class=fmt_class)
+
+    parser.add_argument('config',
+                        help='The JSON file with the sweep configuration')
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help='The maximum number of concurrent processes')
+    parser.add_argument('--solver-tokens', type=int,
+                        default=len(os.sched_getaffinity(0)),
+                        help=('The number of solver threads allowed to run at '
+                              'once across all the units, 0 for no limit'))
+    parser.add_argument('--generate-only', action='store_true',
+                        help='Only generate the domains and the users')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='Only print the units and their status')
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = json.load(f)
+
+    # Inherited by main.py, see cls.governor
+    if args.solver_tokens:
+        start_governor(args.solver_tokens)
+
+    failed = sweep(config, jobs=args.jobs, generate_only=args.generate_only,
+                   dry_run=args.dry_run)
+    if not (args.dry_run or args.generate_only):
+        cost_summary(expand(config)[2])
+    sys.exit(1 if failed and not args.dry_run else 0)
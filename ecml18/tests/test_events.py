@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from cls import events as ev
+
+
+def _write(path, num_features, **event):
+    with ev.EventWriter(path, num_features) as writer:
+        writer.append(**event)
+
+
+def _write_old(path, num_features, **event):
+    """Writes an event with the dtype of logs without reg_exact and stop."""
+    dtype = ev.event_dtype(num_features)
+    names = [name for name in dtype.names if name not in ('reg_exact', 'stop')]
+    old = np.dtype([(name, dtype[name]) for name in names])
+    with open(path, 'ab') as f:
+        if f.tell() == 0:
+            f.write(ev.MAGIC)
+        f.write(ev._encode([event], old))
+
+
+def test_mixed_dtypes_are_aligned(tmp_path):
+    path = str(tmp_path / 'events.log')
+    _write_old(path, 2, uid=0, it=0, reg=1.0, w=[1.0, 0.0])
+    _write(path, 2, uid=0, it=1, reg=0.5, reg_exact=1, stop=0, w=[0.0, 1.0])
+    events = ev.load_events(path)
+    assert events['it'].tolist() == [0, 1]
+    assert events['reg_exact'].tolist() == [-1, 1]
+    assert events['w'].tolist() == [[1.0, 0.0], [0.0, 1.0]]
+    events = ev.load_events(path, fields=['it', 'stop'])
+    assert events.dtype.names == ('it', 'stop')
+    assert events['stop'].tolist() == [-1, 0]
+
+
+def test_different_features_are_refused(tmp_path):
+    path = str(tmp_path / 'events.log')
+    _write(path, 2, uid=0, it=0, w=[1.0, 0.0])
+    _write(path, 3, uid=0, it=1, w=[1.0, 0.0, 0.0])
+    with pytest.raises(ValueError):
+        ev.load_events(path)
+
+
+def test_write_errors_are_raised(tmp_path):
+    writer = ev.EventWriter(str(tmp_path / 'events.log'), 2)
+    writer.append(uid='not a number')
+    writer.flush()
+    writer._thread.join(1)
+    with pytest.raises(RuntimeError):
+        writer.close()
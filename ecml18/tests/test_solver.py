@@ -0,0 +1,56 @@
+import pymzn
+import pytest
+
+from cls import solver
+from cls.pool import SolverCrashError
+
+
+class FakePool(object):
+    """Raises the given errors on the first solves, then returns 'ok'."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = []
+
+    def solve(self, mzn, *dzn_files, data=None, job_timeout=None, **kwargs):
+        self.calls.append(kwargs)
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok', 1
+
+
+def _error(stderr='Segmentation fault'):
+    return pymzn.MiniZincError('model.mzn', ['--solver', 'opturion'], stderr)
+
+
+def _supervised(pool):
+    return solver._supervised(pool, 'model.mzn', (), {}, None,
+                              {'timeout': 1})
+
+
+def test_crash_is_retried():
+    outcomes0 = solver.solver_stats.outcomes.copy()
+    pool = FakePool(_error())
+    assert _supervised(pool) == ('ok', 1)
+    assert len(pool.calls) == 2
+    outcomes = solver.solver_stats.outcomes_since(outcomes0)
+    assert outcomes == {'crash': 1, 'retried': 1}
+
+
+def test_crashes_fall_back_to_gecode():
+    pool = FakePool(_error(), _error())
+    assert _supervised(pool) == ('ok', 1)
+    assert pool.calls[-1]['solver'] == 'gecode'
+
+
+def test_failed_after_fallbacks():
+    pool = FakePool(*[_error() for _ in range(len(solver.FALLBACKS) + 1)])
+    with pytest.raises(SolverCrashError):
+        _supervised(pool)
+
+
+def test_unsatisfiable_is_not_retried():
+    pool = FakePool(_error('=====UNSATISFIABLE====='))
+    with pytest.raises(pymzn.MiniZincError):
+        _supervised(pool)
+    assert len(pool.calls) == 1
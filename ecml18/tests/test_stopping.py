@@ -0,0 +1,32 @@
+import numpy as np
+
+from cls.solutions import SolutionPool
+from cls.stopping import ArgmaxStable
+
+
+def _step(pool, x, w0):
+    return {'x': x, 'w0': w0, 'w1': -w0, 'pool': pool}
+
+
+def test_new_contexts_are_not_stable():
+    pool = SolutionPool()
+    detector = ArgmaxStable(k=2)
+    w0 = np.array([1.0, 0.0])
+    for c in range(5):
+        x = {'c': c}
+        pool.add(x, {'v': 0}, np.array([1.0, 0.0]))
+        assert not detector(_step(pool, x, w0))
+
+
+def test_flipping_argmax_is_not_stable():
+    pool = SolutionPool()
+    detector = ArgmaxStable(k=2)
+    x = {'c': 0}
+    pool.add(x, {'v': 0}, np.array([1.0, 0.0]))
+    pool.add(x, {'v': 1}, np.array([0.0, 1.0]))
+    w0 = np.array([1.0, 0.5])
+    for _ in range(5):
+        assert not detector(_step(pool, x, w0))
+    step = {'x': x, 'w0': w0, 'w1': w0, 'pool': pool}
+    assert not detector(step)
+    assert detector(step)
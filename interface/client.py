@@ -0,0 +1,86 @@
+
+import numpy as np
+
+# The pool module puts the shared solverkit package on the path
+import pool
+from solverkit.service import call_service
+
+
+class ServiceClient(object):
+    """Client of a layout synthesis service, see `server.py`.
+
+    Parameters
+    ----------
+    url : str
+        The address of the service, e.g. http://127.0.0.1:8765.
+    """
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def call(self, method, **kwargs):
+        return call_service(self.url, method, **kwargs)
+
+
+class RemoteDomain(object):
+    """A domain solved by the service, with the interface of `Domain`.
+
+    A new session is opened, unless the id of a session persisted by the
+    service is given, in which case the session is resumed.
+    """
+    def __init__(self, client, domain, num_features, w=None, session=None):
+        self.client = client
+        self.num_features = num_features
+        if session is None:
+            reply = client.call('session', domain=domain, w=w)
+        else:
+            reply = client.call('resume', session=session)
+        self.session = reply['session']
+        self.w = np.array(reply['w'], dtype=np.float64)
+
+    def phi(self, x, y):
+        _phi = self.client.call('phi', session=self.session, x=x, y=y)['phi']
+        return np.array(_phi, dtype=np.float64)
+
+    def infer(self, x, w):
+        return self.client.call('infer', session=self.session, x=x, w=w)['y']
+
+    def prefetch(self, x, w):
+        """Asks the service to precompute infer(x, w) in background."""
+        self.client.call('prefetch', session=self.session, x=x, w=w)
+
+    def improve(self, x, phi, changed):
+        return self.client.call('improve', session=self.session, x=x, phi=phi,
+                                changed=changed)['y']
+
+    def close(self):
+        self.client.call('close', session=self.session)
+
+
+class RemoteModel(object):
+    """A coactive model whose weights live in a service session.
+
+    Has the interface of `CoactiveModel`; `w` mirrors the session weights.
+    """
+    def __init__(self, domain):
+        self.domain = domain
+        self.w = domain.w
+
+    def _update(self, **kwargs):
+        w = self.domain.client.call('update', session=self.domain.session,
+                                    **kwargs)['w']
+        self.w = np.array(w, dtype=np.float64)
+
+    def phi(self, x, y):
+        return self.domain.phi(x, y)
+
+    def infer(self, x):
+        return self.domain.infer(x, self.w)
+
+    def improve(self, x, phi, changed):
+        return self.domain.improve(x, phi, changed)
+
+    def update(self, x, y, y_bar):
+        self._update(x=x, y=y, y_bar=y_bar)
+
+    def phi_update(self, phi, phi_bar):
+        self._update(phi=phi, phi_bar=phi_bar)
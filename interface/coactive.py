@@ -7,15 +7,23 @@ from utils import freeze, subdict
 
 class Domain:
 
-    def __init__(self, mzn_phi, mzn_infer, mzn_improve, num_features):
+    def __init__(self, mzn_phi, mzn_infer, mzn_improve, num_features,
+                 pool=None):
         self.mzn_phi = mzn_phi
         self.mzn_infer = mzn_infer
         self.mzn_improve = mzn_improve
         self.num_features = num_features
+        self.pool = pool
         self._phis = {}
         self._infers = {}
         self._improves = {}
 
+    def _minizinc(self, *args, **kwargs):
+        """Runs a short solve on the solver pool, if any."""
+        if self.pool is not None:
+            return self.pool.solve(*args, **kwargs)
+        return pymzn.minizinc(*args, **kwargs)
+
     @staticmethod
     def inputize(x, target_keys):
         x_input = {key: val for key, val in x.items() if key not in target_keys}
@@ -27,7 +35,7 @@ class Domain:
         _frx = freeze(x), freeze(y)
         if _frx not in self._phis:
             ykeys = ['x', 'y', 'dx', 'dy']
-            _phi = pymzn.minizinc(self.mzn_phi,output_vars=['phi'],
+            _phi = self._minizinc(self.mzn_phi,output_vars=['phi'],
                     data={**self.inputize(subdict(y, ykeys), ykeys), **x},
                     solver=pymzn.opturion)[0]['phi']
             self._phis[_frx] = np.array(_phi, dtype=np.float64)
@@ -47,7 +55,7 @@ class Domain:
         """
         _frx = freeze(x), freeze(phi)
         if _frx not in self._improves:
-            _impr = pymzn.minizinc(self.mzn_improve, data={**x, 'input_phi': phi,
+            _impr = self._minizinc(self.mzn_improve, data={**x, 'input_phi': phi,
                                        'changed': changed + 1},
                                    solver=pymzn.opturion)[0]
             self._improves[_frx] = _impr
@@ -1,7 +1,7 @@
 
 from kivy.app import App
 from kivy.core.image import Image as CoreImage
-from kivy.graphics import Color, Rectangle, Line
+from kivy.graphics import Color, Rectangle, Line, InstructionGroup
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.button import Button
 from kivy.uix.dropdown import DropDown
@@ -9,15 +9,28 @@ from kivy.uix.floatlayout import FloatLayout
 from kivy.uix.label import Label
 from kivy.uix.widget import Widget
 
+import numpy as np
+
 from random import random
 
 
+_textures = {}
+
+
+def get_texture(path):
+    """Returns the texture of an image file, loading it only once."""
+    if path not in _textures:
+        _textures[path] = CoreImage(path).texture
+    return _textures[path]
+
+
 class Object:
 
     def __init__(self, pos, size, texture, editable=True):
         self.pos = pos
         self.size = size
-        self.texture = CoreImage(texture).texture
+        self.texture_path = texture
+        self.texture = get_texture(texture)
         self.editable = editable
 
 
@@ -35,9 +48,19 @@ class GridDrawingBoard(Widget):
 
         self.n_cols, self.n_rows  = size
         self.controller = controller
-        self.bind(size=self.draw)
-        self.bind(pos=self.draw)
-        self.draw()
+
+        # Retained instructions: the grid is rebuilt only on resize, while
+        # each object keeps its rectangle, updated only when it changes
+        self._grid = InstructionGroup()
+        self._objects = InstructionGroup()
+        self._objects.add(Color(1, 1, 1))
+        self._rects = {}
+        self.canvas.add(self._grid)
+        self.canvas.add(self._objects)
+
+        self.bind(size=self.resize)
+        self.bind(pos=self.resize)
+        self.resize()
 
     def _get_relative_touch(self, touch):
         rel_x = (touch.x - self.pos[0]) / self.size[0]
@@ -56,40 +79,60 @@ class GridDrawingBoard(Widget):
         cy = int(round(self.n_rows * ry))
         return cx, cy
 
-    def _draw_objects(self):
+    def _object_geometry(self, obj):
         delta_x = self.size[0] / self.n_cols
         delta_y = self.size[1] / self.n_rows
+        obj_pos = (self.pos[0] + obj.pos[0] * delta_x,
+                   self.pos[1] + obj.pos[1] * delta_y)
+        size = (obj.size[0] * delta_x, obj.size[1] * delta_y)
+        return obj_pos, size
+
+    def _draw_objects(self):
+        """Updates the rectangles of the objects which changed."""
+        objects = set(self.controller.objects)
+        for obj in list(self._rects):
+            if obj not in objects:
+                rect, _ = self._rects.pop(obj)
+                self._objects.remove(rect)
 
         for obj in self.controller.objects:
-            obj_pos = (self.pos[0] + obj.pos[0] * delta_x,
-                       self.pos[1] + obj.pos[1] * delta_y)
-            size = (obj.size[0] * delta_x, obj.size[1] * delta_y)
-            with self.canvas:
-                Rectangle(pos=obj_pos, size=size, texture=obj.texture)
+            state = (tuple(obj.pos), tuple(obj.size), obj.texture)
+            if obj not in self._rects:
+                rect = Rectangle(texture=obj.texture)
+                self._objects.add(rect)
+            else:
+                rect, old_state = self._rects[obj]
+                if old_state == state:
+                    continue
+                rect.texture = obj.texture
+            rect.pos, rect.size = self._object_geometry(obj)
+            self._rects[obj] = rect, state
 
     def _draw_grid(self):
         delta_x = self.size[0] / self.n_cols
         delta_y = self.size[1] / self.n_rows
-        with self.canvas:
-            self._BG_COLOR()
-            Rectangle(pos=self.pos, size=self.size)
-            self._LINE_COLOR()
-            # horizontal lines
-            x1, x2 = self.pos[0], self.pos[0] + self.size[0]
-            for i in range(1, self.n_rows):
-                y = self.pos[1] + i * delta_y
-                Line(points=(x1, y, x2, y))
-            # vertical lines
-            y1, y2 = self.pos[1], self.pos[1] + self.size[1]
-            for i in range(1, self.n_cols):
-                x = self.pos[0] + i * delta_x
-                Line(points=(x, y1, x, y2))
-
-            Color(1,1,1) # this seems necessary
+        self._grid.clear()
+        self._grid.add(self._BG_COLOR())
+        self._grid.add(Rectangle(pos=self.pos, size=self.size))
+        self._grid.add(self._LINE_COLOR())
+        # horizontal lines
+        x1, x2 = self.pos[0], self.pos[0] + self.size[0]
+        for i in range(1, self.n_rows):
+            y = self.pos[1] + i * delta_y
+            self._grid.add(Line(points=(x1, y, x2, y)))
+        # vertical lines
+        y1, y2 = self.pos[1], self.pos[1] + self.size[1]
+        for i in range(1, self.n_cols):
+            x = self.pos[0] + i * delta_x
+            self._grid.add(Line(points=(x, y1, x, y2)))
+
+    def resize(self, *args):
+        """Rebuilds the grid and moves all the objects to the new geometry."""
+        self._draw_grid()
+        for obj, (rect, state) in self._rects.items():
+            rect.pos, rect.size = self._object_geometry(obj)
 
     def draw(self, *args):
-        self.canvas.clear()
-        self._draw_grid()
         self._draw_objects()
 
     def on_touch_down(self, touch):
@@ -132,6 +175,12 @@ class GridUI(BoxLayout):
         self.n_cols, self.n_rows = size
         self.object_palette = object_palette
         self.objects = []
+
+        # Occupancy grid: the id of the object covering each cell, -1 if free
+        self.occupancy = np.full((self.n_cols, self.n_rows), -1, dtype=np.int32)
+        self._by_id = {}
+        self._next_id = 0
+        self._overlaps = False
         self.output = None
         self.current_action = None
 
@@ -190,8 +239,21 @@ class GridUI(BoxLayout):
 
         return output
 
+    def _reuse_object(self, objects, pos, size, texture, editable=True):
+        """Returns an unchanged object of the previous layout, or a new one."""
+        key = (pos, size, texture)
+        if objects.get(key):
+            return objects[key].pop()
+        return Object(pos, size, texture, editable=editable)
+
     def update(self, x, y):
+        # Objects unchanged from the previous layout keep their instructions
+        previous = {}
+        for obj in self.objects:
+            key = (tuple(obj.pos), tuple(obj.size), obj.texture_path)
+            previous.setdefault(key, []).append(obj)
         self.objects = []
+        self._clear_occupancy()
         tables = list(zip(y['x'], y['dx'], y['y'], y['dy']))
         walls = list(zip(x['wall_x'], x['wall_dx'], x['wall_y'], x['wall_dy']))
         doors = list(zip(x['door_x'], x['door_y']))
@@ -207,13 +269,16 @@ class GridUI(BoxLayout):
             else:
                 texture = self.TEX_TABLE_GENERIC
 
-            table = Object((x - 1, y - 1), size, texture)
+            table = self._reuse_object(previous, (x - 1, y - 1), size, texture)
             print("update -- {} {}".format((x,y),(dx,dy)))
             self.objects.append(table)
+            self._place(table)
 
         for x, dx, y, dy in walls:
-            wall = Object((x - 1, y - 1), (dx, dy), self.TEX_WALL, editable=False)
+            wall = self._reuse_object(previous, (x - 1, y - 1), (dx, dy),
+                                      self.TEX_WALL, editable=False)
             self.objects.append(wall)
+            self._place(wall)
 
         for x, y in doors:
             if x == 1:
@@ -225,8 +290,10 @@ class GridUI(BoxLayout):
             elif x == self.n_rows:
                 texture = self.TEX_DOOR_TOP
 
-            door = Object((x - 1, y - 1), (1, 1), texture, editable=False)
+            door = self._reuse_object(previous, (x - 1, y - 1), (1, 1),
+                                      texture, editable=False)
             self.objects.append(door)
+            self._place(door)
 
         self.grid.draw()
 
@@ -258,9 +325,47 @@ class GridUI(BoxLayout):
             self.current_action = None
             self.info_label = self.messages['default']
 
+    def _cells(self, pos, size):
+        x, y = max(pos[0], 0), max(pos[1], 0)
+        return (slice(x, pos[0] + size[0]), slice(y, pos[1] + size[1]))
+
+    def _clear_occupancy(self):
+        self.occupancy.fill(-1)
+        self._by_id = {}
+        self._overlaps = False
+
+    def _place(self, obj):
+        """Marks the free cells covered by the object in the occupancy grid.
+
+        Cells already covered by another object keep it, so that hit tests
+        return the first object in the list, as the list order does.
+        """
+        obj.oid = self._next_id
+        self._next_id += 1
+        self._by_id[obj.oid] = obj
+        cells = self.occupancy[self._cells(obj.pos, obj.size)]
+        free = cells == -1
+        if not free.all():
+            self._overlaps = True
+        cells[free] = obj.oid
+
+    def _unplace(self, obj):
+        del self._by_id[obj.oid]
+        cells = self.occupancy[self._cells(obj.pos, obj.size)]
+        cells[cells == obj.oid] = -1
+        if self._overlaps:
+            # The freed cells may be covered by other objects
+            self.occupancy.fill(-1)
+            self._by_id = {}
+            for other in self.objects:
+                if other is not obj:
+                    self._place(other)
+
     def move_object(self, cell, obj):
         if self.is_free_area(cell, obj.size, ignore=[obj]):
+            self._unplace(obj)
             obj.pos = cell
+            self._place(obj)
             return True
         else:
             self.info_label.text += " " + self.messages['move_retry']
@@ -268,15 +373,14 @@ class GridUI(BoxLayout):
 
     def select_object(self, cell):
         x, y = cell
-        for obj in self.objects:
-            if (x in range(obj.pos[0], obj.pos[0] + obj.size[0]) and
-                y in range(obj.pos[1], obj.pos[1] + obj.size[1])):
-                return obj
-        return None
+        if not (0 <= x < self.n_cols and 0 <= y < self.n_rows):
+            return None
+        return self._by_id.get(self.occupancy[x, y])
 
     def add_object(self, obj):
         if self.is_free_area(obj.pos, obj.size):
             self.objects.append(obj)
+            self._place(obj)
             return True
         else:
             return False
@@ -285,6 +389,7 @@ class GridUI(BoxLayout):
         selected_obj = self.select_object(cell)
         if selected_obj != None and selected_obj.editable:
             self.objects.remove(selected_obj)
+            self._unplace(selected_obj)
             return True
 
         return False
@@ -294,12 +399,11 @@ class GridUI(BoxLayout):
         delta_y = pos[1] + size[1]
         if delta_x > self.n_cols or delta_y > self.n_rows:
             return False
-        for x in range(pos[0], delta_x):
-            for y in range(pos[1], delta_y):
-                obstacle = self.select_object((x,y))
-                if obstacle != None and not obstacle in ignore:
-                    return False
-        return True
+        if pos[0] < 0 or pos[1] < 0:
+            return False
+        cells = self.occupancy[pos[0]:delta_x, pos[1]:delta_y]
+        ignored = [obj.oid for obj in ignore]
+        return not np.any((cells != -1) & ~np.isin(cells, ignored))
 
     def _select_obj(self, btn):
         self.dropdown.select(btn.text)
@@ -5,6 +5,7 @@ import kivy
 import numpy as np
 import threading
 from kivy.app import App
+from kivy.clock import Clock
 from kivy.loader import Loader
 from kivy.uix.label import Label
 from kivy.uix.gridlayout import GridLayout
@@ -20,12 +21,19 @@ from kivy.properties import ListProperty
 from kivy.uix.treeview import TreeView, TreeViewNode, TreeViewLabel
 
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from client import ServiceClient, RemoteDomain, RemoteModel
 from coactive import Domain, CoactiveModel
 from draw import draw_tables, draw_rooms
 from gridui import GridUI, Object
+from pool import SolverPool
 
 kivy.resources.resource_add_path('/usr/share/fonts')
 
+# Environment variable with the address of a layout synthesis service to use
+# instead of solving locally, e.g. http://127.0.0.1:8765
+SERVER_ENV = 'CLS_SERVER'
+
 
 class Problem:
 
@@ -60,11 +68,19 @@ class Problem:
     }
     _draw = {'tables': draw_tables, 'rooms': draw_rooms}
 
-    def __init__(self, domain):
-        phi = os.path.join(domain, 'phi.mzn')
-        infer = os.path.join(domain, 'infer.mzn')
-        improve = os.path.join(domain, 'improve.mzn')
-        self.domain = Domain(phi, infer, improve, self._features[domain])
+    def __init__(self, domain, num_workers=2, server=None):
+        if server:
+            # Solves on a running layout synthesis service, see server.py
+            self.pool = None
+            self.domain = RemoteDomain(ServiceClient(server), domain,
+                                       self._features[domain])
+        else:
+            phi = os.path.join(domain, 'phi.mzn')
+            infer = os.path.join(domain, 'infer.mzn')
+            improve = os.path.join(domain, 'improve.mzn')
+            self.pool = SolverPool(num_workers)
+            self.domain = Domain(phi, infer, improve, self._features[domain],
+                                 pool=self.pool)
         self.context = self._context[domain]
         self.draw = self._draw[domain]
         self.sliders = self._sliders[domain]
@@ -127,6 +143,13 @@ class FeatureTree(TreeView):
             if n is not node and n.is_open:
                 self.toggle_node(n)
 
+    def expanded_slider(self):
+        """Returns the slider of the expanded feature, if any."""
+        for idx, label in self.labels.items():
+            if label.is_open:
+                return self.sliders[idx]
+        return None
+
     def bind_sliders(self, f):
         for slider in self.sliders.values():
             slider.bind(value=f)
@@ -134,16 +157,34 @@ class FeatureTree(TreeView):
 
 class MainWindow(GridLayout):
 
+    # Seconds a slider has to stay still before its improvement is solved
+    SLIDER_DEBOUNCE = 0.2
+
+    # Seconds of idleness before the likely next solves are prefetched
+    PREFETCH_DELAY = 0.5
 
-    def __init__(self, domain, **kwargs):
+    def __init__(self, domain, server=None, **kwargs):
         super().__init__(cols=2, **kwargs)
-        self.problem = Problem(domain)
+        self.problem = Problem(domain, server=server)
         self.domain = self.problem.domain
-        self.model = CoactiveModel(self.domain)
+        if server:
+            self.model = RemoteModel(self.domain)
+        else:
+            self.model = CoactiveModel(self.domain)
+
+        # Solver work runs on a background thread, one request at a time, and
+        # its results are applied on the main thread by the Kivy clock
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._prefetcher = ThreadPoolExecutor(max_workers=1)
+        self._prefetch_event = None
+        self._generation = 0
+        self._future = None
+        self._slider_event = None
+        self._setting_sliders = False
 
         self._x = self.problem.context
-        self._y = self.model.infer(self._x)
-        self.phi = list(self.model.phi(self._x, self._y))
+        self._y = None
+        self.phi = None
 
         n_cells = (self._x['SIDE'],)*2
         # TODO: move this somewhere else
@@ -153,7 +194,6 @@ class MainWindow(GridLayout):
 
         self.grid_ui = GridUI(n_cells, palette)
         self.add_widget(self.grid_ui)
-        self.grid_ui.update(self._x, self._y)
 
         self.side = GridLayout(cols=1, rows=2, size_hint=(.45, 1))
         with self.side.canvas.before:
@@ -165,38 +205,164 @@ class MainWindow(GridLayout):
         self.tree = FeatureTree(self.problem, size_hint=(.45, .8))
         self.side.add_widget(self.tree)
         self.tree.bind_sliders(self.on_slider_update)
-        self.tree.set_sliders(self.phi)
+        self.tree.bind(on_node_expand=self._schedule_prefetch)
 
         self.submit = Button(text='Submit', size_hint=(.2, .1))
         self.side.add_widget(self.submit)
         self.submit.bind(on_press=self.on_submit_press)
 
+        self._set_busy(True)
+        self._request(partial(self._infer_job, self._x), self._on_infer)
+
+    def _request(self, job, callback):
+        """Runs job in the background, then callback(result) on the main thread.
+
+        A new request cancels the previous one if it has not started yet, and
+        the results of the requests superseded while running are discarded.
+        """
+        self._generation += 1
+        generation = self._generation
+        if self._prefetch_event is not None:
+            self._prefetch_event.cancel()
+        if self._future is not None:
+            self._future.cancel()
+        self._future = self._executor.submit(job)
+
+        def done(future):
+            Clock.schedule_once(partial(self._on_done, generation, future,
+                                        callback))
+        self._future.add_done_callback(done)
+
+    def _on_done(self, generation, future, callback, dt):
+        if generation != self._generation or future.cancelled():
+            return
+        try:
+            result = future.result()
+        except Exception as e:
+            self.grid_ui.info_label.text = 'Solver error: {}'.format(e)
+            self._set_busy(False)
+            return
+        callback(result)
+
+    def _set_busy(self, busy):
+        self.submit.disabled = busy
+        self.tree.disabled = busy
+
+    def _set_sliders(self, phi):
+        self._setting_sliders = True
+        self.tree.set_sliders(phi)
+        self._setting_sliders = False
+
     def on_slider_update(self, slider, value):
+        if self._setting_sliders:
+            return
+        if self._slider_event is not None:
+            self._slider_event.cancel()
+        self._slider_event = Clock.schedule_once(
+            partial(self._request_improve, slider.index), self.SLIDER_DEBOUNCE
+        )
+
+    def _request_improve(self, changed, dt):
         _phi = list(self.phi)
-        _phi[slider.index] = slider.value
+        _phi[changed] = self.tree.sliders[changed].value
+        job = partial(self._improve_job, self._x,
+                      np.array(_phi, dtype=np.int32), changed)
+        self._request(job, self._on_improve)
 
-        y_bar = self.model.improve(self._x, np.array(_phi, dtype=np.int32),
-                                   self.tree.changed)
+    def _improve_job(self, x, phi, changed):
+        y_bar = self.model.improve(x, phi, changed)
+        return x, y_bar, self.model.phi(x, y_bar)
 
-        self.phi = self.model.phi(self._x, y_bar)
-        self.grid_ui.update(self._x, y_bar)
+    def _on_improve(self, result):
+        x, y_bar, self.phi = result
+        self.grid_ui.update(x, y_bar)
+        self._schedule_prefetch()
 
     def on_submit_press(self, *args):
+        if self._slider_event is not None:
+            self._slider_event.cancel()
         y_bar = self.grid_ui.get_output()
+        self._set_busy(True)
+        job = partial(self._submit_job, dict(self._x), self._y, y_bar)
+        self._request(job, self._on_infer)
+
+    def _submit_job(self, x, y, y_bar):
         n_tables = len(y_bar['x'])
-        if n_tables != self._x['N_TABLES']:
-            phi = self.model.phi(self._x, self._y)
-            x = dict(self._x)
-            x['N_TABLES'] = n_tables
-            phi_bar = self.model.phi(x, y_bar)
+        if n_tables != x['N_TABLES']:
+            phi = self.model.phi(x, y)
+            x_bar = dict(x)
+            x_bar['N_TABLES'] = n_tables
+            phi_bar = self.model.phi(x_bar, y_bar)
             self.model.phi_update(phi, phi_bar)
-            self._x['N_TABLES'] = n_tables
+            x['N_TABLES'] = n_tables
         else:
-            self.model.update(self._x, self._y, y_bar)
-        self._y = self.model.infer(self._x)
-        self.phi = self.model.phi(self._x, self._y)
-        self.tree.set_sliders(self.phi)
+            self.model.update(x, y, y_bar)
+        return self._infer_job(x)
+
+    def _infer_job(self, x):
+        y = self.model.infer(x)
+        return x, y, self.model.phi(x, y)
+
+    def _on_infer(self, result):
+        self._x, self._y, self.phi = result
+        self._set_sliders(self.phi)
         self.grid_ui.update(self._x, self._y)
+        self._set_busy(False)
+        self._schedule_prefetch()
+
+    def _schedule_prefetch(self, *args):
+        if self._prefetch_event is not None:
+            self._prefetch_event.cancel()
+        self._prefetch_event = Clock.schedule_once(self._prefetch,
+                                                   self.PREFETCH_DELAY)
+
+    def _prefetch(self, dt):
+        """Solves the likely next requests into the caches of the domain.
+
+        These are the improvements for the values next to the current one of
+        the expanded slider, and the inference following a submit of the
+        current layout. The prefetch stops as soon as a new request is made.
+        """
+        if self._y is None or self.phi is None:
+            return
+        phis = []
+        slider = self.tree.expanded_slider()
+        if slider is not None:
+            for step in [1, -1]:
+                value = slider.value + step
+                if slider.min <= value <= slider.max:
+                    _phi = list(self.phi)
+                    _phi[slider.index] = value
+                    phis.append((np.array(_phi, dtype=np.int32), slider.index))
+        # A copy of the weights, which the submits update in place
+        job = partial(self._prefetch_job, self._generation, self._x, self._y,
+                      np.array(self.phi), phis, np.array(self.model.w))
+        self._prefetcher.submit(job)
+
+    def _prefetch_job(self, generation, x, y, phi_bar, phis, w):
+        for phi, changed in phis:
+            if generation != self._generation:
+                return
+            self.model.phi(x, self.model.improve(x, phi, changed))
+        if generation != self._generation:
+            return
+        # Same update as CoactiveModel.update, on the current layout
+        w = w + (phi_bar - self.model.phi(x, y))
+        if hasattr(self.domain, 'prefetch'):
+            # Solved by the service in background, behind the user requests
+            self.domain.prefetch(x, w)
+        else:
+            self.model.phi(x, self.domain.infer(x, w))
+
+    def close(self):
+        """Stops the background solver work."""
+        self._generation += 1
+        self._prefetcher.shutdown(cancel_futures=True)
+        self._executor.shutdown(cancel_futures=True)
+        if self.problem.pool is not None:
+            self.problem.pool.close()
+        else:
+            self.domain.close()
 
     def track(self, *args):
         self.side_bg.pos = self.side.pos
@@ -205,7 +371,11 @@ class MainWindow(GridLayout):
 
 class LayoutSynthesisApp(App):
     def build(self):
-        return MainWindow('tables')
+        self.window = MainWindow('tables', server=os.environ.get(SERVER_ENV))
+        return self.window
+
+    def on_stop(self):
+        self.window.close()
 
 
 if __name__ == '__main__':
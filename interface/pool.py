@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The solver pool is shared by the packages of the repository, see solverkit at
+# its root
+_root = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+if _root not in sys.path:
+    sys.path.append(_root)
+
+from solverkit.pool import *
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import shelve
+import argparse
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import matplotlib.patches as patches
+
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+
+from draw import ColorPicker
+from utils import freeze
+
+
+# The experiments package, needed to load the event logs and the domains
+ECML18_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                          '..', 'ecml18')
+
+# Colors of the subrooms when the context has no room types
+ROOM_COLORS = [(1, 0, 0, 0.7), (0, 1, 0, 0.7), (0, 0, 1, 0.7),
+               (0.5, 0.5, 0, 0.7), (0, 0.5, 0.5, 0.7), (0.5, 0, 0.5, 0.7)]
+
+
+class LayoutRenderer(object):
+    """Renders the layouts of a context on a single, reused figure.
+
+    The grid, the doors and the walls of the context are drawn once, while
+    the patches of the tables (or subrooms) are kept and only moved, resized
+    and recolored for each layout.
+
+    Parameters
+    ----------
+    x : dict
+        The context.
+    kind : str
+        The kind of layouts, either 'tables' or 'rooms'.
+    dpi : int
+        The resolution of the rendered images.
+    size : float
+        The size of the figure in inches.
+    """
+    def __init__(self, x, kind='tables', dpi=100, size=4.0):
+        self.x = x
+        self.kind = kind
+        self.dpi = dpi
+        side = x['SIDE']
+
+        self.fig = plt.figure(figsize=(size, size), dpi=dpi)
+        ax = self.fig.add_axes([0, 0, 1, 1], aspect='equal')
+        ax.set_xlim((0, side))
+        ax.set_ylim((0, side))
+        ax.set_xticks(range(side))
+        ax.set_yticks(range(side))
+        ax.grid(True)
+        ax.set_axisbelow(True)
+        ax.tick_params(axis='both', which='both', top=False, left=False,
+                       right=False, bottom=False, labelleft=False,
+                       labelbottom=False)
+        self.ax = ax
+
+        if kind == 'tables':
+            self._draw_doors()
+        self._draw_walls()
+
+        self._patches = []
+        self.label = ax.text(0.02, 0.98, '', transform=ax.transAxes,
+                             va='top', ha='left', fontsize=8, zorder=3,
+                             bbox={'facecolor': 'white', 'alpha': 0.7,
+                                   'edgecolor': 'none'})
+
+    def _draw_doors(self):
+        side = self.x['SIDE']
+        door_xs, door_ys = self.x['door_x'], self.x['door_y']
+        for door_x, door_y in zip(np.atleast_1d(door_xs),
+                                  np.atleast_1d(door_ys)):
+            door_x -= 1
+            door_y -= 1
+            width = 0.5 if door_x == 0 else 1
+            door_dx = 0.5 if door_x == side - 1 else 0
+            height = 0.5 if door_y == 0 else 1
+            door_dy = 0.5 if door_y == side - 1 else 0
+            self.ax.add_patch(patches.Rectangle(
+                (door_x + door_dx, door_y + door_dy), width, height,
+                edgecolor='none', facecolor='#E5292B'
+            ))
+
+    def _draw_walls(self):
+        x = self.x
+        face = '#FFFFFF' if self.kind == 'tables' else (1, 1, 1, 0.8)
+        walls = zip(x['wall_x'], x['wall_dx'], x['wall_y'], x['wall_dy'])
+        for wall_x, wall_dx, wall_y, wall_dy in walls:
+            self.ax.add_patch(patches.Rectangle(
+                (wall_x - 1, wall_y - 1), wall_dx, wall_dy, hatch='/',
+                edgecolor='#121212', facecolor=face, zorder=2
+            ))
+
+    def _patch(self, i):
+        while len(self._patches) <= i:
+            if self.kind == 'tables':
+                patch = patches.Rectangle((0, 0), 0, 0, hatch='\\',
+                                          edgecolor='#7f4224',
+                                          facecolor='#A0522D', zorder=1)
+            else:
+                patch = patches.Rectangle((0, 0), 0, 0, zorder=1)
+            self._patches.append(self.ax.add_patch(patch))
+        return self._patches[i]
+
+    def _room_colors(self, y):
+        x = self.x
+        if 'sub_type' not in x or 'room_type' not in x:
+            return [ROOM_COLORS[i % len(ROOM_COLORS)]
+                    for i in range(len(y['x']))]
+        cp = ColorPicker()
+        return [cp.getc(x['room_type'][sub], sub) for sub in x['sub_type']]
+
+    def draw(self, y, label=''):
+        """Moves the patches to the given layout."""
+        objects = list(zip(y['x'], y['dx'], y['y'], y['dy']))
+        if self.kind == 'rooms':
+            valid = y.get('valid', [True] * len(objects))
+            colors = self._room_colors(y)
+        for i, (obj_x, obj_dx, obj_y, obj_dy) in enumerate(objects):
+            patch = self._patch(i)
+            patch.set_xy((obj_x - 1, obj_y - 1))
+            patch.set_width(obj_dx)
+            patch.set_height(obj_dy)
+            if self.kind == 'rooms':
+                patch.set_visible(bool(valid[i]))
+                patch.set_edgecolor(colors[i])
+                patch.set_facecolor(colors[i])
+            else:
+                patch.set_visible(True)
+        for patch in self._patches[len(objects):]:
+            patch.set_visible(False)
+        self.label.set_text(label)
+        self.label.set_visible(bool(label))
+
+    def render(self, y, output_file=None, label=''):
+        """Renders a layout to a file, or to an RGB array if no file is given."""
+        self.draw(y, label)
+        if output_file is not None:
+            self.fig.savefig(output_file, dpi=self.dpi)
+            return None
+        self.fig.canvas.draw()
+        return np.asarray(self.fig.canvas.buffer_rgba())[:, :, :3].copy()
+
+    def close(self):
+        plt.close(self.fig)
+
+
+class RendererCache(object):
+    """Keeps one renderer per context, so figures are reused across layouts."""
+
+    def __init__(self, kind='tables', dpi=100, size=4.0):
+        self.kind = kind
+        self.dpi = dpi
+        self.size = size
+        self._renderers = {}
+
+    def get(self, x):
+        key = freeze(x)
+        if key not in self._renderers:
+            self._renderers[key] = LayoutRenderer(x, self.kind, self.dpi,
+                                                  self.size)
+        return self._renderers[key]
+
+    def close(self):
+        for renderer in self._renderers.values():
+            renderer.close()
+        self._renderers = {}
+
+
+def contact_sheet(frames, cols=10, pad=4):
+    """Tiles equally sized RGB frames into a single image array."""
+    rows = -(-len(frames) // cols)
+    h, w, c = frames[0].shape
+    sheet = np.full((rows * (h + pad) + pad, cols * (w + pad) + pad, c), 255,
+                    dtype=np.uint8)
+    for i, frame in enumerate(frames):
+        r, q = divmod(i, cols)
+        top, left = pad + r * (h + pad), pad + q * (w + pad)
+        sheet[top:top + h, left:left + w] = frame
+    return sheet
+
+
+def render_trajectory(trajectory, output_dir, kind='tables', mode='sheet',
+                      dpi=100, size=4.0, cols=10, fps=4):
+    """Renders the learning trajectory of a user.
+
+    Parameters
+    ----------
+    trajectory : tuple
+        A tuple (uid, steps) where steps is a list of (it, x, y, reg) tuples.
+    output_dir : str
+        The directory where to write the images.
+    mode : str
+        Either 'frames' (one PNG per iteration), 'sheet' (a contact sheet of
+        the whole trajectory) or 'animation' (an animated GIF).
+
+    Returns
+    -------
+    str
+        The file, or the directory of the frames, written.
+    """
+    uid, steps = trajectory
+    renderers = RendererCache(kind, dpi, size)
+    label = 'it = {}, reg = {:.2f}'
+    try:
+        if mode == 'frames':
+            output = os.path.join(output_dir, 'user_{}'.format(uid))
+            os.makedirs(output, exist_ok=True)
+            for it, x, y, reg in steps:
+                path = os.path.join(output, 'it_{:03d}.png'.format(it))
+                renderers.get(x).render(y, path, label.format(it, reg))
+            return output
+
+        frames = [renderers.get(x).render(y, label=label.format(it, reg))
+                  for it, x, y, reg in steps]
+        if mode == 'sheet':
+            output = os.path.join(output_dir, 'user_{}.png'.format(uid))
+            Image.fromarray(contact_sheet(frames, cols)).save(output)
+        else:
+            output = os.path.join(output_dir, 'user_{}.gif'.format(uid))
+            images = [Image.fromarray(frame) for frame in frames]
+            images[0].save(output, save_all=True, append_images=images[1:],
+                           duration=int(1000 / fps), loop=0)
+        return output
+    finally:
+        renderers.close()
+
+
+def load_trajectories(events_file, domain_file, layout='y', users=None):
+    """Loads the learning trajectories of the users from a trace store.
+
+    Parameters
+    ----------
+    events_file : str
+        The event log of a simulation.
+    domain_file : str
+        The shelf of the domain of the simulation, holding its contexts.
+    layout : str
+        The layouts to load, either 'y' (the inferred objects) or 'y_bar'
+        (the user improvements).
+    users : list of int
+        The users to load. If None, all the users are loaded.
+
+    Returns
+    -------
+    tuple
+        The kind of layouts ('tables' or 'rooms') and the list of
+        trajectories, see `render_trajectory`.
+    """
+    if ECML18_DIR not in sys.path:
+        sys.path.append(ECML18_DIR)
+    from cls.events import load_events
+
+    with shelve.open(domain_file, 'r') as shelf:
+        domain = shelf['domain']
+    kind = type(domain).__name__.lower()
+
+    events, layouts = load_events(events_file, fields=['uid', 'it', 'x_id',
+                                                       'reg'], layouts=True)
+    index = 0 if layout == 'y' else 1
+    trajectories = {}
+    for event, ys in zip(events, layouts):
+        uid = int(event['uid'])
+        if (users is not None and uid not in users) or ys[index] is None:
+            continue
+        x = domain.contexts[event['x_id']]
+        trajectories.setdefault(uid, []).append(
+            (int(event['it']), x, ys[index], float(event['reg']))
+        )
+    return kind, sorted(trajectories.items())
+
+
+def _render_trajectory(args):
+    trajectory, kwargs = args
+    return render_trajectory(trajectory, **kwargs)
+
+
+def render_all(trajectories, output_dir, jobs=4, **kwargs):
+    """Renders the trajectories on a pool of processes."""
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(trajectory, {'output_dir': output_dir, **kwargs})
+             for trajectory in trajectories]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(_render_trajectory, tasks))
+
+
+if __name__ == '__main__':
+    fmt_class = argparse.ArgumentDefaultsHelpFormatter
+    parser = argparse.ArgumentParser(formatter_class=fmt_class)
+
+    parser.add_argument('events_file',
+                        help='The event log of the simulation')
+    parser.add_argument('-D', '--domain-file', required=True,
+                        help='The domain shelf of the simulation')
+    parser.add_argument('-o', '--output-dir', default='renders',
+                        help='The directory where to write the images')
+    parser.add_argument('-m', '--mode', default='sheet',
+                        choices=['frames', 'sheet', 'animation'],
+                        help='What to render for each user')
+    parser.add_argument('-l', '--layout', default='y', choices=['y', 'y_bar'],
+                        help='Render the inferred or the improved layouts')
+    parser.add_argument('-u', '--users', type=int, nargs='+',
+                        help='The users to render, all if not given')
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help='The number of rendering processes')
+    parser.add_argument('--dpi', type=int, default=100,
+                        help='The resolution of the images')
+    parser.add_argument('--cols', type=int, default=10,
+                        help='The number of columns of the contact sheets')
+    parser.add_argument('--fps', type=float, default=4,
+                        help='The frame rate of the animations')
+    args = parser.parse_args()
+
+    kind, trajectories = load_trajectories(args.events_file, args.domain_file,
+                                           layout=args.layout,
+                                           users=args.users)
+    outputs = render_all(trajectories, args.output_dir, jobs=args.jobs,
+                         kind=kind, mode=args.mode, dpi=args.dpi,
+                         cols=args.cols, fps=args.fps)
+    for output in outputs:
+        print(output)
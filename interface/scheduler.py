@@ -0,0 +1,203 @@
+
+import time
+import heapq
+import itertools
+import threading
+import numpy as np
+
+from collections import deque
+from concurrent.futures import Future
+
+
+# The priorities of the solves, lower runs first
+INTERACTIVE, BACKGROUND = 0, 1
+
+PRIORITIES = {'interactive': INTERACTIVE, 'background': BACKGROUND}
+
+
+class _Job(object):
+
+    def __init__(self, key, fn, args, kwargs, priority):
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.futures = []
+        self.submitted = []
+
+
+class Scheduler(object):
+    """Priority scheduler of the solves of many sessions on a core budget.
+
+    At most `num_cores` solves run at once. Interactive solves always run
+    before the queued background ones, and `reserved` cores are kept free of
+    background solves, so that a user never waits for a precomputation.
+
+    Solves with the same key that are queued together are batched into a
+    single solve, whose result is given to all of them; a background solve
+    joined by an interactive one is promoted to interactive.
+
+    Parameters
+    ----------
+    num_cores : int
+        The number of solves that can run at once.
+    reserved : int
+        The number of cores reserved to interactive solves. Defaults to one
+        if there is more than one core, zero otherwise.
+    window : int
+        The number of latencies kept to compute the percentiles.
+    """
+    def __init__(self, num_cores=2, reserved=None, window=10000):
+        if reserved is None:
+            reserved = 1 if num_cores > 1 else 0
+        self.num_cores = num_cores
+        self.reserved = min(reserved, num_cores - 1)
+        self._heap = []
+        self._pending = {}
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._running = [0, 0]
+        self._closed = False
+        self._latencies = {p: deque(maxlen=window) for p in PRIORITIES}
+        self._counts = {'solves': 0, 'batched': 0, 'promoted': 0}
+        self._threads = []
+        for _ in range(num_cores):
+            thread = threading.Thread(target=self._run, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _push(self, job):
+        heapq.heappush(self._heap, (job.priority, next(self._counter), job))
+
+    def _pop(self):
+        """Pops the next job that can run, None if none can."""
+        while self._heap:
+            priority, _, job = self._heap[0]
+            if job.priority != priority:
+                # A stale entry of a promoted job
+                heapq.heappop(self._heap)
+                continue
+            if priority == BACKGROUND and not self._closed:
+                busy = sum(self._running)
+                if busy >= self.num_cores - self.reserved:
+                    return None
+            heapq.heappop(self._heap)
+            if job.key is not None:
+                self._pending.pop(job.key, None)
+            return job
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                job = self._pop()
+                while job is None and not self._closed:
+                    self._cond.wait()
+                    job = self._pop()
+                if job is None:
+                    return
+                self._running[job.priority] += 1
+            try:
+                result = job.fn(*job.args, **job.kwargs)
+            except Exception as e:
+                result, error = None, e
+            else:
+                error = None
+            done = time.perf_counter()
+            with self._cond:
+                self._running[job.priority] -= 1
+                self._counts['solves'] += 1
+                for future, submitted in zip(job.futures, job.submitted):
+                    name = 'interactive' if submitted[1] == INTERACTIVE \
+                        else 'background'
+                    self._latencies[name].append(done - submitted[0])
+                self._cond.notify_all()
+            for future in job.futures:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+    def submit(self, fn, *args, key=None, priority=INTERACTIVE, **kwargs):
+        """Schedules a solve.
+
+        Parameters
+        ----------
+        fn : callable
+            The solve, called with the other arguments.
+        key : hashable
+            The key of the solve. Queued solves with the same key are batched.
+            None if the solve cannot be batched.
+        priority : int
+            Either INTERACTIVE or BACKGROUND.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            The future result of the solve.
+        """
+        future = Future()
+        submitted = (time.perf_counter(), priority)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('The scheduler is closed')
+            job = self._pending.get(key) if key is not None else None
+            if job is None:
+                job = _Job(key, fn, args, kwargs, priority)
+                if key is not None:
+                    self._pending[key] = job
+                self._push(job)
+            else:
+                self._counts['batched'] += 1
+                if priority < job.priority:
+                    job.priority = priority
+                    self._counts['promoted'] += 1
+                    self._push(job)
+            job.futures.append(future)
+            job.submitted.append(submitted)
+            self._cond.notify()
+        return future
+
+    def run(self, fn, *args, key=None, priority=INTERACTIVE, **kwargs):
+        """Schedules a solve and waits for its result."""
+        return self.submit(fn, *args, key=key, priority=priority,
+                           **kwargs).result()
+
+    def latency(self, percentiles=(50, 99)):
+        """The percentiles of the latencies of the solves, in seconds.
+
+        The latency of a solve goes from its submission to its result, so it
+        includes the time spent in the queue.
+        """
+        with self._cond:
+            latencies = {name: list(values)
+                         for name, values in self._latencies.items()}
+        stats = {}
+        for name, values in latencies.items():
+            stats[name] = {'count': len(values)}
+            for p in percentiles:
+                stats[name]['p{}'.format(p)] = \
+                    float(np.percentile(values, p)) if values else None
+        return stats
+
+    def stats(self):
+        with self._cond:
+            queued = [0, 0]
+            for priority, _, job in self._heap:
+                if job.priority == priority:
+                    queued[priority] += 1
+            return {'cores': self.num_cores, 'reserved': self.reserved,
+                    'running': {'interactive': self._running[INTERACTIVE],
+                                'background': self._running[BACKGROUND]},
+                    'queued': {'interactive': queued[INTERACTIVE],
+                               'background': queued[BACKGROUND]},
+                    **self._counts, 'latency': self.latency()}
+
+    def close(self):
+        """Stops the scheduler once the queued solves are done."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import uuid
+import shelve
+import argparse
+import threading
+import numpy as np
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from coactive import Domain
+from pool import SolverPool
+from scheduler import Scheduler, INTERACTIVE, BACKGROUND
+from solverkit.service import to_json
+
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+
+# The experiments package, needed to serve the domains of its shelves
+ECML18_DIR = os.path.join(DIR, '..', 'ecml18')
+
+# The number of features of the domains of the interface
+FEATURES = {'tables': 10, 'rooms': 45}
+
+
+class ServiceError(Exception):
+    """An invalid request, reported to the client with the given status."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _key(*args):
+    """A hashable key of the arguments of a solve, to batch equal solves."""
+    return json.dumps(args, sort_keys=True, default=to_json)
+
+
+class Session(object):
+    """The state of a client: its domain, its weights and its last context."""
+
+    def __init__(self, sid, domain_key, domain, w, num_updates=0):
+        self.sid = sid
+        self.domain_key = domain_key
+        self.domain = domain
+        self.w = w
+        self.num_updates = num_updates
+        self.x = None
+        self.lock = threading.Lock()
+
+    def state(self):
+        """The persistent state of the session."""
+        return {'domain_key': self.domain_key, 'w': self.w,
+                'num_updates': self.num_updates}
+
+
+class LayoutService(object):
+    """Layout synthesis backend shared by many concurrent sessions.
+
+    Domains are loaded once and shared by all the sessions using them, so
+    their caches and the solver workers stay warm across clients and runs.
+    The domains of the interface (e.g. 'tables') solve on a `SolverPool`,
+    while the domains of the ecml18 shelves solve on the `cls.solver` pool.
+
+    The solves of all the sessions go through a `Scheduler` limited to
+    `num_workers` cores. The solves asked by the users are interactive; after
+    each update, the layout of the new weights for the last context of the
+    session is precomputed in background, as are the solves asked with
+    `prefetch`. The weights of the sessions are saved to `state_file`, if
+    given, and the sessions are restored from it on start.
+
+    The shelves of the ecml18 domains are unpickled, so only those under
+    `domains_dir` are served: the domain files asked by the clients are
+    resolved in it, and the paths leading out of it are refused.
+
+    Parameters
+    ----------
+    num_workers : int
+        The number of solver worker processes, i.e. the solver core budget.
+    state_file : str
+        The shelf where to persist the sessions, None to keep them in memory.
+    domains_dir : str
+        The directory of the ecml18 domain shelves served, None to serve only
+        the domains of the interface.
+    """
+    def __init__(self, num_workers=2, state_file=None, domains_dir=None):
+        self.num_workers = num_workers
+        self.domains_dir = (os.path.realpath(domains_dir)
+                            if domains_dir is not None else None)
+        self.pool = SolverPool(num_workers)
+        self.scheduler = Scheduler(num_workers)
+        self.state_file = state_file
+        self._domains = {}
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        if state_file is not None:
+            self._restore()
+
+    def _domain_path(self, domain_file):
+        """The path of a domain shelf, which must be under domains_dir."""
+        if self.domains_dir is None:
+            raise ServiceError('Domain files are not served', 403)
+        path = os.path.realpath(os.path.join(self.domains_dir, domain_file))
+        if os.path.commonpath([path, self.domains_dir]) != self.domains_dir:
+            raise ServiceError('Domain file outside of the domains '
+                               'directory: {}'.format(domain_file), 403)
+        return path
+
+    def _load_domain(self, domain=None, domain_file=None):
+        if domain_file is not None:
+            path = self._domain_path(domain_file)
+            if ECML18_DIR not in sys.path:
+                sys.path.append(ECML18_DIR)
+            from cls.solver import start_pool, _pool
+            if _pool['pool'] is None:
+                start_pool(self.num_workers)
+            with shelve.open(path, 'r') as shelf:
+                return shelf['domain']
+        if domain not in FEATURES:
+            raise ServiceError('Unknown domain: {}'.format(domain))
+        models = os.path.join(DIR, domain)
+        return Domain(os.path.join(models, 'phi.mzn'),
+                      os.path.join(models, 'infer.mzn'),
+                      os.path.join(models, 'improve.mzn'),
+                      FEATURES[domain], pool=self.pool)
+
+    def domain(self, domain=None, domain_file=None):
+        """Returns a domain, loading it on first use."""
+        key = domain_file or domain
+        with self._lock:
+            if key not in self._domains:
+                self._domains[key] = self._load_domain(domain, domain_file)
+            return self._domains[key]
+
+    def _domain_args(self, domain_key):
+        if domain_key in FEATURES:
+            return {'domain': domain_key}
+        return {'domain_file': domain_key}
+
+    def _save(self, session):
+        if self.state_file is None:
+            return
+        with self._state_lock, shelve.open(self.state_file) as shelf:
+            shelf[session.sid] = session.state()
+
+    def _forget(self, sid):
+        if self.state_file is None:
+            return
+        with self._state_lock, shelve.open(self.state_file) as shelf:
+            shelf.pop(sid, None)
+
+    def _restore(self):
+        with self._state_lock, shelve.open(self.state_file) as shelf:
+            states = dict(shelf)
+        for sid, state in states.items():
+            try:
+                domain = self.domain(**self._domain_args(state['domain_key']))
+            except (ServiceError, OSError, KeyError):
+                continue
+            self._sessions[sid] = Session(sid, state['domain_key'], domain,
+                                          state['w'], state['num_updates'])
+
+    def session(self, sid):
+        with self._lock:
+            if sid not in self._sessions:
+                raise ServiceError('Unknown session: {}'.format(sid), 404)
+            return self._sessions[sid]
+
+    def open_session(self, domain=None, domain_file=None, w=None, seed=None):
+        """Opens a session, returns its id and initial weights."""
+        _domain = self.domain(domain, domain_file)
+        if w is None:
+            w = np.random.RandomState(seed).normal(size=_domain.num_features)
+        sid = uuid.uuid4().hex
+        s = Session(sid, domain_file or domain, _domain,
+                    np.array(w, dtype=np.float64))
+        with self._lock:
+            self._sessions[sid] = s
+        self._save(s)
+        return {'session': sid, 'w': s.w}
+
+    def resume_session(self, session):
+        """Returns the weights of a session, e.g. after a restart."""
+        s = self.session(session)
+        return {'session': s.sid, 'w': s.w, 'num_updates': s.num_updates}
+
+    def close_session(self, session):
+        with self._lock:
+            self._sessions.pop(session, None)
+        self._forget(session)
+        return {}
+
+    def _infer(self, s, x, w, priority, **kwargs):
+        key = _key('infer', s.domain_key, x, w, kwargs)
+        return self.scheduler.submit(s.domain.infer, x, w, key=key,
+                                     priority=priority, **kwargs)
+
+    def infer(self, session, x, w=None, **kwargs):
+        """The optimal layout for x, with the session weights if w is None."""
+        s = self.session(session)
+        w = s.w if w is None else np.array(w, dtype=np.float64)
+        s.x = x
+        return {'y': self._infer(s, x, w, INTERACTIVE, **kwargs).result()}
+
+    def prefetch(self, session, x, w=None, **kwargs):
+        """Precomputes in background the layout for x, without waiting."""
+        s = self.session(session)
+        w = s.w if w is None else np.array(w, dtype=np.float64)
+        self._infer(s, x, w, BACKGROUND, **kwargs)
+        return {}
+
+    def improve(self, session, x, phi, changed):
+        s = self.session(session)
+        if not hasattr(s.domain, 'improve'):
+            raise ServiceError('The domain does not support improve')
+        phi = np.array(phi, dtype=np.int32)
+        key = _key('improve', s.domain_key, x, phi, changed)
+        return {'y': self.scheduler.run(s.domain.improve, x, phi, changed,
+                                        key=key)}
+
+    def phi(self, session, x, y, **kwargs):
+        s = self.session(session)
+        key = _key('phi', s.domain_key, x, y, kwargs)
+        return {'phi': self.scheduler.run(s.domain.phi, x, y, key=key,
+                                          **kwargs)}
+
+    def update(self, session, x=None, y=None, y_bar=None, phi=None,
+               phi_bar=None):
+        """Updates the session weights, from layouts or feature vectors."""
+        s = self.session(session)
+        if phi is None:
+            phi = self.phi(session, x, y)['phi']
+        if phi_bar is None:
+            phi_bar = self.phi(session, x, y_bar)['phi']
+        with s.lock:
+            s.w = s.w + (np.asarray(phi_bar) - np.asarray(phi))
+            s.num_updates += 1
+            w = s.w
+            self._save(s)
+        if x is not None or s.x is not None:
+            # The next layout the user will likely ask for
+            self._infer(s, x if x is not None else s.x, w, BACKGROUND)
+        return {'w': w}
+
+    def stats(self):
+        with self._lock:
+            stats = {'sessions': len(self._sessions),
+                     'domains': sorted(self._domains)}
+        return {**stats, 'scheduler': self.scheduler.stats()}
+
+    def close(self):
+        self.scheduler.close()
+        self.pool.close()
+        if ECML18_DIR in sys.path:
+            from cls.solver import stop_pool
+            stop_pool()
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """JSON over HTTP: POST /<method> with the keyword arguments as body."""
+
+    methods = {'session': 'open_session', 'resume': 'resume_session',
+               'close': 'close_session', 'infer': 'infer',
+               'prefetch': 'prefetch', 'improve': 'improve', 'phi': 'phi',
+               'update': 'update', 'stats': 'stats'}
+
+    def _reply(self, status, body):
+        data = json.dumps(body, default=to_json).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        method = self.methods.get(self.path.strip('/'))
+        if method is None:
+            self._reply(404, {'error': 'Unknown method: {}'.format(self.path)})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            kwargs = json.loads(self.rfile.read(length) or b'{}')
+            result = getattr(self.server.service, method)(**kwargs)
+        except ServiceError as e:
+            self._reply(e.status, {'error': str(e)})
+        except (TypeError, ValueError) as e:
+            self._reply(400, {'error': repr(e)})
+        except Exception as e:
+            self._reply(500, {'error': repr(e)})
+        else:
+            self._reply(200, result)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def serve(host='127.0.0.1', port=8765, num_workers=2, state_file=None,
+          domains_dir=None):
+    """Runs the service until interrupted."""
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = LayoutService(num_workers, state_file, domains_dir)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.close()
+
+
+if __name__ == '__main__':
+    fmt_class = argparse.ArgumentDefaultsHelpFormatter
+    parser = argparse.ArgumentParser(formatter_class=fmt_class)
+
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='The address to listen on')
+    parser.add_argument('-p', '--port', type=int, default=8765,
+                        help='The port to listen on')
+    parser.add_argument('-w', '--workers', type=int, default=2,
+                        help='The number of solver worker processes, i.e. the '
+                             'number of solves running at once')
+    parser.add_argument('-s', '--state-file',
+                        help='The shelf where to persist the sessions')
+    parser.add_argument('-d', '--domains-dir',
+                        help='The directory of the ecml18 domain shelves to '
+                             'serve, none are served if not given')
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.workers, args.state_file,
+          args.domains_dir)
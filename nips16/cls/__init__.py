@@ -1,4 +1,14 @@
+import os
+import sys
+
+# The solver pool and governor are shared by the packages of the repository,
+# see solverkit at its root
+_root = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if _root not in sys.path:
+    sys.path.append(_root)
+
 
 from . import utils
 from . import coactive
 from . import furniture
+from . import governor
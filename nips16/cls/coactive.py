@@ -1,10 +1,18 @@
 # -*- encoding: utf-8 -*-
 
+import pymzn
 import numpy as np
 
 from time import time
 from cls.utils import get_logger, array2str, x2str
 from functools import partial
+from collections import Counter
+from cls.pool import SolverError
+
+
+# The errors of the solves, supervised or not
+SOLVE_ERRORS = (SolverError, pymzn.MiniZincError)
+
 
 class Problem(object):
     """Base class for all problems.
@@ -113,7 +121,14 @@ class User(object):
                                     approx=approx)
 
 
-def pp(problem, user, max_iters=100, approx=False):
+def _outcomes_since(problem, outcomes0):
+    """Abnormal solve outcomes of the problem since outcomes0, updated."""
+    outcomes = Counter(getattr(problem, 'outcomes', {})) - outcomes0
+    outcomes0.update(outcomes)
+    return dict(outcomes)
+
+
+def pp(problem, user, max_iters=100, approx=False, trace=None):
     """The Preference Perceptron [1]_.
 
     This is a context-less implementation, used for preference elicitation.
@@ -129,11 +144,18 @@ def pp(problem, user, max_iters=100, approx=False):
         The user of the perceptron.
     max_iters : positive int
         Number of iterations.
+    trace : list
+        The list where to append the trace, so that the caller keeps it if
+        the simulation raises. A new list if None.
 
     Returns
     -------
     trace : list of tuples
-        List of (loss, time) pairs for all iterations.
+        List of (loss, time, w, outcomes) tuples for all iterations, where
+        outcomes are the abnormal outcomes of the solves of the iteration, see
+        `Furniture.outcomes`. A failed solve stops the user, as it would fail
+        again with the same weights: its iteration is the last of the trace,
+        with a NaN loss.
 
     References
     ----------
@@ -141,24 +163,41 @@ def pp(problem, user, max_iters=100, approx=False):
     """
     log = get_logger(__name__)
 
-    user.init()
     uid = user.uid
+    trace = [] if trace is None else trace
+    try:
+        user.init()
+    except SOLVE_ERRORS as e:
+        log.warning('uid = {:>2d}, stopped, optimal solve failed: {!r}',
+                    uid, e)
+        return trace
 
     msg_base = 'uid = {:>2d}, it = {:>2d}'
     msg_it = msg_base + ', reg = {:>7.3f}, t = {:>7.3f}'
     msg_kv = msg_base + ', {} = {}'
 
     w = problem.init_w()
-    trace = []
+    outcomes0 = Counter(getattr(problem, 'outcomes', {}))
     for it in range(max_iters):
         log.debug(msg_kv, user.uid, it, 'w', w)
 
         # Inference
         t0 = time()
-        x = problem.infer(w, approx=approx)
-        t_infer = time() - t0
-        u_x = user.utility(x)
-        phi_x = problem.phi(x)
+        try:
+            x = problem.infer(w, approx=approx)
+            t_infer = time() - t0
+            u_x = user.utility(x)
+            phi_x = problem.phi(x)
+            if user.regret(x) != 0.0:
+                t1 = time()
+                x_bar = user.improve(x, approx=approx)
+                t_improve = time() - t1
+                phi_x_bar = problem.phi(x_bar)
+        except SOLVE_ERRORS as e:
+            log.warning(msg_kv, uid, it, 'stopped, solve failed', repr(e))
+            outcomes = _outcomes_since(problem, outcomes0)
+            trace.append((np.nan, time() - t0, w.copy(), outcomes))
+            break
         log.debug(msg_kv, uid, it, 'x', partial(x2str, x))
         log.debug(msg_kv, uid, it, 'phi_x', partial(array2str, phi_x))
         log.debug(msg_kv, uid, it, 'u_x', u_x)
@@ -169,15 +208,12 @@ def pp(problem, user, max_iters=100, approx=False):
 
         if regret == 0.0:
             log.debug('outcome: user satisfied')
-            trace.append((regret, t_infer, w.copy()))
+            outcomes = _outcomes_since(problem, outcomes0)
+            trace.append((regret, t_infer, w.copy(), outcomes))
             print(msg_it.format(uid, it, regret, t_infer))
             break
 
-        # Improvement
-        t1 = time()
-        x_bar = user.improve(x, approx=approx)
-        t_improve = time() - t1
-        phi_x_bar = problem.phi(x_bar)
+        # Improvement, solved above with the other solves
         u_x_bar = user.utility(x_bar)
         log.debug(msg_kv, uid, it, 'x_bar', partial(x2str, x_bar))
         log.debug(msg_kv, uid, it, 'phi_x_bar', partial(array2str, phi_x_bar))
@@ -193,7 +229,8 @@ def pp(problem, user, max_iters=100, approx=False):
         t_elapsed = t_infer + t_update
         log.debug(msg_kv, uid, it, 't_elapsed', t_elapsed)
 
-        trace.append((regret, t_elapsed, w.copy()))
+        outcomes = _outcomes_since(problem, outcomes0)
+        trace.append((regret, t_elapsed, w.copy(), outcomes))
         print(msg_it.format(uid, it, regret, t_elapsed))
 
     else:
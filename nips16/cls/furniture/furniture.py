@@ -1,10 +1,42 @@
 # -*- encoding: utf-8 -*-
 
+import os
 import pymzn
+import shutil
 import numpy as np
 
+from collections import Counter
+
 from cls.utils import freeze, input_x, input_star_x
 from cls.coactive import Problem
+from cls.governor import get_governor
+from cls.pool import SolverPool, SolverError
+from solverkit.supervision import UNSAT_ERRORS, supervised_solve
+
+
+# Overrides of the arguments of the retries of a crashed solve: the first retry
+# runs the same solve again, the second switches to Gecode
+FALLBACKS = [{}, {'fzn_fn': 'gecode', 'mzn_globals_dir': 'gecode'}]
+
+_supervisor = {'pool': None, 'pid': None}
+
+
+def _solve(*args, **kwargs):
+    """Solves with pymzn, holding a solver token if governed."""
+    if isinstance(kwargs.get('fzn_fn'), str):
+        kwargs['fzn_fn'] = getattr(pymzn, kwargs['fzn_fn'])
+    governor = get_governor()
+    if governor is None:
+        return pymzn.minizinc(*args, **kwargs)
+    with governor.acquire(1):
+        return pymzn.minizinc(*args, **kwargs)
+
+
+def _supervisor_pool():
+    if _supervisor['pid'] != os.getpid():
+        _supervisor['pool'] = SolverPool(1, target=_solve)
+        _supervisor['pid'] = os.getpid()
+    return _supervisor['pool']
 
 
 class Furniture(Problem):
@@ -18,12 +50,13 @@ class Furniture(Problem):
         The number of tables.
     """
 
-    infer_model = 'cls/furniture/infer.mzn'
-    improve_model = 'cls/furniture/improve.mzn'
-    phi_model = 'cls/furniture/phi.mzn'
+    models_dir = os.path.dirname(os.path.realpath(__file__))
+    infer_model = os.path.join(models_dir, 'infer.mzn')
+    improve_model = os.path.join(models_dir, 'improve.mzn')
+    phi_model = os.path.join(models_dir, 'phi.mzn')
 
     def __init__(self, canvas_size=12, num_tables=8, layout=0, timeout=None,
-                 **kwargs):
+                 solver_grace=0, solver_deadline=3600, **kwargs):
         num_features = 10
         super().__init__(num_features)
 
@@ -42,18 +75,49 @@ class Furniture(Problem):
         ]
 
         self.timeout = timeout
+        self.solver_grace = solver_grace
+        self.solver_deadline = solver_deadline
+        self.outcomes = Counter()
+        self._incumbent = None
         self._data = {'SIDE': canvas_size, 'N_TABLES': num_tables,
                       **layouts[layout]}
         self._phis = {}
         self._debug = kwargs['debug']
 
+    def set_workdir(self, workdir):
+        """Uses private copies of the models in the given directory.
+
+        MiniZinc intermediate files (.fzn, .ozn) are written next to the
+        models, so processes solving concurrently need separate directories.
+        """
+        for model in ['infer_model', 'improve_model', 'phi_model']:
+            setattr(self, model, shutil.copy(getattr(self, model), workdir))
+
+    def _minizinc(self, *args, incumbent=None, **kwargs):
+        """Solves with pymzn, supervised if solver_grace is positive.
+
+        Supervised solves run on a worker process, which is killed together
+        with its solver processes if the solve runs solver_grace seconds past
+        its timeout (or solver_deadline if it has none). Crashed solves are
+        retried with the `FALLBACKS`, killed ones return the incumbent if
+        given, otherwise a `cls.pool.SolverError` is raised. The abnormal
+        outcomes are counted in `self.outcomes`, see
+        `solverkit.supervision`.
+        """
+        if not self.solver_grace:
+            return _solve(*args, **kwargs)
+
+        deadline = ((kwargs.get('timeout') or self.solver_deadline) +
+                    self.solver_grace)
+        return supervised_solve(_supervisor_pool(), args, kwargs, deadline,
+                                FALLBACKS, self.outcomes, incumbent=incumbent)
 
     def phi(self, x):
         _frx = freeze(x)
         if _frx in self._phis:
             return self._phis[_frx]
 
-        _phi = pymzn.minizinc(self.phi_model,
+        _phi = self._minizinc(self.phi_model,
                               data={**self._data, **input_x(x)},
                               output_vars=['phi'], serialize=True,
                               mzn_globals_dir='opturion-cpx', keep=True,
@@ -67,15 +131,19 @@ class Furniture(Problem):
             timeout = self.timeout
         else:
             timeout = None
+        # The last inferred object is feasible, used if the solve is killed
+        incumbent = None if self._incumbent is None else [self._incumbent]
         while len(sols) == 0:
-            sols =  pymzn.minizinc(self.infer_model,
-                                   data={**self._data, 'w': w},
-                                   output_vars=['x', 'y', 'dx', 'dy'],
-                                   mzn_globals_dir='opturion-cpx',
-                                   serialize=True, keep=True, 
-                                   fzn_fn=pymzn.opturion, timeout=timeout)
+            sols = self._minizinc(self.infer_model,
+                                  data={**self._data, 'w': w},
+                                  output_vars=['x', 'y', 'dx', 'dy'],
+                                  mzn_globals_dir='opturion-cpx',
+                                  serialize=True, keep=True,
+                                  fzn_fn=pymzn.opturion, timeout=timeout,
+                                  incumbent=incumbent)
             if timeout is not None:
                 timeout *= 2
+        self._incumbent = sols[-1]
         return sols[-1]
 
     def improve(self, x, x_star, w, alpha=0.2, approx=False):
@@ -86,18 +154,20 @@ class Furniture(Problem):
             else:
                 timeout = None
             while len(sols) == 0:
-                sols = pymzn.minizinc(self.improve_model,
+                sols = self._minizinc(self.improve_model,
                                       data={**self._data, **input_x(x), 'w': w,
                                             **input_star_x(x_star),
                                             'ALPHA': alpha},
                                       output_vars=['x', 'y', 'dx', 'dy'],
                                       mzn_globals_dir='opturion-cpx',
                                       serialize=True, keep=True,
-                                      fzn_fn=pymzn.opturion, timeout=timeout)
+                                      fzn_fn=pymzn.opturion, timeout=timeout,
+                                      incumbent=[x])
                 if timeout is not None:
                     timeout *= 2
             return sols[-1]
-        except pymzn.MiniZincUnsatisfiableError:
-            # when no improvement possible for noisy users
+        except UNSAT_ERRORS + (SolverError,):
+            # when no improvement possible for noisy users, or when the solver
+            # keeps crashing
             return x
 
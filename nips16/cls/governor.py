@@ -0,0 +1,4 @@
+# -*- encoding: utf-8 -*-
+
+from solverkit.governor import *
+from solverkit.governor import __all__
@@ -1,24 +1,67 @@
 #!/usr/bin/env python3
 
+import os
 import cls
 import sys
 import pickle
+import shutil
 import logging
 import argparse
-import threading
+import tempfile
 import numpy as np
 
+from functools import partial
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.utils import check_random_state
 
 from cls.utils import subdict
 from cls.coactive import User, pp
 from cls.furniture import Furniture
+from cls.governor import start_governor, stop_governor
+
+
+# RAM-backed directory for the solver intermediate files, if available
+SCRATCH_DIR = '/dev/shm'
 
 
 def make_problem(problem, **kwargs):
     return {'furn': Furniture}[problem](**kwargs)
 
 
+_problem = None
+
+
+def _init_worker(args):
+    """Initializes a worker process with a private working directory."""
+    global _problem
+    scratch = SCRATCH_DIR if os.path.isdir(SCRATCH_DIR) else None
+    workdir = tempfile.mkdtemp(prefix='cls-', dir=scratch)
+    Finalize(None, shutil.rmtree, args=(workdir,),
+             kwargs={'ignore_errors': True}, exitpriority=0)
+    tempfile.tempdir = workdir
+
+    _problem = make_problem(args['problem'], **subdict(args, {'problem'}))
+    _problem.set_workdir(workdir)
+
+
+def _run_user(user, iters=100, approx=False):
+    """Simulates a user, returns its trace so far if the simulation fails.
+
+    A failure is logged rather than raised, which would drop the traces of
+    all the users of the experiment.
+    """
+    user.problem = _problem
+    trace = []
+    try:
+        pp(_problem, user, max_iters=iters, approx=approx, trace=trace)
+    except Exception:
+        logging.getLogger(__name__).exception(
+            'uid = %d, simulation failed after %d iterations', user.uid,
+            len(trace))
+    return trace
+
+
 def gen_weights(args):
     if not args['weights']:
         raise ValueError('Argument weights must be given.')
@@ -37,38 +80,27 @@ def experiment(args):
     rng = check_random_state(args['seed'])
     problem = make_problem(args['problem'], **subdict(args, {'problem'}))
 
+    def user_rng():
+        return check_random_state(rng.randint(np.iinfo(np.int32).max))
+
     if args['weights']:
         with open(args['weights'], 'rb') as f:
             weights = pickle.load(f)
-        users = [User(problem, w_star, uid=uid, noise=args['noise'], rng=rng,
-                 alpha=args['alpha']) for uid, w_star in weights]
+        users = [User(problem, w_star, uid=uid, noise=args['noise'],
+                      rng=user_rng(), alpha=args['alpha'])
+                 for uid, w_star in weights]
     else:
         users = [User(problem, rng.normal(size=(problem.num_features,)),
                       uid=uid, noise=args['noise'], alpha=args['alpha'],
-                      rng=rng) for uid in range(1, args['users'] + 1)]
+                      rng=user_rng()) for uid in range(1, args['users'] + 1)]
 
     approx = args['timeout'] is not None
 
-    traces = []
-    start_user = args['user']
-
-    pd = args['parallel']
-    pdl = (len(users) - start_user) // pd + 1
-    batches = [users[u : u + pdl] for u in range(start_user, len(users), pdl)]
-
-    def _exp(_users):
-        for user in _users:
-            trace = pp(problem, user, max_iters=args['iters'], approx=approx)
-            traces.append(trace)
-
-    threads = []
-    for batch in batches:
-        t = threading.Thread(target=_exp, args=(batch,))
-        t.start()
-        threads.append(t)
-
-    for t in threads:
-        t.join()
+    run = partial(_run_user, iters=args['iters'], approx=approx)
+    with ProcessPoolExecutor(max_workers=args['parallel'],
+                             initializer=_init_worker,
+                             initargs=(args,)) as executor:
+        traces = list(executor.map(run, users[args['user']:]))
 
     with open(args['output_file'], 'wb') as f:
         pickle.dump((args['label'], traces), f)
@@ -110,8 +142,23 @@ if __name__ == '__main__':
                         '(std of normal noise on w_star)'))
     parser.add_argument('-p', '--parallel', type=int, default=4,
                         help=('The parallelism degree'))
+    parser.add_argument('--solver-tokens', type=int, default=None,
+                        help=('The number of solvers allowed to run at once '
+                              'on the machine, shared with the other '
+                              'governed processes; 0 disables the limit, '
+                              'default inherits it from the parent process '
+                              '(e.g. a sweep)'))
     parser.add_argument('--timeout', type=int, default=None,
                         help=('The timeout for opturion'))
+    parser.add_argument('--solver-grace', type=float, default=0,
+                        help=('Supervise the solves: seconds a solve may run '
+                              'past its timeout before being killed (e.g. '
+                              '60); crashed solves are retried and killed '
+                              'ones fall back to the incumbent; 0 disables '
+                              'the supervision'))
+    parser.add_argument('--solver-deadline', type=float, default=3600,
+                        help=('Seconds after which supervised solves without '
+                              'timeout are killed'))
     parser.add_argument('--debug', action='store_true',
                         help='Enable debug logging on screen')
     parser.add_argument('--log', default='cls.log', help='Log file')
@@ -122,5 +169,11 @@ if __name__ == '__main__':
         handlers.append(logging.StreamHandler(sys.stdout))
     logging.basicConfig(level=logging.DEBUG, handlers=handlers)
 
+    # Inherited by the worker processes, see cls.governor
+    if args.solver_tokens == 0:
+        stop_governor()
+    elif args.solver_tokens is not None:
+        start_governor(args.solver_tokens)
+
     {'exp': experiment,
      'gen': gen_weights}[args.method](vars(args))
@@ -0,0 +1,9 @@
+# -*- encoding: utf-8 -*-
+
+""" Solver process management shared by the packages of the repository
+
+The packages (ecml18, nips16 and the interface) add the root of the repository
+to their path and import these modules, directly or through their `cls.pool`
+and `cls.governor` modules. The clients of the layout synthesis service share
+its encoding in `solverkit.service`.
+"""
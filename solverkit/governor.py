@@ -0,0 +1,184 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import time
+import fcntl
+
+
+__all__ = ['GOVERNOR_DIR', 'GOVERNOR_ENV', 'Governor', 'start_governor',
+           'stop_governor', 'get_governor']
+
+
+""" Solver concurrency governor
+
+The solver threads of all the processes running on the machine are allotted
+from a fixed set of tokens, one per core. A token is a file in a shared
+directory, held with an exclusive `flock` for the duration of a solve, so
+tokens are released by the kernel even if the holding process dies. The
+token number is also the core the solve is pinned to.
+
+The governor is configured through an environment variable, so that it is
+inherited by the worker processes and by the processes started by a sweep.
+"""
+
+
+# Directory of the token files, RAM-backed if possible
+GOVERNOR_DIR = os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else '/tmp', 'cls-governor'
+)
+
+# Environment variable holding the governor configuration, as "dir:tokens"
+GOVERNOR_ENV = 'CLS_GOVERNOR'
+
+
+class Grant(object):
+    """A set of tokens held by a solve, released on exit.
+
+    Attributes
+    ----------
+    cores : list of int
+        The cores allotted to the solve, one per token.
+    """
+    def __init__(self, governor, fds, cores, pin):
+        self.governor = governor
+        self.cores = cores
+        self._fds = fds
+        self._pin = pin
+        self._affinity = None
+
+    def __len__(self):
+        return len(self.cores)
+
+    def __enter__(self):
+        if self._pin and self.cores and hasattr(os, 'sched_setaffinity'):
+            # On Linux the affinity is per thread and inherited by the solver
+            # processes started by this thread
+            self._affinity = os.sched_getaffinity(0)
+            try:
+                os.sched_setaffinity(0, self.cores)
+            except OSError:
+                self._affinity = None
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def release(self):
+        if self._affinity is not None:
+            os.sched_setaffinity(0, self._affinity)
+            self._affinity = None
+        for fd in self._fds:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        self._fds = []
+
+
+class Governor(object):
+    """Machine-wide allotment of solver threads.
+
+    Parameters
+    ----------
+    num_tokens : int
+        The number of solver threads that can run at once on the machine.
+        Defaults to the number of usable cores.
+    lock_dir : str
+        The directory of the token files, shared by all the processes.
+    pin : bool
+        Whether to pin the solves to the cores of their tokens.
+    poll_interval : float
+        The seconds between two attempts to get a token when none is free.
+    """
+    def __init__(self, num_tokens=None, lock_dir=GOVERNOR_DIR, pin=True,
+                 poll_interval=0.05):
+        if not num_tokens:
+            num_tokens = _num_cores()
+        self.num_tokens = num_tokens
+        self.lock_dir = lock_dir
+        self.pin = pin
+        self.poll_interval = poll_interval
+        self._cores = sorted(_usable_cores())
+        os.makedirs(lock_dir, exist_ok=True)
+
+    def _try_token(self, token):
+        path = os.path.join(self.lock_dir, 'token-{}'.format(token))
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def _grab(self, num_threads):
+        fds, cores = [], []
+        # Start from a different token in each process to spread the contention
+        start = os.getpid() % self.num_tokens
+        for i in range(self.num_tokens):
+            token = (start + i) % self.num_tokens
+            fd = self._try_token(token)
+            if fd is not None:
+                fds.append(fd)
+                cores.append(self._cores[token % len(self._cores)])
+                if len(fds) == num_threads:
+                    break
+        return fds, cores
+
+    def acquire(self, num_threads=1):
+        """Acquires up to num_threads tokens, waiting for at least one.
+
+        Parameters
+        ----------
+        num_threads : int
+            The number of solver threads the solve would like to use.
+
+        Returns
+        -------
+        Grant
+            The tokens acquired, to be used as a context manager around the
+            solve. Its length is the number of threads the solve may use.
+        """
+        num_threads = max(1, min(num_threads, self.num_tokens))
+        while True:
+            fds, cores = self._grab(num_threads)
+            if fds:
+                return Grant(self, fds, cores, self.pin)
+            time.sleep(self.poll_interval)
+
+
+def _usable_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return os.sched_getaffinity(0)
+    return set(range(os.cpu_count() or 1))
+
+
+def _num_cores():
+    return len(_usable_cores())
+
+
+_governor = {'governor': None, 'config': None}
+
+
+def start_governor(num_tokens=None, lock_dir=GOVERNOR_DIR):
+    """Enables the governor in this process and in its child processes."""
+    if not num_tokens:
+        num_tokens = _num_cores()
+    os.environ[GOVERNOR_ENV] = '{}:{}'.format(lock_dir, num_tokens)
+    return get_governor()
+
+
+def stop_governor():
+    """Disables the governor in this process and in its child processes."""
+    os.environ.pop(GOVERNOR_ENV, None)
+    _governor['governor'] = _governor['config'] = None
+
+
+def get_governor():
+    """Returns the governor configured in the environment, if any."""
+    config = os.environ.get(GOVERNOR_ENV)
+    if not config:
+        return None
+    if config != _governor['config']:
+        lock_dir, num_tokens = config.rsplit(':', 1)
+        _governor['governor'] = Governor(int(num_tokens), lock_dir)
+        _governor['config'] = config
+    return _governor['governor']
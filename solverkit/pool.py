@@ -0,0 +1,246 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import queue
+import signal
+import pickle
+import threading
+import multiprocessing as mp
+
+from concurrent.futures import Future
+
+
+__all__ = ['SolverError', 'SolverTimeoutError', 'SolverCrashError',
+           'SolverPool']
+
+
+class SolverError(Exception):
+    """Base class of the errors raised by the solver pool."""
+
+
+class SolverTimeoutError(SolverError):
+    """A solver job exceeded its timeout and its worker was killed."""
+
+
+class SolverCrashError(SolverError):
+    """A solver worker died while running a job, e.g. on segfault."""
+
+
+_PING = '__ping__'
+
+
+def _worker_main(conn, target):
+    """Main loop of a solver worker process."""
+    # Own process group, so that the solver subprocesses can be killed with it
+    os.setsid()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        args, kwargs = job
+        if args == (_PING,):
+            conn.send(('ok', os.getpid()))
+            continue
+        try:
+            conn.send(('ok', target(*args, **kwargs)))
+        except Exception as e:
+            try:
+                pickle.loads(pickle.dumps(e))
+            except Exception:
+                e = SolverError(repr(e))
+            conn.send(('error', e))
+
+
+class _Worker(object):
+
+    def __init__(self, context, target):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main,
+                                       args=(child_conn, target), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def kill(self):
+        """Kills the worker and all the solver processes it started."""
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, BrokenPipeError):
+            pass
+        self.process.join(1.0)
+        if self.process.is_alive():
+            self.kill()
+
+
+class SolverPool(object):
+    """A pool of long-lived solver worker processes.
+
+    Jobs are put in a queue and dispatched to the first idle worker. Workers
+    stay alive between jobs, keeping the solver modules imported (and, with
+    the solver of `cls.solver`, the model sources and scratch directory warm),
+    so short solves do not pay for the start-up of a new Python process. The
+    start-up of MiniZinc is not saved: each job runs its own `pymzn.minizinc`
+    call, which flattens the model and launches the solver anew.
+    Workers that die (e.g. on segfault) or exceed the timeout of a job are
+    killed, together with their solver subprocesses, and restarted.
+
+    Parameters
+    ----------
+    num_workers : int
+        The number of worker processes.
+    target : callable
+        The function run by the workers for each job. It must be importable
+        by the worker processes. Default is `pymzn.minizinc`.
+    timeout : float
+        The default per-job timeout in seconds, None for no timeout.
+    """
+    def __init__(self, num_workers=2, target=None, timeout=None):
+        if target is None:
+            from pymzn import minizinc as target
+        self.target = target
+        self.timeout = timeout
+        self._context = mp.get_context('spawn')
+        self._jobs = queue.Queue()
+        # Held by the dispatcher of a slot while it runs a job, and around
+        # the restarts of its worker
+        self._slot_locks = [threading.Lock() for _ in range(num_workers)]
+        self._workers = [_Worker(self._context, target)
+                         for _ in range(num_workers)]
+        self._threads = []
+        for slot in range(num_workers):
+            thread = threading.Thread(target=self._dispatch, args=(slot,),
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def num_workers(self):
+        return len(self._workers)
+
+    def _restart(self, slot):
+        """Restarts the worker of a slot, whose lock the caller holds."""
+        self._workers[slot].kill()
+        self._workers[slot] = _Worker(self._context, self.target)
+        return self._workers[slot]
+
+    def _dispatch(self, slot):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            with self._slot_locks[slot]:
+                self._run(slot, *job)
+
+    def _run(self, slot, future, args, kwargs, timeout):
+        """Runs a job on the worker of a slot, restarting it if needed."""
+        if not future.set_running_or_notify_cancel():
+            return
+        worker = self._workers[slot]
+        if not worker.is_alive():
+            worker = self._restart(slot)
+        try:
+            worker.conn.send((args, kwargs))
+            if not worker.conn.poll(timeout):
+                self._restart(slot)
+                future.set_exception(SolverTimeoutError(
+                    'Solver job exceeded {}s'.format(timeout)))
+                return
+            status, value = worker.conn.recv()
+        except (EOFError, OSError):
+            worker.process.join(1.0)
+            exitcode = worker.process.exitcode
+            self._restart(slot)
+            future.set_exception(SolverCrashError(
+                'Solver worker died with exit code {}'.format(exitcode)))
+            return
+        if status == 'ok':
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    def submit(self, *args, job_timeout=-1, **kwargs):
+        """Submits a job to the pool.
+
+        The arguments are passed to the target function of the workers.
+
+        Parameters
+        ----------
+        job_timeout : float
+            The timeout of the job in seconds, None for no timeout. Defaults to
+            the timeout of the pool.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            The future result of the job.
+        """
+        if job_timeout == -1:
+            job_timeout = self.timeout
+        future = Future()
+        self._jobs.put((future, args, kwargs, job_timeout))
+        return future
+
+    def solve(self, *args, job_timeout=-1, **kwargs):
+        """Runs a job on the pool and waits for its result."""
+        return self.submit(*args, job_timeout=job_timeout, **kwargs).result()
+
+    def check_health(self, timeout=5.0):
+        """Checks the workers, restarting the dead or unresponsive ones.
+
+        Dead workers are restarted right away, then each worker is pinged
+        through the job queue; a worker not answering within the timeout is
+        restarted by its dispatcher.
+
+        Returns
+        -------
+        list of bool
+            For each worker, whether it was alive.
+        """
+        health = []
+        for slot, lock in enumerate(self._slot_locks):
+            health.append(self._workers[slot].is_alive())
+            # A busy slot is left to its dispatcher, which restarts its
+            # worker if it dies during the job
+            if not health[-1] and lock.acquire(blocking=False):
+                try:
+                    if not self._workers[slot].is_alive():
+                        self._restart(slot)
+                finally:
+                    lock.release()
+        pings = [self.submit(_PING, job_timeout=timeout)
+                 for _ in range(self.num_workers)]
+        for ping in pings:
+            try:
+                ping.result()
+            except SolverError:
+                pass
+        return health
+
+    def close(self):
+        """Stops the workers once the queued jobs are done."""
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+        for worker in self._workers:
+            worker.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
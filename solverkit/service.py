@@ -0,0 +1,57 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import numpy as np
+import urllib.error
+import urllib.request
+
+
+__all__ = ['to_json', 'call_service']
+
+
+""" Service calls
+
+The layout synthesis service (interface/server.py) speaks JSON over HTTP: the
+keyword arguments of a method are POSTed to /<method> as a JSON object, and
+the reply is the JSON object of its results, or of its error. The numpy values
+are encoded as lists and numbers.
+"""
+
+
+def to_json(obj):
+    """JSON encoding of the numpy values, for `json.dumps`."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    raise TypeError('Cannot encode {} to JSON'.format(type(obj)))
+
+
+def call_service(url, method, **kwargs):
+    """Calls a method of the service, returns its results.
+
+    Parameters
+    ----------
+    url : str
+        The address of the service, e.g. http://127.0.0.1:8765.
+    method : str
+        The method, e.g. 'infer'.
+
+    Raises
+    ------
+    RuntimeError
+        With the error reported by the service, if any.
+    """
+    data = json.dumps(kwargs, default=to_json).encode('utf-8')
+    request = urllib.request.Request(
+        '{}/{}'.format(url.rstrip('/'), method), data=data,
+        headers={'Content-Type': 'application/json'}
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        error = json.loads(e.read() or b'{}').get('error', str(e))
+        raise RuntimeError('Service error: {}'.format(error)) from None
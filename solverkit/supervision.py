@@ -0,0 +1,97 @@
+# -*- encoding: utf-8 -*-
+
+import pymzn
+import logging
+
+from solverkit.pool import SolverCrashError, SolverTimeoutError
+
+
+__all__ = ['UNSAT_ERRORS', 'unsatisfiable', 'crashed', 'supervised_solve']
+
+
+""" Supervision
+
+Supervised solves run on a solver pool, whose workers are killed together
+with their solver processes when a solve exceeds its hard deadline. A solve
+whose worker or solver crashed is retried with the given fallbacks, while a
+solve past its deadline returns the incumbent given by the caller, if any.
+"""
+
+
+# The errors raised on unsatisfiable problems: pymzn < 0.13 raises
+# MiniZincUnsatisfiableError, later versions return no solutions instead
+UNSAT_ERRORS = tuple(filter(None, [
+    getattr(pymzn, 'MiniZincUnsatisfiableError', None)
+]))
+
+
+def unsatisfiable(error):
+    """Whether a solver error reports an unsatisfiable problem."""
+    if isinstance(error, UNSAT_ERRORS):
+        return True
+    return 'UNSATISFIABLE' in (getattr(error, 'stderr', None) or '')
+
+
+def crashed(error):
+    """Whether a solver error is a crash, to be retried."""
+    if isinstance(error, SolverCrashError):
+        return True
+    return isinstance(error, pymzn.MiniZincError) and not unsatisfiable(error)
+
+
+def supervised_solve(pool, args, kwargs, deadline, fallbacks, outcomes,
+                     incumbent=None):
+    """Runs a solve on a pool, retrying it if it crashes.
+
+    Parameters
+    ----------
+    pool : solverkit.pool.SolverPool
+        The pool running the solve.
+    args : tuple
+        The positional arguments of the solve.
+    kwargs : dict
+        The keyword arguments of the solve.
+    deadline : float
+        The seconds after which the solve is killed.
+    fallbacks : list of dict
+        The overrides of the keyword arguments of each retry.
+    outcomes : collections.Counter
+        The counters of the abnormal outcomes: 'timeout', 'crash', 'retried'
+        (succeeded after a crash), 'incumbent' (answered with the incumbent
+        after a timeout) and 'failed'.
+    incumbent : object
+        The result returned if the solve is killed. If None, a
+        `SolverTimeoutError` is raised.
+    """
+    log = logging.getLogger(__name__)
+    attempts = [{}] + list(fallbacks)
+    for i, overrides in enumerate(attempts):
+        try:
+            result = pool.solve(*args, job_timeout=deadline,
+                                **{**kwargs, **overrides})
+        except SolverTimeoutError:
+            outcomes['timeout'] += 1
+            if incumbent is None:
+                outcomes['failed'] += 1
+                raise
+            log.warning('Solve killed after %ss, using the incumbent',
+                        deadline)
+            outcomes['incumbent'] += 1
+            return incumbent
+        except Exception as e:
+            if not crashed(e):
+                raise
+            outcomes['crash'] += 1
+            if i + 1 == len(attempts):
+                outcomes['failed'] += 1
+                if isinstance(e, SolverCrashError):
+                    raise
+                raise SolverCrashError(repr(e)) from e
+            retry = ', '.join('{} = {}'.format(*item)
+                              for item in attempts[i + 1].items())
+            log.warning('Solve crashed (%r), retrying with %s', e,
+                        retry or 'the same arguments')
+            continue
+        if i > 0:
+            outcomes['retried'] += 1
+        return result